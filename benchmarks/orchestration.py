@@ -0,0 +1,306 @@
+#!/usr/bin/env python
+"""
+Measure the orchestration overhead of build_pyoptsparse without a network or real compilers.
+
+Local bare git repositories stand in for every build_info entry. Their configure scripts
+write Makefiles that only sleep and create the files a real build would install, and stub
+compilers and a stub 'python -m pip' are placed first in the PATH. With the default
+durations of zero, the measured wall time is the overhead of the driver itself.
+
+Examples:
+    python benchmarks/orchestration.py
+    python benchmarks/orchestration.py --make-seconds 2 --output new.json --baseline old.json
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+REPO_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_DIR))
+import build_pyoptsparse as bp
+
+# Command line arguments for each measured combination of solver and options
+SCENARIOS = {
+    'mumps': [],
+    'mumps-paropt-snopt': ['--paropt', '--snopt-dir', '{snopt_dir}'],
+    'hsl': ['--linear-solver', 'hsl', '--hsl-tar-file', '{hsl_tar_file}'],
+    'hsl-paropt-snopt': ['--linear-solver', 'hsl', '--hsl-tar-file', '{hsl_tar_file}',
+                         '--paropt', '--snopt-dir', '{snopt_dir}'],
+    'mumps+hsl': ['--linear-solver', 'mumps+hsl', '--hsl-tar-file', '{hsl_tar_file}'],
+    'pardiso': ['--linear-solver', 'pardiso'],
+    'pardiso-paropt-snopt': ['--linear-solver', 'pardiso', '--paropt', '--snopt-dir', '{snopt_dir}'],
+}
+
+# Runs perform_install() in a clean interpreter with the URLs pointed at the local repos
+DRIVER = """
+import json, sys
+sys.path.insert(0, sys.argv[1])
+import build_pyoptsparse as bp
+for key, url in json.loads(sys.argv[2]).items():
+    bp.build_info[key]['url'] = url
+sys.argv = ['build_pyoptsparse'] + sys.argv[3:]
+bp.perform_install()
+"""
+
+STUB_CONFIGURE = """#!/bin/sh
+sleep ${{BENCH_CONFIGURE_SECONDS:-0}}
+for arg in "$@"; do
+    case $arg in --prefix=*) PREFIX=${{arg#--prefix=}};; esac
+done
+touch config.status
+cat > Makefile <<EOF
+all: {lib_name}
+{lib_name}:
+\tsleep \\$\\${{BENCH_MAKE_SECONDS:-0}}
+\ttouch {lib_name}
+clean:
+\trm -f {lib_name}
+install:
+\tmkdir -p \\$(DESTDIR)$PREFIX/lib \\$(DESTDIR)$PREFIX/include/coin-or/{include_subdir}
+\tcp {lib_name} \\$(DESTDIR)$PREFIX/lib/
+\ttouch \\$(DESTDIR)$PREFIX/include/coin-or/{include_subdir}/{include_file}
+EOF
+"""
+
+STUB_GET = """#!/bin/sh
+sleep ${BENCH_GET_SECONDS:-0}
+"""
+
+STUB_PAROPT_MAKEFILE = """include Makefile.in
+all:
+\tsleep $(BENCH_MAKE_SECONDS)
+\tmkdir -p lib
+\ttouch lib/libparopt.$(SO_EXT)
+"""
+
+STUB_PYTHON = """#!/bin/sh
+if [ "$1" = "-m" ] && [ "$2" = "pip" ]; then
+    sleep ${{BENCH_PIP_SECONDS:-0}}
+    exit 0
+fi
+exec "{python}" "$@"
+"""
+
+STUB_COMPILER = """#!/bin/sh
+case "$1" in
+    -dumpversion) echo 12.2.0;;
+    --version) echo "stub compiler 12.2.0";;
+esac
+"""
+
+def run_git(args:list, cwd:Path):
+    """ Run a git command quietly with a fixed identity. """
+    subprocess.run(['git', '-c', 'user.name=bench', '-c', 'user.email=bench@localhost'] + args,
+                   cwd=cwd, check=True, capture_output=True)
+
+def make_repo(work_dir:Path, build_key:str, files:dict)->str:
+    """
+    Create a bare repository with the given files on the branch or tag from build_info.
+
+    Returns
+    -------
+    str
+        The file:// URL of the bare repository.
+    """
+    src_dir = work_dir / 'src' / build_key
+    src_dir.mkdir(parents=True)
+    for rel_path, content in files.items():
+        file_path = src_dir / rel_path
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        file_path.write_text(content)
+        if content.startswith('#!'):
+            file_path.chmod(0o755)
+
+    branch = bp.build_info[build_key]['branch']
+    run_git(['init', '-q'], src_dir)
+    run_git(['add', '.'], src_dir)
+    run_git(['commit', '-q', '-m', 'stub'], src_dir)
+    run_git(['tag', branch] if build_key == 'pyoptsparse' else ['branch', branch], src_dir)
+
+    bare_dir = work_dir / 'repos' / f'{build_key}.git'
+    subprocess.run(['git', 'clone', '-q', '--bare', str(src_dir), str(bare_dir)],
+                   check=True, capture_output=True)
+    return bare_dir.as_uri()
+
+def stub_configure(build_key:str, lib_name:str)->str:
+    """ Create a configure script that writes a Makefile installing stand-in files. """
+    d = bp.build_info[build_key]
+    return STUB_CONFIGURE.format(lib_name=lib_name, include_subdir=d['include_subdir'],
+                                 include_file=d['include_file'])
+
+def create_fixtures(work_dir:Path)->dict:
+    """
+    Create the local repositories, stub tools, and input files.
+
+    Returns
+    -------
+    dict
+        'urls': the repo URL for each build_info key, 'bin_dir': the stub tool directory,
+        'snopt_dir' and 'hsl_tar_file': inputs for the scenarios.
+    """
+    urls = {
+        'metis': make_repo(work_dir, 'metis', {
+            'configure': stub_configure('metis', 'libcoinmetis.so'), 'get.Metis': STUB_GET}),
+        'mumps': make_repo(work_dir, 'mumps', {
+            'configure': stub_configure('mumps', 'libcoinmumps.so'), 'get.Mumps': STUB_GET}),
+        'hsl': make_repo(work_dir, 'hsl', {
+            'configure': stub_configure('hsl', 'libcoinhsl.so')}),
+        'ipopt': make_repo(work_dir, 'ipopt', {
+            'configure': stub_configure('ipopt', 'libipopt.so')}),
+        'paropt': make_repo(work_dir, 'paropt', {
+            'Makefile.in.info': '', 'Makefile': STUB_PAROPT_MAKEFILE}),
+        'pyoptsparse': make_repo(work_dir, 'pyoptsparse', {
+            'setup.py': '', 'pyoptsparse/pySNOPT/source/.keep': ''}),
+    }
+
+    bin_dir = work_dir / 'bin'
+    bin_dir.mkdir()
+    (bin_dir / 'python').write_text(STUB_PYTHON.format(python=sys.executable))
+    for comp in ['gcc', 'g++', 'gfortran', 'icc', 'icpc', 'ifort']:
+        (bin_dir / comp).write_text(STUB_COMPILER)
+    for tool in bin_dir.iterdir():
+        tool.chmod(0o755)
+
+    snopt_dir = work_dir / 'snopt' / 'src'
+    snopt_dir.mkdir(parents=True)
+    for name in ['snoptc.f', 'snopth.f', 'sn02lib.f']:
+        (snopt_dir / name).write_text('')
+
+    hsl_src = work_dir / 'hsl_archive' / 'coinhsl-2023.11.17'
+    hsl_src.mkdir(parents=True)
+    (hsl_src / 'README').write_text('')
+    hsl_tar_file = work_dir / 'coinhsl.tar.gz'
+    subprocess.run(['tar', 'czf', str(hsl_tar_file), '-C', str(hsl_src.parent), f'./{hsl_src.name}'],
+                   check=True)
+
+    return {'urls': urls, 'bin_dir': bin_dir, 'snopt_dir': snopt_dir, 'hsl_tar_file': hsl_tar_file}
+
+def run_scenario(fixtures:dict, scenario_args:list, work_dir:Path, env:dict)->dict:
+    """
+    Run perform_install() once into a fresh prefix.
+
+    Returns
+    -------
+    dict
+        The wall time and the phase summary from the trace.
+    """
+    prefix = Path(tempfile.mkdtemp(dir=work_dir, prefix='prefix-'))
+    trace_file = prefix / 'trace.json'
+    args = [arg.format(snopt_dir=fixtures['snopt_dir'], hsl_tar_file=fixtures['hsl_tar_file'])
+            for arg in scenario_args]
+    cmd = [sys.executable, '-c', DRIVER, str(REPO_DIR), json.dumps(fixtures['urls']),
+           '--no-sanity-check', '--ignore-conda', '--prefix', str(prefix),
+           '--trace', str(trace_file), '--log-dir', str(prefix / 'logs')] + args
+
+    start_time = time.perf_counter()
+    result = subprocess.run(cmd, env=env, capture_output=True, text=True)
+    wall = time.perf_counter() - start_time
+    if result.returncode != 0:
+        raise RuntimeError(f'{" ".join(args)} failed:\n{result.stdout}\n{result.stderr}')
+
+    with open(trace_file, encoding='utf-8') as f:
+        summary = json.load(f)['summary']
+
+    shutil.rmtree(prefix)
+    return {'wall_seconds': wall, 'phases': summary}
+
+def compare(results:dict, baseline_file:str, threshold:float)->list:
+    """
+    Find scenarios that are slower than in the baseline by more than the threshold.
+
+    Returns
+    -------
+    list
+        Descriptions of the regressions.
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = json.load(f)['scenarios']
+
+    regressions = []
+    for name, res in results.items():
+        if name not in baseline:
+            continue
+        old = baseline[name]['wall_seconds']
+        new = res['wall_seconds']
+        if new > old * (1 + threshold):
+            regressions.append(f'{name}: {old:.2f}s -> {new:.2f}s (+{(new / old - 1) * 100:.0f}%)')
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Runs per scenario; the median is reported. Default: 3')
+    parser.add_argument('-s', '--scenario', action='append', choices=list(SCENARIOS),
+                        help='Scenario to run, can be repeated. Default: all')
+    parser.add_argument('--configure-seconds', type=float, default=0,
+                        help='Simulated duration of each configure script. Default: 0')
+    parser.add_argument('--make-seconds', type=float, default=0,
+                        help='Simulated duration of each make. Default: 0')
+    parser.add_argument('--get-seconds', type=float, default=0,
+                        help='Simulated duration of get.Metis/get.Mumps. Default: 0')
+    parser.add_argument('--pip-seconds', type=float, default=0,
+                        help='Simulated duration of each pip install. Default: 0')
+    parser.add_argument('-o', '--output', help='Write the results to this JSON file.')
+    parser.add_argument('-b', '--baseline',
+                        help='Compare with results previously written with --output and exit '
+                             'with status 1 if any scenario regressed.')
+    parser.add_argument('-t', '--threshold', type=float, default=0.2,
+                        help='Allowed slowdown relative to the baseline. Default: 0.2')
+    parser.add_argument('extra_args', nargs='*',
+                        help='Additional build_pyoptsparse arguments, after --')
+    args = parser.parse_args()
+
+    work_dir = Path(tempfile.mkdtemp(prefix='bpo-bench-'))
+    try:
+        fixtures = create_fixtures(work_dir)
+
+        env = {k: v for k, v in os.environ.items() if k not in ['CONDA_PREFIX', 'VIRTUAL_ENV']}
+        env['PATH'] = f"{fixtures['bin_dir']}{os.pathsep}{env['PATH']}"
+        env['BENCH_CONFIGURE_SECONDS'] = str(args.configure_seconds)
+        env['BENCH_MAKE_SECONDS'] = str(args.make_seconds)
+        env['BENCH_GET_SECONDS'] = str(args.get_seconds)
+        env['BENCH_PIP_SECONDS'] = str(args.pip_seconds)
+
+        results = {}
+        for name in args.scenario or list(SCENARIOS):
+            runs = [run_scenario(fixtures, SCENARIOS[name] + args.extra_args, work_dir, env)
+                    for _ in range(args.repeat)]
+            walls = [run['wall_seconds'] for run in runs]
+            results[name] = {'wall_seconds': statistics.median(walls), 'runs': walls,
+                             'phases': runs[0]['phases']}
+            print(f'{name:<24} {results[name]["wall_seconds"]:8.2f}s '
+                  f'(min {min(walls):.2f}s, max {max(walls):.2f}s)')
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    if args.output is not None:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({
+                'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'settings': {k: getattr(args, k) for k in
+                             ['configure_seconds', 'make_seconds', 'get_seconds', 'pip_seconds',
+                              'repeat', 'extra_args']},
+                'scenarios': results
+            }, f, indent=2)
+
+    if args.baseline is not None:
+        regressions = compare(results, args.baseline, args.threshold)
+        for reg in regressions:
+            print(f'REGRESSION: {reg}')
+        if len(regressions) > 0:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
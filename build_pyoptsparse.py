@@ -1,16 +1,33 @@
 #!/usr/bin/env python
 import argparse
+import collections
+import concurrent.futures
+import contextlib
+import errno
+import fcntl
+import gzip
+import hashlib
+import json
+import math
+import multiprocessing
+import multiprocessing.connection
 import os
 import platform
 import re
 import shutil
+import signal
 import sys
 import subprocess
+import tarfile
 from pathlib import Path, PurePath
 import tempfile
+import threading
+import time
+import zipfile
 from colors import *
 from shutil import which
 from packaging.version import Version, parse
+from sqlitedict import SqliteDict
 
 # Default options that the user can change with command line switches
 opts = {
@@ -20,6 +37,7 @@ opts = {
     'intel_compiler_suite': False,
     'snopt_dir': None,
     'hsl_tar_file': None,
+    'auto_scale': 10000,
     'include_paropt': False,
     'include_ipopt': True,
     'keep_build_dir': False,
@@ -31,9 +49,31 @@ opts = {
     'verbose': False,
     'compile_required': True, # Not set directly by the user, but determined from other options
     'uninstall': False,
+    'show_installed': False,
+    'staged_install': False,
+    'export_bundle': None,
+    'from_bundle': None,
+    'extra_prefixes': [],
     'pyoptsparse_version': None, # Parsed pyOptSparse version, set by finish_setup()
     'make_name': 'make',
-    'fall_back': False
+    'fall_back': False,
+    'cpu_budget': os.cpu_count(),
+    'cache_dir': str(Path(os.environ.get('XDG_CACHE_HOME', Path.home() / '.cache')) / 'build_pyoptsparse'),
+    'artifact_cache': False,
+    'configure_cache': False,
+    'mirror_dir': None,
+    'offline': False,
+    'build_root': None,
+    'build_profile': 'default',
+    'blas': 'auto',
+    'pgo': False,
+    'shallow_clone': False,
+    'compiler_cache': None,
+    'trace_file': None,
+    'recheck': False,
+    'log_dir': None,
+    'compress_logs': False,
+    'log_tail_lines': 40 # How much output to show when a command fails
 }
 
 # Information about the host, status, and constants
@@ -43,12 +83,34 @@ sys_info = {
     'msg_color': 'gray',
     'gnu_sanity_check_done': False,
     'python_sanity_check_done': False,
-    'compile_cores': int(os.cpu_count()/2),
+    'compile_cores': os.cpu_count(), # Updated with get_cpu_limit() by process_command_line()
     'sys_name': platform.system(),
     'conda_activate_dir': None,
     'conda_deactivate_dir': None,
     'conda_env_script': 'pyoptsparse_lib.sh',
-    'conda_forge_available': False
+    'conda_forge_available': False,
+    'check_conda_forge': False, # Set by process_command_line() if finish_setup() should check
+    'task_cores': None, # Cores allotted to the task running in this process, if any
+    'task_mem_mb': None, # Memory allotted to the task running concurrently in this process
+    'task_label': None, # Name of the task when running concurrently with others
+    'task_results': {}, # Return values of finished tasks, keyed by task name
+    'task_name': None, # Name of the task running in this process, if any
+    'log_run_dir': None, # Where command logs for this run go, set by start_build_logs()
+    'log_count': 0, # Commands logged so far by the current task
+    'configure_cache_dir': None, # Set by finish_setup() if --configure-cache is used
+    'blas': None, # The BLAS/LAPACK selected by select_blas(), with its link flags and threading
+    'pgo_phase': None, # 'generate' or 'use' during a --pgo build
+    'stage_root': None, # Staging tree for --staged-install, set by start_staged_install()
+    'wheel_dir': None, # Where Python packages are built as wheels, if they're not installed directly
+    'pending_note': None,
+    'compilers': {}, # Compiler commands before any wrapping, set by select_*_compilers()
+    'compiler_id': None, # Paths and versions of the selected compilers, set by get_compiler_id()
+    'compiler_cache_cmd': None, # Full path to ccache or sccache if used
+    'trace_start': time.perf_counter(),
+    'trace_pid': os.getpid(),
+    'trace_events': [], # Chrome trace events recorded by trace_phase()
+    'probe_cache_lock': threading.Lock(),
+    'log_count_lock': threading.Lock() # Probes run commands from several threads
 }
 
 # Where to find each package, which branch to use if obtained by git,
@@ -59,14 +121,17 @@ build_info = {
         'url': 'https://github.com/coin-or-tools/ThirdParty-Metis.git',
         'src_lib_glob': 'libcoinmetis*',
         'include_subdir': 'metis',
-        'include_file': 'metis.h'
+        'include_file': 'metis.h',
+        'conda_pkgs': ['metis'],
+        'make_job_mem_mb': 256
     },
     'mumps': {
         'branch': 'releases/3.0.2',
         'url': 'https://github.com/coin-or-tools/ThirdParty-Mumps.git',
         'src_lib_glob': 'libcoinmumps*',
         'include_subdir': 'mumps',
-        'include_file': 'mumps_c_types.h'
+        'include_file': 'mumps_c_types.h',
+        'conda_pkgs': ['mumps-include', 'mumps-seq', 'mumps-mpi']
     },
     'ipopt': {
         'branch': 'releases/3.14.7',
@@ -74,7 +139,9 @@ build_info = {
         'src_lib_glob': 'lib*ipopt*',
         'include_subdir': '.',
         'include_glob_list': ['Ip*.hpp', 'Sens*.hpp', 'Ip*.h', 'Ip*.inc'],
-        'include_file': 'IpoptConfig.h'
+        'include_file': 'IpoptConfig.h',
+        'conda_pkgs': ['ipopt'],
+        'make_job_mem_mb': 512
     },
     'pyoptsparse': {
         'branch': 'v2.9.2',
@@ -85,17 +152,22 @@ build_info = {
         'url': 'https://github.com/coin-or-tools/ThirdParty-HSL',
         'src_lib_glob': 'libcoinhsl*',
         'include_subdir': 'hsl',
-        'include_file': 'CoinHslConfig.h'
+        'include_file': 'CoinHslConfig.h',
+        'make_job_mem_mb': 512
     },
     'paropt': {
         'branch': 'v2.0.2',
         'url': 'https://github.com/smdogroup/paropt.git',
         'src_lib_glob': 'libparopt*',
+        'make_job_mem_mb': 512
     }
 }
 
 def process_command_line():
     """ Validate command line arguments and update options, or print usage and exit. """
+    sys_info['compile_cores'] = get_cpu_limit()
+    opts['cpu_budget'] = sys_info['compile_cores']
+
     parser = argparse.ArgumentParser(
         formatter_class=argparse.RawDescriptionHelpFormatter,
         description='''
@@ -118,16 +190,81 @@ def process_command_line():
     build_pyoptsparse
     build_pyoptsparse --intel --linear-solver=pardiso
     build_pyoptsparse -l hsl -n -t ../../coinhsl-archive-2014.01.17.tar.gz
+    build_pyoptsparse bench --sizes 1000 10000
     '''
     )
     parser.add_argument("-a", "--paropt",
                         help="Add ParOpt support. Default: no ParOpt",
                         action="store_true",
                         default=opts['include_paropt'])
+    parser.add_argument("--artifact-cache",
+                        help="Install METIS, MUMPS, HSL, and IPOPT from a previous build in the \
+                              cache directory when all build inputs are the same, and add new \
+                              builds to it. Default: always build",
+                        action="store_true",
+                        default=opts['artifact_cache'])
+    parser.add_argument("--auto-scale",
+                        help="Number of constraints in the problem that --linear-solver=auto \
+                              times each linear solver with. Use the size of the problems \
+                              you intend to solve. Default: 10000",
+                        type=int,
+                        default=opts['auto_scale'])
     parser.add_argument("-b", "--branch",
                         help=f"pyOptSparse release. \
                         Default: {build_info['pyoptsparse']['branch']}",
                         default=build_info['pyoptsparse']['branch'])
+    parser.add_argument("--blas",
+                        help="The BLAS/LAPACK for MUMPS, HSL, and IPOPT to link with. 'auto' \
+                              picks the first one found of MKL, OpenBLAS, BLIS, and the \
+                              reference implementation. Default: auto",
+                        choices=['auto', 'mkl', 'openblas', 'blis', 'reference'],
+                        default=opts['blas'])
+    parser.add_argument("--build-root",
+                        help="Build each package in a persistent directory under BUILD_ROOT, \
+                              named after the package and branch. Later runs update it, skip \
+                              configure when its inputs are unchanged, and run an incremental \
+                              make. Without a value, CACHE_DIR/builds is used. A build root \
+                              should not be used by two runs at once. Default: temporary \
+                              directories",
+                        nargs='?',
+                        const='',
+                        default=opts['build_root'])
+    parser.add_argument("--profile",
+                        help="Optimization flags for METIS, MUMPS, HSL, and IPOPT. 'fast' adds \
+                              -O3, tuning for this CPU, and link-time optimization. \
+                              'fast-portable' is the same without CPU tuning, for builds used \
+                              on other machines. Default: the packages' own flags",
+                        choices=['default', 'fast', 'fast-portable'],
+                        default=opts['build_profile'])
+    parser.add_argument("--pgo",
+                        help="Use profile-guided optimization: first build the solver \
+                              libraries with instrumentation, run the IPOPT tests to collect a \
+                              profile, then rebuild them using it. Implies -f and --build-root. \
+                              GNU compilers only",
+                        action="store_true",
+                        default=opts['pgo'])
+    parser.add_argument("--cache-dir",
+                        help=f"Where to keep cached build results. Default: {opts['cache_dir']}",
+                        default=opts['cache_dir'])
+    parser.add_argument("--compiler-cache",
+                        help="Run the compilers through ccache or sccache to speed up \
+                              repeated builds. Without a value, use whichever is found. \
+                              Default: no compiler cache",
+                        nargs='?',
+                        const='auto',
+                        choices=['auto', 'ccache', 'sccache'],
+                        default=opts['compiler_cache'])
+    parser.add_argument("--compress-logs",
+                        help="Compress the build logs with gzip. Default: plain text",
+                        action="store_true",
+                        default=opts['compress_logs'])
+    parser.add_argument("--configure-cache",
+                        help="Keep the results of configure checks in the cache directory, \
+                              separately for each compiler suite and prefix. Checks that only \
+                              depend on the compilers and system are shared between packages. \
+                              Default: run every check",
+                        action="store_true",
+                        default=opts['configure_cache'])
     parser.add_argument("-c", "--conda-cmd",
                         help=f"Command to install packages with if conda is used. \
                                Default: {opts['conda_cmd']}")
@@ -140,17 +277,38 @@ def process_command_line():
                               or uninstall from the conda environment.",
                         action="store_true",
                         default=opts['ignore_conda'])
+    parser.add_argument("--export-bundle",
+                        help="After a successful build, pack the packages built from source in \
+                              the prefix, with their install manifests and the Python wheels, \
+                              into a relocatable archive at EXPORT_BUNDLE (.tar.gz).")
+    parser.add_argument("--extra-prefix",
+                        help="Also install the packages built from source and the Python wheels \
+                              into the environment at EXTRA_PREFIX, sharing library files with \
+                              hard links or reflinks where the filesystem allows. Can be used \
+                              more than once.",
+                        action="append",
+                        default=[])
     parser.add_argument("-f", "--force-build",
                         help="Build/rebuild packages even if found to be installed or \
                               can be installed with conda.",
                         action="store_true",
                         default=opts['force_build'])
+    parser.add_argument("--from-bundle",
+                        help="Install the packages from an archive made with --export-bundle \
+                              into the prefix, without building anything.")
     parser.add_argument("-g", "--fall-back",
                         help="If a conda package fails to install, fall back to \
                               building from source. If selected, the build environment is \
                               tested in case it is needed.",
                         action="store_true",
                         default=opts['fall_back'])
+    parser.add_argument("-j", "--jobs",
+                        help=f"Maximum number of CPU cores shared by build steps running \
+                              concurrently and their parallel make jobs. Use 1 to build one \
+                              package at a time with a single make job. \
+                              Default: {opts['cpu_budget']}",
+                        type=int,
+                        default=opts['cpu_budget'])
     parser.add_argument("-k", "--no-sanity-check",
                         help="Skip the sanity checks.",
                         action="store_true",
@@ -160,14 +318,29 @@ def process_command_line():
                         action="store_true",
                         default=opts['intel_compiler_suite'])
     parser.add_argument("-l", "--linear-solver",
-                        help="Which linear solver to use with IPOPT. Default: mumps",
-                        choices=['mumps', 'hsl', 'pardiso'],
+                        help="Which linear solver to use with IPOPT. 'mumps+hsl' builds both, \
+                              so the solver can be chosen at run time with IPOPT's linear_solver \
+                              option. 'auto' also does, if -t is given, then makes the fastest \
+                              one on a benchmark problem the default. Default: mumps",
+                        choices=['mumps', 'hsl', 'mumps+hsl', 'pardiso', 'auto'],
                         default=opts['linear_solver'])
+    parser.add_argument("--log-dir",
+                        help="Where to write the full output of each build step. Each run gets \
+                              its own subdirectory. Default: CACHE_DIR/logs",
+                        default=opts['log_dir'])
     parser.add_argument("-m", "--ignore-mamba",
                         help="Do not use mamba to install conda packages. \
                               Default: Use mamba if found",
                         action="store_true",
                         default=opts['ignore_mamba'])
+    parser.add_argument("--mirror-dir",
+                        help="Clone from bare mirrors of the git repositories kept in MIRROR_DIR, \
+                              which are created or updated as needed. The directory can be \
+                              shared by several hosts. Without a value, CACHE_DIR/git is used. \
+                              Default: clone directly from the remote",
+                        nargs='?',
+                        const='',
+                        default=opts['mirror_dir'])
     parser.add_argument("-n", "--no-install",
                         help=f"Prepare, but do {yellow('not')} build/install pyOptSparse itself. \
                                Default: install",
@@ -177,9 +350,40 @@ def process_command_line():
                         help="Do not install IPOPT. Default: install IPOPT",
                         action="store_true",
                         default=not opts['include_ipopt']),
+    parser.add_argument("--offline",
+                        help="Don't use the network. Repositories come from --mirror-dir \
+                              (implied), the METIS and MUMPS source tar files from the tarball \
+                              cache, pip only uses local wheels, and conda only its package \
+                              cache. Fails before building if something is missing. \
+                              Default: download what's needed",
+                        action="store_true",
+                        default=opts['offline'])
     parser.add_argument("-p", "--prefix",
                         help=f"Where to install if not a conda/venv environment. Default: {opts['prefix']}",
                         default=opts['prefix'])
+    parser.add_argument("--show-installed",
+                        help="List the packages built from source in the prefix, with the build \
+                              and size of each, then exit.",
+                        action="store_true",
+                        default=opts['show_installed'])
+    parser.add_argument("--shallow",
+                        help="Only download the selected branch or tag of each repository, \
+                              without history. Falls back to a full clone if that fails. \
+                              Ignored with --mirror-dir. Default: full clone",
+                        action="store_true",
+                        default=opts['shallow_clone'])
+    parser.add_argument("--recheck",
+                        help="Repeat environment checks whose results were cached by previous \
+                              runs with the same tools. Default: reuse cached results",
+                        action="store_true",
+                        default=opts['recheck'])
+    parser.add_argument("--staged-install",
+                        help="Install everything into a staging tree inside the prefix, and only \
+                              move it into place after all packages have been built, leaving \
+                              the prefix unchanged if anything fails. Default: install each \
+                              package as soon as it's built",
+                        action="store_true",
+                        default=opts['staged_install'])
     parser.add_argument("-s", "--snopt-dir",
                         help="Include SNOPT from SNOPT-DIR. Default: no SNOPT",
                         default=opts['snopt_dir'])
@@ -188,6 +392,11 @@ def process_command_line():
                         to the tar file of the HSL source. \
                         E.g. -t ../../coinhsl-archive-2014.01.17.tar.gz",
                         default=opts['hsl_tar_file'])
+    parser.add_argument("--trace",
+                        help="Write the time spent in each build phase to TRACE as Chrome \
+                              trace-event JSON and print a summary. Default: no trace",
+                        metavar="TRACE",
+                        default=opts['trace_file'])
     parser.add_argument("-u", "--uninstall",
                         help="Attempt to remove include/lib files previously built from source \
                               (using the same --prefix) and/or installed with conda in the same \
@@ -220,25 +429,35 @@ def process_command_line():
             else:
                 opts['conda_cmd'] = 'mamba'
 
-        # Make sure conda forge channel is available
-        if args.uninstall is False:
-            note('Checking for conda-forge')
-            cmd_list=['info','--unsafe-channels']
-            result = run_conda_cmd(cmd_list)
-
-            if re.search(r'conda.*forge', result.stdout) is not None:
-                sys_info['conda_forge_available'] = True
-                note_ok()
-            else:
-                print(f'{yellow("WARNING")}: The conda-forge channel is not configured, cannot \
-                        install conda packages. Falling back to building from source.')
-                opts['compile_required'] = True
+        # Make sure conda forge channel is available, in parallel with other checks
+        sys_info['check_conda_forge'] = args.uninstall is False
 
     opts['keep_build_dir'] = args.no_delete
-    opts['force_build'] = args.force_build
+    opts['cache_dir'] = str(Path(args.cache_dir).resolve())
+    opts['artifact_cache'] = args.artifact_cache
+    opts['configure_cache'] = args.configure_cache
+    opts['shallow_clone'] = args.shallow
+    opts['compiler_cache'] = args.compiler_cache
+    if args.trace is not None:
+        opts['trace_file'] = str(Path(args.trace).resolve())
+    opts['log_dir'] = str(Path(args.log_dir or Path(opts['cache_dir']) / 'logs').resolve())
+    opts['compress_logs'] = args.compress_logs
+    opts['build_profile'] = args.profile
+    opts['blas'] = args.blas
+    opts['pgo'] = args.pgo
+    # Both builds of a PGO run must be in the same directories to match the profile
+    if args.build_root is not None or opts['pgo'] is True:
+        opts['build_root'] = str(Path(args.build_root or Path(opts['cache_dir']) / 'builds').resolve())
+    opts['offline'] = args.offline
+    if args.mirror_dir is not None or opts['offline'] is True:
+        opts['mirror_dir'] = str(Path(args.mirror_dir or Path(opts['cache_dir']) / 'git').resolve())
+    opts['force_build'] = args.force_build or opts['pgo']
     opts['fall_back'] = args.fall_back
     opts['check_sanity'] = not args.no_sanity_check
+    opts['recheck'] = args.recheck
+    opts['cpu_budget'] = max(1, args.jobs)
     opts['linear_solver'] = args.linear_solver
+    opts['auto_scale'] = args.auto_scale
     if opts['linear_solver'] == 'pardiso':
         opts['intel_compiler_suite'] = True
     else:
@@ -250,6 +469,13 @@ def process_command_line():
     opts['hsl_tar_file'] = args.hsl_tar_file
     opts['verbose'] = args.verbose
     opts['uninstall'] = args.uninstall
+    opts['show_installed'] = args.show_installed
+    opts['staged_install'] = args.staged_install
+    if args.export_bundle is not None:
+        opts['export_bundle'] = str(Path(args.export_bundle).resolve())
+    opts['extra_prefixes'] = [str(Path(p).resolve()) for p in args.extra_prefix]
+    if args.from_bundle is not None:
+        opts['from_bundle'] = str(Path(args.from_bundle).resolve())
 
 
 def announce(msg:str):
@@ -273,21 +499,45 @@ def note(msg:str):
     msg : str
         The information to be printed.
     """
-    if opts['verbose'] is False:
+    if sys_info['task_label'] is not None:
+        msg = f"[{sys_info['task_label']}] {msg}"
+
+    if opts['verbose'] is True:
+        print(msg + '...')
+    elif sys_info['task_label'] is not None:
+        # Other tasks are printing too, so hold the message until the result is known
+        sys_info['pending_note'] = msg
+    else:
         print(msg, end="... ")
         sys.stdout.flush()
+
+def note_result(result:str):
+    """
+    Print the result of the operation announced by note(), preceded by the held
+    message if running concurrently with other tasks.
+
+    Parameters
+    ----------
+    result : str
+        The colored result text.
+    """
+    if opts['verbose'] is True:
+        return
+
+    if sys_info['pending_note'] is not None:
+        print(f"{sys_info['pending_note']}... {result}")
+        sys_info['pending_note'] = None
     else:
-        print(msg + '...')
+        print(result)
+    sys.stdout.flush()
 
 def note_ok():
     """ Print a green OK message to follow up a note() with. """
-    if opts['verbose'] is False:
-        print(green('OK'))
+    note_result(green('OK'))
 
 def note_failed():
     """ Print a red failure message to follow up a note() with. """
-    if opts['verbose'] is False:
-        print(red('failed'))
+    note_result(red('failed'))
 
 def code(msg:str)->str:
     """
@@ -370,10 +620,205 @@ def subst_env_for_path(path:str)->str:
 
     return path
 
-def run_cmd(cmd_list, do_check=True, raise_error=True)->bool:
+@contextlib.contextmanager
+def trace_phase(name:str, category:str, args:dict=None):
+    """
+    Record the time spent in the context as a Chrome trace event.
+
+    Parameters
+    ----------
+    name : str
+        The name of the phase.
+    category : str
+        The kind of phase, e.g. 'task' or 'cmd'.
+    args : dict
+        Extra information to show with the event.
+    """
+    start_time = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_time = time.perf_counter()
+        sys_info['trace_events'].append({
+            'name': name,
+            'cat': category,
+            'ph': 'X',
+            'ts': round((start_time - sys_info['trace_start']) * 1e6),
+            'dur': round((end_time - start_time) * 1e6),
+            'pid': sys_info['trace_pid'],
+            'tid': os.getpid(),
+            'args': args if args is not None else {}
+        })
+
+def get_cmd_label(cmd_list:list)->str:
+    """
+    Create a short name for a command line, like 'make install' or 'configure'.
+
+    Parameters
+    ----------
+    cmd_list : list
+        Each token of the command line is a separate member of the list.
+
+    Returns
+    -------
+    str
+        The program name followed by its subcommand, if any.
+    """
+    tokens = [str(token) for token in cmd_list]
+    if len(tokens) > 2 and tokens[1] == '-m':
+        tokens = tokens[2:] # e.g. python -m pip
+
+    label = Path(tokens[0]).name
+    if len(tokens) > 1 and re.match(r'^[a-z][\w-]*$', tokens[1]) is not None:
+        label += f' {tokens[1]}'
+
+    return label
+
+def write_trace():
+    """ Write the recorded trace events to the trace file and print a summary. """
+    totals = {}
+    for event in sys_info['trace_events']:
+        if event['ph'] == 'X':
+            key = (event['cat'], event['name'])
+            count, dur = totals.get(key, (0, 0))
+            totals[key] = (count + 1, dur + event['dur'])
+
+    summary = [{'category': cat, 'name': name, 'count': count, 'seconds': round(dur / 1e6, 3)}
+               for (cat, name), (count, dur) in sorted(totals.items(), key=lambda t: -t[1][1])]
+
+    with open(opts['trace_file'], 'w', encoding='utf-8') as f:
+        json.dump({
+            'traceEvents': sys_info['trace_events'],
+            'displayTimeUnit': 'ms',
+            'summary': summary
+        }, f, indent=1)
+
+    announce('Time spent in each phase')
+    print(f'{"Category":<10} {"Phase":<40} {"Count":>6} {"Seconds":>10}')
+    for row in summary:
+        print(f'{row["category"]:<10} {row["name"][:40]:<40} {row["count"]:>6} {row["seconds"]:>10.1f}')
+    print(f'Trace written to {code(subst_env_for_path(opts["trace_file"]))}')
+
+def start_build_logs(keep_runs:int=10):
+    """
+    Create the directory for this run's command logs, removing those of older runs.
+
+    Parameters
+    ----------
+    keep_runs : int
+        How many of the most recent runs to keep logs for, including this one.
+    """
+    log_dir = Path(opts['log_dir'])
+    log_dir.mkdir(parents=True, exist_ok=True)
+    old_runs = sorted(d for d in log_dir.iterdir() if d.is_dir() and d.name.startswith('run-'))
+    for old_run in old_runs[:max(0, len(old_runs) - keep_runs + 1)]:
+        shutil.rmtree(old_run, ignore_errors=True)
+
+    run_dir = Path(tempfile.mkdtemp(dir=log_dir, prefix=time.strftime('run-%Y%m%d-%H%M%S-')))
+    sys_info['log_run_dir'] = str(run_dir)
+    print(f'Build logs are in {code(subst_env_for_path(str(run_dir)))}')
+
+def open_cmd_log(cmd_list:list, cwd:str=None):
+    """
+    Create a log file for the output of a command, once start_build_logs() has been called.
+
+    Parameters
+    ----------
+    cmd_list : list
+        Each token of the command line is a separate member of the list.
+    cwd : str
+        The directory the command runs in, if not the current one.
+
+    Returns
+    -------
+    file object
+        The open log file, or None if command output isn't being logged.
+    str
+        The path of the log file, or None.
+    """
+    if sys_info['log_run_dir'] is None:
+        return None, None
+
+    # Log files are numbered within each task, since concurrent tasks can't share a counter
+    with sys_info['log_count_lock']:
+        sys_info['log_count'] += 1
+        log_count = sys_info['log_count']
+    # The two builds of a PGO run have the same tasks, so tell their logs apart
+    pgo_part = f"pgo-{sys_info['pgo_phase']}" if sys_info['pgo_phase'] is not None else None
+    name_parts = [pgo_part, sys_info['task_name'], f"{log_count:03d}", get_cmd_label(cmd_list)]
+    log_name = re.sub(r'[^\w.-]+', '-', '-'.join(p for p in name_parts if p is not None)) + '.log'
+    log_path = Path(sys_info['log_run_dir']) / log_name
+
+    if opts['compress_logs'] is True:
+        log_path = log_path.with_name(log_name + '.gz')
+        log_file = gzip.open(log_path, 'wt', encoding='utf-8')
+    else:
+        log_file = open(log_path, 'w', encoding='utf-8')
+
+    log_file.write(f"# cwd: {cwd or os.getcwd()}\n$ {' '.join(str(c) for c in cmd_list)}\n")
+    return log_file, str(log_path)
+
+def stream_output(pipe, tail:collections.deque, log_file, lock:threading.Lock,
+                  captured:list=None):
+    """
+    Read a command's output line by line as it's produced, keeping only the last
+    lines in memory unless the whole output is needed.
+
+    Parameters
+    ----------
+    pipe : file object
+        The stdout or stderr pipe of the process.
+    tail : collections.deque
+        Bounded buffer of the latest lines from both pipes.
+    log_file : file object
+        Where to write every line, or None.
+    lock : threading.Lock
+        Keeps lines from the two pipes from being interleaved mid-line.
+    captured : list
+        If provided, every line is also appended here.
+    """
+    prefix = f"[{sys_info['task_label']}] " if sys_info['task_label'] is not None else ''
+
+    for line in pipe:
+        with lock:
+            tail.append(line)
+            if log_file is not None:
+                log_file.write(line)
+            if captured is not None:
+                captured.append(line)
+            if opts['verbose'] is True:
+                sys.stdout.write(prefix + line)
+                sys.stdout.flush()
+
+    pipe.close()
+
+def report_cmd_failure(e:BaseException):
+    """
+    Follow up a failed note() and, if a logged command failed, show the end of its
+    output and where to find the rest.
+
+    Parameters
+    ----------
+    e : BaseException
+        The exception that caused the failure.
+    """
+    note_failed()
+    log_path = getattr(e, 'log_path', None)
+    if log_path is None:
+        return
+
+    if opts['verbose'] is False:
+        label = f"[{sys_info['task_label']}] " if sys_info['task_label'] is not None else ''
+        print(f'{label}{yellow("Last lines of output")}:')
+        print(''.join(f'{label}    {line}' for line in e.output_tail), end='')
+    print(f'Full log: {code(subst_env_for_path(log_path))}')
+    sys.stdout.flush()
+
+def run_cmd(cmd_list, do_check=True, raise_error=True, cwd:str=None, capture:bool=False)->bool:
     """
-    Run a command with provided arguments. Hide output unless there's an error
-    or verbose mode is enabled.
+    Run a command with provided arguments. Output is streamed to the build log, if
+    started, and only the last lines are kept in memory. It's hidden unless there's
+    an error or verbose mode is enabled, when it's shown as it's produced.
 
     Parameters
     ----------
@@ -388,32 +833,153 @@ def run_cmd(cmd_list, do_check=True, raise_error=True)->bool:
         if the process returns a non-zero status. If true, do not raise
         an exception, but have the function return False.
 
+    cwd : str
+        Run the command in this directory instead of the current one. A relative
+        command name is also looked up in it.
+
+    capture : bool
+        If true, keep all of stdout and stderr in the result for the caller to parse.
+        Otherwise they're None, except for the last lines of output in stderr when
+        the command fails.
+
     Returns
     -------
     subprocess.CompletedProcess
         The result of the finished command.
     """
-    result = None
+    tail = collections.deque(maxlen=opts['log_tail_lines'])
+    captured = {'stdout': [], 'stderr': []} if capture is True else {'stdout': None, 'stderr': None}
+    log_file, log_path = open_cmd_log(cmd_list, cwd)
 
-    try:
-        result = subprocess.run(cmd_list, check=do_check, capture_output=True, text=True)
-    except subprocess.CalledProcessError as inst:
-        if raise_error is True:
-            raise inst
+    with trace_phase(get_cmd_label(cmd_list), 'cmd', {'cmd': ' '.join(str(c) for c in cmd_list)}):
+        try:
+            with subprocess.Popen(cmd_list, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                  text=True, errors='replace', cwd=cwd) as proc:
+                lock = threading.Lock()
+                readers = [threading.Thread(target=stream_output,
+                                            args=(pipe, tail, log_file, lock, captured[name]))
+                           for name, pipe in [('stdout', proc.stdout), ('stderr', proc.stderr)]]
+                for reader in readers:
+                    reader.start()
+                for reader in readers:
+                    reader.join()
+                returncode = proc.wait()
+        finally:
+            if log_file is not None:
+                log_file.close()
+
+    stdout, stderr = [''.join(captured[name]) if capture is True else None
+                      for name in ['stdout', 'stderr']]
+
+    if do_check is True and returncode != 0:
+        if raise_error is False:
+            return None
+
+        err = subprocess.CalledProcessError(returncode, cmd_list, output=stdout,
+                                            stderr=stderr if capture is True else ''.join(tail))
+        err.output_tail = list(tail)
+        err.log_path = log_path
+        raise err
+
+    return subprocess.CompletedProcess(cmd_list, returncode, stdout, stderr)
+
+def get_tool_identity(cmd:str)->dict:
+    """
+    Identify a command by its resolved path, modification time, and version output.
 
-    if opts['verbose'] is True and result is not None:
-        print(result.stdout, result.stderr)
+    Parameters
+    ----------
+    cmd : str
+        The name of the command to look for.
 
-    return result
+    Returns
+    -------
+    dict
+        The identifying information.
+    """
+    cmd_path = which(cmd)
+    if cmd_path is None:
+        return {'cmd': cmd, 'path': None}
+
+    real_path = os.path.realpath(cmd_path)
+    result = subprocess.run([cmd_path, '--version'], check=False, capture_output=True, text=True)
+    return {
+        'cmd': cmd,
+        'path': real_path,
+        'mtime': os.stat(real_path).st_mtime_ns,
+        'version': result.stdout.strip()
+    }
 
-def check_make(errors:list):
+def cached_probe(name:str, tools:list, func, extra_inputs:dict=None):
     """
-    Find the best make command and test its viability.
+    Run an environment check, or reuse its result from a previous run if the tools it
+    depends on are unchanged. Only successful results are cached.
 
     Parameters
     ----------
-    errors : list
-        Accumulated pre-check error messages.
+    name : str
+        A unique name for the check.
+    tools : list
+        Names of the commands the result depends on.
+    func : callable
+        Performs the check. Raises an exception on failure.
+    extra_inputs : dict
+        Any other information the result depends on.
+
+    Returns
+    -------
+    object
+        The value returned by func.
+    """
+    inputs = {
+        'name': name,
+        'tools': [get_tool_identity(tool) for tool in tools],
+        'extra': extra_inputs or {}
+    }
+    key = hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+    cache_file = str(Path(opts['cache_dir']) / 'probes.sqlite')
+
+    if opts['recheck'] is False:
+        with sys_info['probe_cache_lock']:
+            Path(opts['cache_dir']).mkdir(parents=True, exist_ok=True)
+            with SqliteDict(cache_file) as cache:
+                if key in cache:
+                    return cache[key]
+
+    result = func()
+
+    with sys_info['probe_cache_lock']:
+        Path(opts['cache_dir']).mkdir(parents=True, exist_ok=True)
+        with SqliteDict(cache_file, autocommit=True) as cache:
+            cache[key] = result
+
+    return result
+
+def test_gnu_make()->str:
+    """
+    Test whether the selected make command is GNU make.
+
+    Returns
+    -------
+    str
+        A warning message if the make command isn't GNU make, otherwise None.
+    """
+    cmd_list=[opts['make_name'], '--version']
+    result = subprocess.run(cmd_list, check=False, capture_output=True, text=True)
+
+    if str(result.stdout).find('GNU Make') == -1:
+        return f'{opts["make_name"]} is not GNU Make. Source code builds may fail.'
+
+    return None
+
+def check_make()->str:
+    """
+    Find the best make command and test its viability.
+
+    Returns
+    -------
+    str
+        A warning message if the make command isn't GNU make, otherwise None.
     """
 
     if 'MAKE' in os.environ:
@@ -421,26 +987,154 @@ def check_make(errors:list):
     elif which('gmake') is not None:
         opts['make_name'] = 'gmake'
 
-    if find_required_command(opts['make_name'], errors):
-        # If the make command is found, test whether it's GNU make
-        cmd_list=[opts['make_name'], '--version']
-        result = subprocess.run(cmd_list, check=False, capture_output=True, text=True)
+    if which(opts['make_name']) is None:
+        raise RuntimeError(f"Required command {yellow(opts['make_name'])} not found.")
+
+    # If the make command is found, test whether it's GNU make
+    return cached_probe('make', [opts['make_name']], test_gnu_make)
 
-        if str(result.stdout).find('GNU Make') == -1:
-            print(f'{yellow("WARNING")}: {opts["make_name"]} is not GNU Make. '
-                  'Source code builds may fail.')
+def get_cpu_limit()->int:
+    """
+    Determine how many CPU cores this process can use, taking the CPU affinity mask
+    and any cgroup CPU quota (e.g. in a container) into account.
+
+    Returns
+    -------
+    int
+        The number of usable cores.
+    """
+    try:
+        cores = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cores = os.cpu_count()
+
+    quota = None
+    try:
+        # cgroup v2
+        quota_str, period_str = Path('/sys/fs/cgroup/cpu.max').read_text().split()
+        if quota_str != 'max':
+            quota = int(quota_str) / int(period_str)
+    except (OSError, ValueError):
+        try:
+            # cgroup v1
+            quota_us = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_quota_us').read_text())
+            period_us = int(Path('/sys/fs/cgroup/cpu/cpu.cfs_period_us').read_text())
+            if quota_us > 0:
+                quota = quota_us / period_us
+        except (OSError, ValueError):
+            pass
+
+    if quota is not None:
+        cores = min(cores, max(1, math.ceil(quota)))
+
+    return cores
+
+def get_available_memory_mb()->int:
+    """
+    Determine how much memory is available for new processes, taking any cgroup
+    memory limit into account.
+
+    Returns
+    -------
+    int
+        The available memory in MiB, or None if it can't be determined.
+    """
+    available = None
+    try:
+        for line in Path('/proc/meminfo').read_text().splitlines():
+            if line.startswith('MemAvailable:'):
+                available = int(line.split()[1]) // 1024
+                break
+    except (OSError, ValueError):
+        pass
+
+    for limit_file, usage_file in [('memory.max', 'memory.current'),
+                                   ('memory/memory.limit_in_bytes', 'memory/memory.usage_in_bytes')]:
+        try:
+            limit = Path('/sys/fs/cgroup', limit_file).read_text().strip()
+            if limit == 'max':
+                break
+            usage = int(Path('/sys/fs/cgroup', usage_file).read_text())
+            cgroup_available = max(0, int(limit) - usage) // 2**20
+            # cgroup v1 reports a huge number when unlimited
+            if available is None or cgroup_available < available:
+                available = cgroup_available
+            break
+        except (OSError, ValueError):
+            continue
+
+    return available
+
+def choose_make_jobs(max_jobs:int, job_mem_mb:int)->int:
+    """
+    Decide how many parallel make jobs to run based on the current load average
+    and the available memory. A task running concurrently with others uses the
+    memory the scheduler allotted to it instead, since its cores were already
+    chosen with the load in mind.
+
+    Parameters
+    ----------
+    max_jobs : int
+        The most jobs to run.
+    job_mem_mb : int
+        The expected peak memory use of each job in MiB.
+
+    Returns
+    -------
+    int
+        The number of jobs, at least 1.
+    """
+    jobs = max_jobs
+    if sys_info['task_label'] is not None:
+        if sys_info['task_mem_mb'] is not None:
+            jobs = min(jobs, sys_info['task_mem_mb'] // job_mem_mb)
+        return max(1, jobs)
+
+    try:
+        idle_cores = get_cpu_limit() - math.floor(os.getloadavg()[0])
+        jobs = min(jobs, idle_cores)
+    except OSError:
+        pass
+
+    available_mb = get_available_memory_mb()
+    if available_mb is not None:
+        jobs = min(jobs, available_mb // job_mem_mb)
 
-def make_install(parallel_procs:int=sys_info['compile_cores'], make_args = None, do_install=True):
+    return max(1, jobs)
+
+def make_install(parallel_procs:int=None, make_args = None, do_install=True,
+                 build_key:str=None, cache_key:str=None, fix_stage=None):
     """
     Run 'make' followed by 'make install' in the current directory.
 
     Parameters
     ----------
     parallel_procs : int
-        Start this many parallel make processes. Defaults to half of the system cores.
-        Some packages fail when built in parallel, so 1 should be used in those cases.
+        Start at most this many parallel make processes. Defaults to the cores allotted
+        to the running task, or all usable cores outside of a task. Fewer are used if
+        the system is busy or short on memory. Some packages fail when built in
+        parallel, so 1 should be used in those cases.
+    make_args : list
+        Additional arguments for the 'make' command.
+    do_install : bool
+        Run 'make install' after building if true.
+    build_key : str
+        A key in the build_info dict with info about the package being built.
+    cache_key : str
+        If not None, add the staged install to the artifact cache under this key and
+        install it from there.
+    fix_stage : callable
+        If not None, called with the staged prefix directory after 'make install' to
+        add to what the package installs.
     """
-    note('Building')
+    if parallel_procs is None:
+        parallel_procs = sys_info['task_cores'] or sys_info['compile_cores']
+
+    job_mem_mb = build_info[build_key].get('make_job_mem_mb', 512) if build_key else 512
+    parallel_procs = choose_make_jobs(parallel_procs, job_mem_mb)
+
+    note(f'Building with {parallel_procs} parallel job{"s" if parallel_procs > 1 else ""}')
+    # Each task runs in its own process, so this doesn't affect concurrent builds
     os.environ['MAKEFLAGS'] = f'-j {str(parallel_procs)}'
     make_cmd=[opts['make_name']]
     if make_args is not None:
@@ -449,11 +1143,44 @@ def make_install(parallel_procs:int=sys_info['compile_cores'], make_args = None,
     note_ok()
 
     if do_install is True:
-        note('Installing')
-        run_cmd(cmd_list=[opts['make_name'],'install'])
+        # Install into a staging directory first to find out exactly which files are installed
+        stage_dir = Path.cwd() / 'install_stage'
+        if stage_dir.exists():
+            shutil.rmtree(stage_dir) # Left by an earlier run in a persistent build tree
+        note('Installing to staging directory')
+        run_cmd(cmd_list=[opts['make_name'], 'install', f'DESTDIR={stage_dir}'])
+        if fix_stage is not None:
+            fix_stage(Path(stage_dir, *Path(opts['prefix']).parts[1:]))
         note_ok()
 
-def run_conda_cmd(cmd_args):
+        if cache_key is None:
+            install_staged_files(build_key, stage_dir)
+        else:
+            with trace_phase(f'store {build_key}', 'artifact'):
+                store_artifact(build_key, cache_key, stage_dir)
+            restore_artifact(build_key, cache_key)
+        shutil.rmtree(stage_dir)
+
+def install_staged_files(build_key:str, stage_dir:Path):
+    """
+    Copy the files that 'make install' put in a staging directory into the prefix and
+    add them to the install manifest.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the package being installed.
+    stage_dir : Path
+        The DESTDIR that 'make install' used.
+    """
+    note('Installing')
+    stage_prefix = Path(stage_dir, *Path(opts['prefix']).parts[1:])
+    files = copy_tree_into(stage_prefix, get_install_prefix())
+    if build_key is not None:
+        record_manifest(build_key, files)
+    note_ok()
+
+def run_conda_cmd(cmd_args, capture:bool=False):
     """
     Shorthand for performing a conda operation.
 
@@ -462,6 +1189,8 @@ def run_conda_cmd(cmd_args):
     cmd_list : list
         Each token of the command line is a separate member of the list. The conda
         executable name is prepended, so should not be included in the list.
+    capture : bool
+        If true, keep the full output in the result.
 
     Returns
     -------
@@ -470,10 +1199,10 @@ def run_conda_cmd(cmd_args):
     """
     cmd_list = [opts['conda_cmd']]
     cmd_list.extend(cmd_args)
-    return run_cmd(cmd_list)
+    return run_cmd(cmd_list, capture=capture)
 
 
-def pip_install(pip_install_args, pkg_desc='packages'):
+def pip_install(pip_install_args, pkg_desc='packages', python_cmd='python'):
     """
     Shorthand for performing a 'pip install' operation.
 
@@ -482,29 +1211,120 @@ def pip_install(pip_install_args, pkg_desc='packages'):
     pip_install_args : list
         Each token of the command line is a separate member of the list. The
         is prepended with 'python -m pip install'; '-q' is added when not verbose.
+    pkg_desc : str
+        A description of the packages for status messages.
+    python_cmd : str
+        The Python interpreter to install the packages for.
     """
-    cmd_list = ['python', '-m', 'pip', 'install']
+    cmd_list = [python_cmd, '-m', 'pip', 'install']
     if opts['verbose'] is False:
         cmd_list.append('-q')
+    if opts['offline'] is True:
+        cmd_list.append('--no-index')
     cmd_list.extend(pip_install_args)
     note(f'Installing {pkg_desc} with pip')
     run_cmd(cmd_list)
     note_ok()
 
-def install_conda_pkg(pkg_name:str):
+def pip_install_package(pip_install_args:list, pkg_desc:str):
     """
-    Shorthand for performing a 'conda install' operation for a single package.
+    Install a package built from source with pip. When its wheel is wanted for a
+    staged install or a bundle, build the wheel first and install that. During a staged
+    install, the wheel is only installed when the install is committed.
 
     Parameters
     ----------
-    pkg_name : str
-        The name of the package to install.
+    pip_install_args : list
+        The arguments for 'pip install', ending with the source directory.
+    pkg_desc : str
+        A description of the package for status messages.
     """
-    note(f'Installing {pkg_name.upper()} with conda')
-    install_args = ['install', '-y', pkg_name]
-    run_conda_cmd(cmd_args=install_args)
+    if sys_info['wheel_dir'] is None:
+        pip_install(pip_install_args, pkg_desc=pkg_desc)
+        return
+
+    wheel_dir = Path(sys_info['wheel_dir']) / pkg_desc
+    cmd_list = ['python', '-m', 'pip', 'wheel', '--no-deps', '-w', str(wheel_dir)]
+    if opts['verbose'] is False:
+        cmd_list.append('-q')
+    if opts['offline'] is True:
+        cmd_list.append('--no-index')
+    cmd_list.extend(pip_install_args)
+    note(f'Building {pkg_desc} wheel')
+    run_cmd(cmd_list)
     note_ok()
 
+    if sys_info['stage_root'] is None:
+        pip_install([str(w) for w in sorted(wheel_dir.glob('*.whl'))], pkg_desc=pkg_desc)
+
+def conda_install_args()->list:
+    """
+    Create the start of a conda install command.
+
+    Returns
+    -------
+    list
+        The arguments, with --offline added if the network shouldn't be used.
+    """
+    args = ['install', '-y']
+    if opts['offline'] is True:
+        args.append('--offline')
+
+    return args
+
+def install_conda_pkgs(build_keys:list)->list:
+    """
+    Install the conda packages for several items in a single transaction, so conda only
+    has to solve the environment once. If that fails and --fall-back is used, each item
+    is tried on its own to find the ones that can't be installed with conda.
+
+    Parameters
+    ----------
+    build_keys : list
+        The build_info keys of the items to install.
+
+    Returns
+    -------
+    list
+        The build_info keys of the items that were installed with conda.
+    """
+    pkg_list = [pkg for key in build_keys for pkg in build_info[key]['conda_pkgs']]
+    note(f'Installing {", ".join(key.upper() for key in build_keys)} with conda')
+    try:
+        run_conda_cmd(cmd_args=conda_install_args() + pkg_list)
+        note_ok()
+        return build_keys
+    except Exception as e:
+        try_fallback(', '.join(key.upper() for key in build_keys), e)
+
+    installed = []
+    for key in build_keys:
+        note(f'Installing {key.upper()} with conda')
+        try:
+            run_conda_cmd(cmd_args=conda_install_args() + build_info[key]['conda_pkgs'])
+            note_ok()
+            installed.append(key)
+        except Exception as e:
+            try_fallback(key.upper(), e)
+
+    return installed
+
+def installed_with_conda(build_key:str)->bool:
+    """
+    Determine whether the 'conda' task installed an item.
+
+    Parameters
+    ----------
+    build_key : str
+        The build_info key of the item.
+
+    Returns
+    -------
+    bool
+        True if the item was installed with conda, otherwise False.
+    """
+    return build_key in sys_info['task_results'].get('conda', [])
+
 def pushd(dirname):
     """
     Preserve the current directory name in a stack, then change to the specified directory.
@@ -534,10 +1354,11 @@ def get_coin_inc_dir()->str:
         The absolute path to the correct existing directory, or None if not found.
     """
     coin_inc_dirs = ['coin-or', 'coin']
-    for coin_dir in coin_inc_dirs:
-        coin_path = Path(opts["prefix"]) / 'include' / coin_dir
-        if coin_path.is_dir():
-            return str(coin_path)
+    for prefix in get_dep_prefixes():
+        for coin_dir in coin_inc_dirs:
+            coin_path = prefix / 'include' / coin_dir
+            if coin_path.is_dir():
+                return str(coin_path)
 
     return None
 
@@ -559,112 +1380,1766 @@ def get_coin_lib_name(pkg:str)->str:
 
     for lv in lib_vars:
         lib_glob = f"lib{lv}{pkg}*"
-        found_libs = sorted(Path(f"{opts['prefix']}/lib").glob(lib_glob))
-        if len(found_libs) > 0:
-            return f'{lv}{pkg}'
+        for prefix in get_dep_prefixes():
+            if len(sorted((prefix / 'lib').glob(lib_glob))) > 0:
+                return f'{lv}{pkg}'
 
     return None
 
-def git_clone(build_key:str, auto_delete:bool=True):
+def get_stage_prefix()->Path:
     """
-    Create a temporary directory, change to it, and clone the repository associated
-    with the specified package key.
-
-    Parameters
-    ----------
-    build_key : str
-        A key in the build_info dict with info about the selected package.
-    auto_delete : bool
-        Override the 'keep_build_dir' setting. Auto-delete if true, leave if false.
+    Find where the prefix is mirrored in the staging tree of a staged install.
 
     Returns
     -------
-    context manager OR str
-        When the 'keep_build_dir' option is False, an object with info about the directory,
-        which causes the directory to be cleaned up and removed when it goes out of scope.
-        When the 'keep_build_dir' option is True, returns a str with the name of the folder.
+    Path
+        The staged prefix, or None if not doing a staged install.
     """
-    d = build_info[build_key]
-    announce(f'Building {build_key.upper()} from source code')
-    if opts['keep_build_dir'] is True or auto_delete is False:
-        build_dir = tempfile.mkdtemp()
-        dir_name = build_dir
-        print(f"Remember to delete {code(subst_env_for_path(dir_name))} afterwards.")
-    else:
-        build_dir = tempfile.TemporaryDirectory()
-        dir_name = build_dir.name
+    if sys_info['stage_root'] is None:
+        return None
 
-    note(f'Cloning {d["url"]}')
-    run_cmd(cmd_list=['git', 'clone', '-q', d['url'], dir_name])
-    note_ok()
-    pushd(dir_name)
+    return Path(sys_info['stage_root'], 'root', *Path(opts['prefix']).parts[1:])
 
-    # We don't care about the "detached HEAD" warning:
-    run_cmd(cmd_list=['git', 'config', '--local', 'advice.detachedHead', 'false'])
-    run_cmd(cmd_list=['git', 'checkout', '-q', d['branch']])
-    return build_dir
+def get_install_prefix()->Path:
+    """
+    Determine where to put installed files right now.
 
-def allow_build(build_key:str) -> bool:
+    Returns
+    -------
+    Path
+        The staged prefix during a staged install, otherwise the prefix itself.
     """
-    Determine whether the specified package should be built from source.
+    return get_stage_prefix() or Path(opts['prefix'])
 
-    Parameters
-    ----------
-    build_key : str
-        A key in the build_info dict with info about the selected package.
+def get_dep_prefixes()->list:
+    """
+    Determine where to look for the packages that others are built against. During a
+    staged install, packages built in this run are in the staging tree, while others
+    may already be installed in the prefix.
 
     Returns
     -------
-    bool
-        True if the package is not yet installed or force_build is true, false if already built.
+    list
+        The prefixes to search, in order.
     """
-    coin_dir = get_coin_inc_dir()
-    if coin_dir is None:
-        build_ok = True
-    else:
-        d = build_info[build_key]
-        include_file = Path(coin_dir) / d['include_subdir'] / d['include_file']
-        build_ok = opts['force_build'] or not include_file.is_file()
+    return [p for p in [get_stage_prefix(), Path(opts['prefix'])] if p is not None]
 
-    if build_ok is False:
-        print(f"{build_key.upper()} is already installed under {opts['prefix']}, {yellow('skipping build')}.")
+def get_dep_lib_flags()->str:
+    """
+    Create the linker flags for finding the libraries of installed packages.
+
+    Returns
+    -------
+    str
+        The -L flags, and on Linux during a staged install, a flag to let the linker
+        find libraries that staged libraries depend on.
+    """
+    flags = [f'-L{prefix}/lib' for prefix in get_dep_prefixes()]
+    if sys_info['stage_root'] is not None and sys_info['sys_name'] != 'Darwin':
+        flags.append(f'-Wl,-rpath-link,{get_stage_prefix()}/lib')
+
+    return ' '.join(flags)
+
+def final_path(path:str)->str:
+    """
+    Find where a path in the staging tree will be once the install is committed.
+
+    Parameters
+    ----------
+    path : str
+        A path that may be in the staged prefix.
+
+    Returns
+    -------
+    str
+        The path in the prefix.
+    """
+    stage_prefix = get_stage_prefix()
+    if stage_prefix is None:
+        return path
+
+    return path.replace(str(stage_prefix), opts['prefix'])
+
+def normalize_prefix(arg:str)->str:
+    """
+    Replace the prefix and the staged prefix with placeholders, so a build can be
+    identified the same way whatever environment it's installed in.
+
+    Parameters
+    ----------
+    arg : str
+        A configure argument or other build input.
+
+    Returns
+    -------
+    str
+        The argument with the prefixes replaced by @STAGE@ and @PREFIX@.
+    """
+    stage_prefix = get_stage_prefix()
+    if stage_prefix is not None:
+        arg = arg.replace(str(stage_prefix), '@STAGE@')
+
+    return arg.replace(opts['prefix'], '@PREFIX@')
+
+def make_build_dir(auto_delete:bool=True):
+    """
+    Create a temporary directory to build a package in.
+
+    Parameters
+    ----------
+    auto_delete : bool
+        Override the 'keep_build_dir' setting. Auto-delete if true, leave if false.
+
+    Returns
+    -------
+    context manager OR str
+        When the 'keep_build_dir' option is False, an object with info about the directory,
+        which causes the directory to be cleaned up and removed when it goes out of scope.
+        When the 'keep_build_dir' option is True, returns a str with the name of the folder.
+    str
+        The name of the directory.
+    """
+    if opts['keep_build_dir'] is True or auto_delete is False:
+        build_dir = tempfile.mkdtemp()
+        dir_name = build_dir
+        print(f"Remember to delete {code(subst_env_for_path(dir_name))} afterwards.")
+    else:
+        build_dir = tempfile.TemporaryDirectory()
+        dir_name = build_dir.name
+
+    return build_dir, dir_name
+
+@contextlib.contextmanager
+def lock_file(lock_path:Path):
+    """
+    Hold an exclusive lock on a file while the context is active. POSIX locks are
+    used so that the lock works on NFS too.
+
+    Parameters
+    ----------
+    lock_path : Path
+        The file to lock, which is created if necessary.
+    """
+    lock_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path, 'a', encoding='utf-8') as f:
+        fcntl.lockf(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.lockf(f, fcntl.LOCK_UN)
+
+def get_mirror_path(build_key:str)->Path:
+    """
+    Determine where the mirror of a package's repository is kept.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    Path
+        The bare mirror, named after the repository and a digest of its URL.
+    """
+    url = build_info[build_key]['url']
+    repo_name = re.sub(r'\.git$', '', url.rstrip('/').split('/')[-1])
+    url_hash = hashlib.sha256(url.encode('utf-8')).hexdigest()[:12]
+    return Path(opts['mirror_dir']) / f'{repo_name}-{url_hash}.git'
+
+def update_git_mirror(build_key:str)->str:
+    """
+    Create or refresh the bare mirror of the repository associated with the specified
+    package key.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    str
+        The path to the mirror.
+    """
+    url = build_info[build_key]['url']
+    mirror_path = get_mirror_path(build_key)
+    repo_name = mirror_path.name.rsplit('-', 1)[0]
+
+    with lock_file(mirror_path.with_suffix('.lock')):
+        if mirror_path.is_dir() and opts['offline'] is True:
+            print(f'Using mirror of {url} without updating it')
+            return str(mirror_path)
+        elif opts['offline'] is True:
+            raise RuntimeError(f'There is no mirror of {url} in {opts["mirror_dir"]}, and --offline was used.')
+        elif mirror_path.is_dir():
+            note(f'Updating mirror of {url}')
+            result = run_cmd(cmd_list=['git', '-C', str(mirror_path), 'fetch', '-q', '--prune'],
+                             raise_error=False)
+            if result is None:
+                note_failed()
+                print(f'{yellow("WARNING")}: Could not update the mirror, using it as is.')
+                return str(mirror_path)
+        else:
+            note(f'Creating mirror of {url}')
+            # Clone to a temporary name so a partial mirror is never used
+            tmp_path = Path(tempfile.mkdtemp(dir=opts['mirror_dir'], prefix=f'.{repo_name}-'))
+            try:
+                run_cmd(cmd_list=['git', 'clone', '-q', '--mirror', url, str(tmp_path)])
+            except subprocess.CalledProcessError:
+                shutil.rmtree(tmp_path)
+                raise
+            tmp_path.chmod(0o755)
+            tmp_path.rename(mirror_path)
+
+        note_ok()
+
+    return str(mirror_path)
+
+def get_build_tree_path(build_key:str)->Path:
+    """
+    Determine where a package is built when using a persistent build root.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    Path
+        The build directory, named after the package and branch.
+    """
+    branch_name = re.sub(r'[^\w.-]+', '-', build_info[build_key]['branch'])
+    return Path(opts['build_root']) / f'{build_key}-{branch_name}'
+
+def git_revision(dir_name:str='.', ref:str='HEAD')->str:
+    """
+    Find the commit that a git reference points to.
+
+    Parameters
+    ----------
+    dir_name : str
+        The directory of the git repository.
+    ref : str
+        The branch, tag, or other reference to look up.
+
+    Returns
+    -------
+    str
+        The full commit hash.
+    """
+    result = run_cmd(cmd_list=['git', '-C', dir_name, 'rev-parse', '-q', '--verify', f'{ref}^{{commit}}'],
+                     capture=True)
+    return result.stdout.strip()
+
+def update_build_tree(build_key:str, dir_name:str):
+    """
+    Bring the clone in a persistent build tree up to date with the selected branch. If
+    the revision hasn't changed, nothing is checked out, so build products and local
+    changes are kept.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    dir_name : str
+        The persistent build directory.
+    """
+    d = build_info[build_key]
+    with trace_phase(f'update {build_key}', 'clone'):
+        source = update_git_mirror(build_key) if opts['mirror_dir'] is not None else d['url']
+        note(f'Updating {code(subst_env_for_path(dir_name))}')
+        old_rev = git_revision(dir_name)
+        result = run_cmd(cmd_list=['git', '-C', dir_name, 'fetch', '-q', source, d['branch']],
+                         raise_error=False)
+        if result is None:
+            note_failed()
+            print(f'{yellow("WARNING")}: Could not fetch {d["branch"]}, using the build tree as is.')
+            return
+
+        new_rev = git_revision(dir_name, 'FETCH_HEAD')
+        if new_rev != old_rev:
+            run_cmd(cmd_list=['git', '-C', dir_name, 'checkout', '-q', '--detach', new_rev])
+        note_ok()
+
+    status = 'is still at' if new_rev == old_rev else 'updated to'
+    print(f'{build_key.upper()} build tree {status} {d["branch"]} ({new_rev[:12]})')
+
+def prepare_source(step_name:str, source_id:str, func):
+    """
+    Perform a step that downloads or extracts source code into the current build
+    directory. In a persistent build tree, skip it if it was already done with the
+    same source, so the files keep their timestamps and make doesn't rebuild them.
+
+    Parameters
+    ----------
+    step_name : str
+        A name for the step, unique within the build directory.
+    source_id : str
+        Identifies the source, like the git revision of the get.* script or the
+        digest of an archive.
+    func : callable
+        Called with no arguments to perform the step.
+    """
+    stamp_path = Path(f'.build_pyoptsparse-{step_name}')
+    if opts['build_root'] is not None:
+        if stamp_path.is_file() and stamp_path.read_text().strip() == source_id:
+            return
+        if stamp_path.is_file():
+            stamp_path.unlink()
+
+    func()
+
+    if opts['build_root'] is not None:
+        stamp_path.write_text(source_id + '\n')
+
+# Autoconf cache variables that only depend on the compilers and the system, so the
+# configure scripts of different packages can share them. Answers that depend on the
+# compiler and linker flags, like the Fortran runtime libraries, aren't shared, since
+# the packages, --profile, and the PGO passes use different flags.
+shared_configure_vars = re.compile(
+    r'^ac_cv_(build|host|objext|exeext|path_\w+|(f77|fc)_mangling|'
+    r'header_(stdc|stdio_h|stdlib_h|string_h|strings_h|memory_h|inttypes_h|stdint_h|'
+    r'unistd_h|sys_types_h|sys_stat_h|dlfcn_h|wchar_h))$')
+
+def get_configure_cache_dir()->Path:
+    """
+    Find the configure cache directory for the selected compilers and prefix, so that
+    cached answers are never used with a different toolchain.
+
+    Returns
+    -------
+    Path
+        The directory for the cache files.
+    """
+    if sys_info['configure_cache_dir'] is None:
+        toolchain = {
+            'compilers': {var: get_tool_identity(cmd) for var, cmd in sys_info['compilers'].items()},
+            'env': {var: os.environ.get(var, '') for var in ['CC', 'CXX', 'FC', 'F77', 'CPP', 'LD']},
+            'system': [sys_info['sys_name'], platform.release(), platform.machine()],
+            'prefix': opts['prefix']
+        }
+        digest = hashlib.sha256(json.dumps(toolchain, sort_keys=True).encode('utf-8')).hexdigest()
+        sys_info['configure_cache_dir'] = str(Path(opts['cache_dir']) / 'configure' / digest[:16])
+
+    return Path(sys_info['configure_cache_dir'])
+
+def read_configure_cache(cache_file:Path)->dict:
+    """
+    Read the variables in an autoconf cache file.
+
+    Parameters
+    ----------
+    cache_file : Path
+        The file written by configure --cache-file.
+
+    Returns
+    -------
+    dict
+        The line that sets each variable, keyed by variable name.
+    """
+    entries = {}
+    if cache_file.is_file():
+        with open(cache_file, encoding='utf-8', errors='replace') as f:
+            for line in f:
+                match = re.match(r'^(\w+_cv_\w+)=\$\{\1=', line)
+                if match is not None:
+                    entries[match.group(1)] = line.rstrip('\n')
+
+    return entries
+
+def write_configure_cache(cache_file:Path, entries:dict):
+    """
+    Replace an autoconf cache file without leaving a partial one behind.
+
+    Parameters
+    ----------
+    cache_file : Path
+        The cache file to write.
+    entries : dict
+        The line that sets each variable, keyed by variable name.
+    """
+    fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, prefix=f'.{cache_file.name}-')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for name in sorted(entries):
+            f.write(entries[name] + '\n')
+    os.replace(tmp_name, cache_file)
+
+def configure_with_cache(build_key:str, cnf_cmd_list:list):
+    """
+    Run a configure script in the current directory. If --configure-cache is used, give
+    it a cache file for this package and configure command, seeded with the shared
+    answers found by other packages, then add its new shareable answers to those.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cnf_cmd_list : list
+        The configure command line.
+    """
+    if opts['configure_cache'] is False:
+        run_cmd(cmd_list=cnf_cmd_list)
+        return
+
+    # Variables like CFLAGS must match between runs that use the same cache file
+    cnf_id = json.dumps([[normalize_prefix(arg) for arg in cnf_cmd_list],
+                         {var: normalize_prefix(os.environ.get(var, '')) for var in
+                          ['CFLAGS', 'CXXFLAGS', 'FCFLAGS', 'FFLAGS', 'CPPFLAGS', 'LDFLAGS', 'LIBS']}])
+    cnf_digest = hashlib.sha256(cnf_id.encode('utf-8')).hexdigest()[:16]
+
+    cache_dir = get_configure_cache_dir()
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_file = cache_dir / f'{build_key}-{cnf_digest}.cache'
+    shared_file = cache_dir / 'shared.cache'
+
+    # Filtered again, since shared files from older versions of this script may hold more
+    with lock_file(cache_dir / 'shared.lock'):
+        entries = {name: line for name, line in read_configure_cache(shared_file).items()
+                   if shared_configure_vars.match(name) is not None}
+    entries.update(read_configure_cache(cache_file))
+    write_configure_cache(cache_file, entries)
+
+    try:
+        run_cmd(cmd_list=cnf_cmd_list + [f'--cache-file={cache_file}'])
+    except subprocess.CalledProcessError:
+        # Don't let a bad cached answer break the build
+        note_failed()
+        print(f'{yellow("WARNING")}: configure failed with cached results, trying without them.')
+        cache_file.unlink()
+        note("Running configure without cached results")
+        run_cmd(cmd_list=cnf_cmd_list)
+        return
+
+    new_entries = {name: line for name, line in read_configure_cache(cache_file).items()
+                   if shared_configure_vars.match(name) is not None}
+    with lock_file(cache_dir / 'shared.lock'):
+        entries = {name: line for name, line in read_configure_cache(shared_file).items()
+                   if shared_configure_vars.match(name) is not None}
+        entries.update(new_entries)
+        write_configure_cache(shared_file, entries)
+
+def run_configure(build_key:str, cnf_cmd_list:list, deps:list=None, extra_inputs:dict=None):
+    """
+    Run the configure script in the current directory. In a persistent build tree, skip
+    it if it already ran with the same inputs and source revision, and remove the old
+    build products if the inputs changed, since make doesn't track compiler flags.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cnf_cmd_list : list
+        The configure command line.
+    deps : list
+        Keys of previously installed packages the build links against.
+    extra_inputs : dict
+        Any other information that affects the build.
+    """
+    if opts['build_root'] is None:
+        note("Running configure")
+        configure_with_cache(build_key, cnf_cmd_list)
+        note_ok()
+        return
+
+    stamp_path = Path('.build_pyoptsparse-configure.json')
+    inputs = build_inputs(build_key, cnf_cmd_list, deps=deps, extra_inputs=extra_inputs)
+    inputs['prefix'] = opts['prefix']
+    revision = git_revision()
+
+    stamp = None
+    if stamp_path.is_file():
+        with open(stamp_path, encoding='utf-8') as f:
+            stamp = json.load(f)
+        stamp_path.unlink() # Don't trust it if configure fails this time
+
+    if stamp is not None and Path('config.status').is_file() and stamp['inputs'] == inputs:
+        if stamp['revision'] == revision:
+            print(f'{build_key.upper()} configure inputs are unchanged, skipping configure')
+        else:
+            note("Running configure for the new revision")
+            configure_with_cache(build_key, cnf_cmd_list)
+            note_ok()
+    else:
+        note("Running configure")
+        configure_with_cache(build_key, cnf_cmd_list)
+        note_ok()
+        if stamp is not None and Path('Makefile').is_file():
+            note("Removing objects built with the previous configuration")
+            run_cmd(cmd_list=[opts['make_name'], 'clean'])
+            note_ok()
+
+    with open(stamp_path, 'w', encoding='utf-8') as f:
+        json.dump({'inputs': inputs, 'revision': revision}, f, indent=2)
+
+def dir_size(dir_name:str)->int:
+    """
+    Add up the sizes of all files under a directory.
+
+    Parameters
+    ----------
+    dir_name : str
+        The top of the directory tree.
+
+    Returns
+    -------
+    int
+        The total size in bytes.
+    """
+    total = 0
+    for root, dirs, files in os.walk(dir_name):
+        for name in files:
+            file_path = Path(root) / name
+            if not file_path.is_symlink():
+                total += file_path.stat().st_size
+
+    return total
+
+def shallow_clone(build_key:str, dir_name:str)->bool:
+    """
+    Clone only the selected branch or tag of a repository without history.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    dir_name : str
+        The existing empty directory to clone into.
+
+    Returns
+    -------
+    bool
+        True if successful, false if the server or ref doesn't support it.
+    """
+    d = build_info[build_key]
+    result = run_cmd(cmd_list=['git', 'clone', '-q', '--depth', '1', '--single-branch',
+                               '--branch', d['branch'], d['url'], dir_name], raise_error=False)
+    if result is not None:
+        return True
+
+    # Leave the directory empty for a full clone
+    for item in Path(dir_name).iterdir():
+        if item.is_dir() and not item.is_symlink():
+            shutil.rmtree(item)
+        else:
+            item.unlink()
+
+    return False
+
+def git_clone(build_key:str, auto_delete:bool=True, dir_name:str=None):
+    """
+    Create a temporary directory, change to it, and clone the repository associated
+    with the specified package key.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    auto_delete : bool
+        Override the 'keep_build_dir' setting. Auto-delete if true, leave if false.
+    dir_name : str
+        Clone into this existing empty directory instead of creating a temporary one.
+        The caller is responsible for removing it, but auto_delete should indicate
+        whether it will be. Ignored when using a persistent build root, where an
+        existing clone is updated instead.
+
+    Returns
+    -------
+    context manager OR str
+        When the 'keep_build_dir' option is False, an object with info about the directory,
+        which causes the directory to be cleaned up and removed when it goes out of scope.
+        When the 'keep_build_dir' option is True, returns a str with the name of the folder.
+    """
+    d = build_info[build_key]
+    announce(f'Building {build_key.upper()} from source code')
+    if opts['build_root'] is not None:
+        dir_name = str(get_build_tree_path(build_key))
+        build_dir = dir_name
+        if (Path(dir_name) / '.git').is_dir():
+            update_build_tree(build_key, dir_name)
+            pushd(dir_name)
+            return build_dir
+
+        # Start over if an earlier clone didn't finish
+        if Path(dir_name).exists():
+            shutil.rmtree(dir_name)
+        Path(dir_name).mkdir(parents=True)
+    elif dir_name is None:
+        build_dir, dir_name = make_build_dir(auto_delete)
+    else:
+        build_dir = dir_name
+
+    clone_stats = {'mode': 'full'}
+    with trace_phase(f'clone {build_key}', 'clone', clone_stats):
+        start_time = time.perf_counter()
+        if opts['mirror_dir'] is None:
+            note(f'Cloning {d["url"]}')
+            if opts['shallow_clone'] is True and shallow_clone(build_key, dir_name):
+                clone_stats['mode'] = 'shallow'
+            else:
+                run_cmd(cmd_list=['git', 'clone', '-q', d['url'], dir_name])
+        else:
+            clone_stats['mode'] = 'mirror'
+            mirror_path = update_git_mirror(build_key)
+            note(f'Cloning {d["url"]} from mirror')
+            clone_cmd = ['git', 'clone', '-q']
+            # Borrowing objects from the mirror is fastest, but a directory that is kept
+            # must not break if the mirror is pruned later.
+            if opts['keep_build_dir'] is False and auto_delete is True and opts['build_root'] is None:
+                clone_cmd.append('--shared')
+            clone_cmd.extend([mirror_path, dir_name])
+            run_cmd(cmd_list=clone_cmd)
+            run_cmd(cmd_list=['git', '-C', dir_name, 'remote', 'set-url', 'origin', d['url']])
+        note_ok()
+        pushd(dir_name)
+
+        # We don't care about the "detached HEAD" warning:
+        run_cmd(cmd_list=['git', 'config', '--local', 'advice.detachedHead', 'false'])
+        run_cmd(cmd_list=['git', 'checkout', '-q', d['branch']])
+
+        if opts['shallow_clone'] is True and clone_stats['mode'] == 'full':
+            print(f'{yellow("NOTE")}: Shallow clone of {d["branch"]} failed, used a full clone.')
+
+        clone_stats['git_mib'] = round(dir_size('.git') / 2**20, 1)
+        clone_stats['seconds'] = round(time.perf_counter() - start_time, 1)
+        print(f'{build_key.upper()} checkout ({clone_stats["mode"]}): {clone_stats["git_mib"]} MiB '
+              f'of git data in {clone_stats["seconds"]}s')
+
+    return build_dir
+
+def is_installed(build_key:str)->bool:
+    """
+    Determine whether a package's include file is found in the prefix.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the package.
+
+    Returns
+    -------
+    bool
+        True if the package is installed.
+    """
+    d = build_info[build_key]
+    if 'include_file' not in d:
+        return False
+
+    return any((prefix / 'include' / coin_dir / d['include_subdir'] / d['include_file']).is_file()
+               for prefix in get_dep_prefixes() for coin_dir in ['coin-or', 'coin'])
+
+def allow_build(build_key:str) -> bool:
+    """
+    Determine whether the specified package should be built from source.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    bool
+        True if the package is not yet installed or force_build is true, false if already built.
+    """
+    build_ok = opts['force_build'] or not is_installed(build_key)
+
+    if build_ok is False:
+        print(f"{build_key.upper()} is already installed under {opts['prefix']}, {yellow('skipping build')}.")
 
     return build_ok
 
+def get_compiler_id()->dict:
+    """
+    Identify the selected compilers by path and version output.
+
+    Returns
+    -------
+    dict
+        Keyed by the CC, CXX, and FC environment variable names.
+    """
+    if sys_info['compiler_id'] is None:
+        compiler_id = {}
+        for var in ['CC', 'CXX', 'FC']:
+            comp_path = which(sys_info['compilers'][var]) if var in sys_info['compilers'] else None
+            version = None
+            if comp_path is not None:
+                result = subprocess.run([comp_path, '--version'], check=False,
+                                        capture_output=True, text=True)
+                version = result.stdout.strip()
+            compiler_id[var] = {'path': comp_path, 'version': version}
+
+        sys_info['compiler_id'] = compiler_id
+
+    return sys_info['compiler_id']
+
+def file_sha256(file_name:str)->str:
+    """
+    Compute the SHA-256 digest of a file's contents.
+
+    Parameters
+    ----------
+    file_name : str
+        The path to the file.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+@contextlib.contextmanager
+def open_manifest():
+    """
+    Open the database under the prefix that lists the files installed for each package,
+    locked so concurrent tasks take turns.
+
+    Yields
+    ------
+    SqliteDict
+        The manifest of each installed package, keyed by build_info key.
+    """
+    manifest_path = Path(opts['prefix']) / 'share' / 'build_pyoptsparse' / 'manifest.sqlite'
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    with lock_file(manifest_path.with_suffix('.lock')):
+        with SqliteDict(str(manifest_path), autocommit=True) as manifest:
+            yield manifest
+
+def get_manifest_entry(build_key:str)->dict:
+    """
+    Look up the install manifest of a package without creating the database.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    dict
+        The manifest entry, or None if the package isn't in the manifest.
+    """
+    if sys_info['stage_root'] is not None:
+        pending_path = Path(sys_info['stage_root']) / 'manifests' / f'{build_key}.json'
+        if pending_path.is_file():
+            with open(pending_path, encoding='utf-8') as f:
+                return json.load(f)
+
+    if not (Path(opts['prefix']) / 'share' / 'build_pyoptsparse' / 'manifest.sqlite').is_file():
+        return None
+
+    with open_manifest() as manifest:
+        return manifest.get(build_key)
+
+def record_manifest(build_key:str, rel_paths:list, build_id:str=None):
+    """
+    Record the size and digest of each file installed for a package. During a staged
+    install, the record is kept in the staging tree until it's committed.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the installed package.
+    rel_paths : list
+        The installed files, relative to the prefix.
+    build_id : str
+        Identifies the build, like the artifact cache key. If None, a digest of the
+        installed files is used.
+    """
+    files = {}
+    for rel_path in rel_paths:
+        file_path = get_install_prefix() / rel_path
+        if file_path.is_symlink():
+            files[rel_path] = {'link': os.readlink(file_path)}
+        else:
+            files[rel_path] = {'size': file_path.stat().st_size, 'sha256': file_sha256(str(file_path))}
+
+    if build_id is None:
+        # pkg-config and libtool files contain the prefix, so leave them out
+        digest = hashlib.sha256()
+        for rel_path in sorted(files):
+            if Path(rel_path).suffix not in ['.pc', '.la']:
+                digest.update(f"{rel_path}:{files[rel_path].get('sha256')}\n".encode('utf-8'))
+        build_id = digest.hexdigest()
+
+    entry = {
+        'build_id': build_id,
+        'branch': build_info[build_key]['branch'],
+        'installed': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'files': files
+    }
+
+    if sys_info['stage_root'] is not None:
+        pending_path = Path(sys_info['stage_root']) / 'manifests' / f'{build_key}.json'
+        pending_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(pending_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f)
+    else:
+        save_manifest_entry(build_key, entry)
+
+def save_manifest_entry(build_key:str, entry:dict):
+    """
+    Store the install manifest of a package, and remove files from its previous
+    install that weren't installed again.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the installed package.
+    entry : dict
+        The manifest entry created by record_manifest().
+    """
+    files = entry['files']
+    with open_manifest() as manifest:
+        old_entry = manifest.get(build_key)
+        manifest[build_key] = entry
+
+    if old_entry is not None:
+        remove_manifest_files({rel_path: info for rel_path, info in old_entry['files'].items()
+                               if rel_path not in files})
+
+def remove_manifest_files(files:dict)->list:
+    """
+    Remove files listed in an install manifest, and any directories left empty. A file
+    whose size or digest no longer matches the manifest was replaced or changed by
+    something else, so it's kept.
+
+    Parameters
+    ----------
+    files : dict
+        The manifest information of each file, keyed by path relative to the prefix.
+
+    Returns
+    -------
+    list
+        The relative paths of the files that were kept because they changed.
+    """
+    prefix = Path(opts['prefix'])
+    kept = []
+    parents = set()
+    for rel_path, info in files.items():
+        file_path = prefix / rel_path
+        if file_path.is_symlink():
+            if 'link' in info:
+                file_path.unlink()
+            else:
+                kept.append(rel_path)
+        elif file_path.is_file():
+            # The size is compared first to avoid reading files that clearly changed
+            if info.get('size') == file_path.stat().st_size and \
+                    info.get('sha256') == file_sha256(str(file_path)):
+                file_path.unlink()
+            else:
+                kept.append(rel_path)
+        parents.update(file_path.parents)
+
+    # Deepest first, so parents of removed directories can be removed too
+    for dir_path in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+        if dir_path in prefix.parents or dir_path == prefix or prefix not in dir_path.parents:
+            continue
+        try:
+            dir_path.rmdir()
+        except OSError:
+            pass # Not empty
+
+    return kept
+
+def installed_artifact_id(build_key:str)->str:
+    """
+    Identify the currently installed build of a package.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+
+    Returns
+    -------
+    str
+        The build ID from the install manifest, a digest of its library files if it
+        was installed without a manifest, or None if not installed.
+    """
+    entry = get_manifest_entry(build_key)
+    if entry is not None:
+        return entry['build_id']
+
+    lib_name = get_coin_lib_name(build_key)
+    if lib_name is None:
+        return None
+
+    # Libtool archives contain the prefix, so leave them out
+    digest = hashlib.sha256()
+    for lib_file in sorted(Path(f"{opts['prefix']}/lib").glob(f'lib{lib_name}*')):
+        if lib_file.is_file() and not lib_file.is_symlink() and lib_file.suffix != '.la':
+            digest.update(lib_file.name.encode())
+            digest.update(file_sha256(str(lib_file)).encode())
+
+    return digest.hexdigest()
+
+def build_inputs(build_key:str, cnf_cmd_list:list, deps:list=None, extra_inputs:dict=None)->dict:
+    """
+    Collect everything that affects the result of a package build, with the prefix
+    replaced by a placeholder.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cnf_cmd_list : list
+        The configure command line.
+    deps : list
+        Keys of previously installed packages the build links against.
+    extra_inputs : dict
+        Any other information that affects the build.
+
+    Returns
+    -------
+    dict
+        The build inputs.
+    """
+    # The prefix is replaced so the same build can be installed in different environments
+    d = build_info[build_key]
+    return {
+        'package': build_key,
+        'url': d['url'],
+        'branch': d['branch'],
+        'compilers': get_compiler_id(),
+        'configure': [normalize_prefix(arg) for arg in cnf_cmd_list],
+        'env': {var: normalize_prefix(os.environ.get(var, ''))
+                for var in ['CFLAGS', 'CXXFLAGS', 'FCFLAGS', 'LDFLAGS']},
+        'deps': {dep: installed_artifact_id(dep) for dep in (deps or [])},
+        'extra': extra_inputs or {}
+    }
+
+def artifact_key(build_key:str, cnf_cmd_list:list, deps:list=None, extra_inputs:dict=None)->str:
+    """
+    Compute the key of a package build from everything that affects the result.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cnf_cmd_list : list
+        The configure command line.
+    deps : list
+        Keys of previously installed packages the build links against.
+    extra_inputs : dict
+        Any other information that affects the build.
+
+    Returns
+    -------
+    str
+        The key, or None if the artifact cache is disabled.
+    """
+    if opts['artifact_cache'] is False:
+        return None
+
+    inputs = build_inputs(build_key, cnf_cmd_list, deps=deps, extra_inputs=extra_inputs)
+    if find_relocation_tool() is None:
+        # Library search paths can't be changed, so only share builds with the same prefix
+        inputs['prefix'] = opts['prefix']
+
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode('utf-8')).hexdigest()
+
+def get_artifact_dir(cache_key:str)->Path:
+    """
+    Determine where a cached build is stored.
+
+    Parameters
+    ----------
+    cache_key : str
+        The key computed by artifact_key().
+
+    Returns
+    -------
+    Path
+        The directory holding the cached build.
+    """
+    return Path(opts['cache_dir']) / 'artifacts' / cache_key
+
+def copy_tree_into(src_dir:Path, dest_dir:Path)->list:
+    """
+    Copy the files in a directory tree into another, merging with existing directories
+    and replacing existing files.
+
+    Parameters
+    ----------
+    src_dir : Path
+        The top of the tree to copy.
+    dest_dir : Path
+        Where to copy the tree to.
+
+    Returns
+    -------
+    list
+        The relative paths of the copied files.
+    """
+    copied = []
+    for root, dirs, files in os.walk(src_dir):
+        rel_root = Path(root).relative_to(src_dir)
+        # Symbolic links to directories are listed with dirs but copied as links
+        for name in sorted(files) + sorted(d for d in dirs if (Path(root) / d).is_symlink()):
+            src_file = Path(root) / name
+            dest_file = Path(dest_dir) / rel_root / name
+            dest_file.parent.mkdir(parents=True, exist_ok=True)
+            if dest_file.is_symlink() or dest_file.is_file():
+                dest_file.unlink()
+            if src_file.is_symlink():
+                dest_file.symlink_to(os.readlink(src_file))
+            else:
+                shutil.copy2(str(src_file), str(dest_file))
+            copied.append(str(rel_root / name))
+
+    return copied
+
+def start_staged_install():
+    """
+    Create the staging tree for a staged install. It's inside the prefix so that
+    staged files are on the same filesystem and can be moved into place by renaming.
+    Its location doesn't change between runs, so configure results in persistent build
+    trees that refer to it stay valid.
+    """
+    stage_root = Path(opts['prefix']) / '.build_pyoptsparse-stage'
+    if stage_root.exists():
+        note('Removing the staging tree of an interrupted install')
+        shutil.rmtree(stage_root)
+        note_ok()
+
+    stage_root.mkdir(parents=True)
+    sys_info['stage_root'] = str(stage_root)
+    print(f'Staging the install in {code(subst_env_for_path(sys_info["stage_root"]))}')
+
+def move_into_place(src_file:Path, dest_file:Path):
+    """
+    Replace a file with another one by renaming, so the destination is never missing
+    or partially written.
+
+    Parameters
+    ----------
+    src_file : Path
+        The file or symbolic link to move.
+    dest_file : Path
+        Where to move it to.
+    """
+    dest_file.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        os.replace(src_file, dest_file)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+
+        # Part of the prefix is on another filesystem, so copy next to the destination first
+        tmp_file = dest_file.parent / f'.{dest_file.name}.{os.getpid()}.tmp'
+        if src_file.is_symlink():
+            tmp_file.symlink_to(os.readlink(src_file))
+        else:
+            shutil.copy2(str(src_file), str(tmp_file))
+        os.replace(tmp_file, dest_file)
+        src_file.unlink()
+
+def commit_staged_install(python_cmd:str='python'):
+    """
+    Move everything from the staging tree into the prefix, record the install
+    manifests, and install the wheels that were built with pip.
+
+    Parameters
+    ----------
+    python_cmd : str
+        The Python interpreter of the environment in the prefix.
+    """
+    announce('Committing the staged install')
+    stage_root = Path(sys_info['stage_root'])
+    stage_prefix = get_stage_prefix()
+    prefix = Path(opts['prefix'])
+
+    with trace_phase('commit staged install', 'install'):
+        # Regular files are moved before symbolic links, so links never point to
+        # files that aren't there yet
+        staged_files = []
+        staged_links = []
+        for root, dirs, files in os.walk(stage_prefix):
+            for name in files + dirs:
+                staged_path = Path(root) / name
+                if staged_path.is_symlink():
+                    staged_links.append(staged_path)
+                elif name in files:
+                    staged_files.append(staged_path)
+
+        rewritten = finalize_staged_text_files(stage_prefix,
+                                               [p.relative_to(stage_prefix) for p in staged_files])
+
+        note(f'Moving {len(staged_files) + len(staged_links)} files into the prefix')
+        for staged_path in staged_files + staged_links:
+            move_into_place(staged_path, prefix / staged_path.relative_to(stage_prefix))
+        note_ok()
+
+        manifest_dir = stage_root / 'manifests'
+        if manifest_dir.is_dir():
+            note('Recording install manifests')
+            for pending_path in sorted(manifest_dir.glob('*.json')):
+                with open(pending_path, encoding='utf-8') as f:
+                    entry = json.load(f)
+                for rel_path in entry['files'].keys() & rewritten.keys():
+                    entry['files'][rel_path] = rewritten[rel_path]
+                save_manifest_entry(pending_path.stem, entry)
+            note_ok()
+
+        wheels = []
+        if sys_info['wheel_dir'] is not None:
+            wheels = sorted(Path(sys_info['wheel_dir']).glob('**/*.whl'))
+        if len(wheels) > 0:
+            pip_install([str(w) for w in wheels], pkg_desc='staged wheels', python_cmd=python_cmd)
+
+        shutil.rmtree(stage_root)
+        sys_info['stage_root'] = None
+
+def finalize_staged_text_files(tree_dir:Path, files:list)->dict:
+    """
+    Replace paths into the staging tree in pkg-config and libtool files with the paths
+    they will have in the prefix. Packages built against staged packages pick up their
+    -L flags, and the -Wl,-rpath-link flag only needed while staging.
+
+    Parameters
+    ----------
+    tree_dir : Path
+        The staged prefix, or a copy of the files installed in it.
+    files : list
+        The files to check, relative to tree_dir.
+
+    Returns
+    -------
+    dict
+        The manifest information of each rewritten file, keyed by path relative to
+        the prefix.
+    """
+    stage_prefix = get_stage_prefix()
+    if stage_prefix is None:
+        return {}
+
+    rpath_link = re.compile(rf'[ \t]*-Wl,-rpath-link,{re.escape(str(stage_prefix))}/lib')
+    rewritten = {}
+    for rel_path in files:
+        file_path = Path(tree_dir) / rel_path
+        if file_path.suffix not in ['.pc', '.la'] or file_path.is_symlink():
+            continue
+        data = file_path.read_text(encoding='utf-8')
+        if str(stage_prefix) not in data:
+            continue
+
+        data = rpath_link.sub('', data).replace(str(stage_prefix), opts['prefix'])
+        # Write a new file, since this one may be a hard link into another prefix
+        file_path.unlink()
+        file_path.write_text(data, encoding='utf-8')
+        rewritten[str(rel_path)] = {
+            'size': file_path.stat().st_size, 'sha256': file_sha256(str(file_path))
+        }
+
+    return rewritten
+
+def discard_staged_install():
+    """ Remove the staging tree after a failed build, leaving the prefix as it was. """
+    shutil.rmtree(sys_info['stage_root'], ignore_errors=True)
+    sys_info['stage_root'] = None
+    print(f'{yellow("NOTE")}: Discarded the staged install, '
+          f'{code(subst_env_for_path(opts["prefix"]))} was not changed.')
+
+def store_artifact(build_key:str, cache_key:str, stage_dir:Path):
+    """
+    Add a build that was installed into a staging directory to the artifact cache.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cache_key : str
+        The key computed by artifact_key().
+    stage_dir : Path
+        The DESTDIR that 'make install' used.
+    """
+    art_dir = get_artifact_dir(cache_key)
+    if art_dir.is_dir():
+        return
+
+    note(f'Adding {build_key.upper()} to the artifact cache')
+    art_dir.parent.mkdir(parents=True, exist_ok=True)
+
+    # Fill a temporary directory first so an interrupted copy is never used
+    tmp_dir = Path(tempfile.mkdtemp(dir=art_dir.parent, prefix=f'.{cache_key}-'))
+    tmp_dir.chmod(0o755)
+    stage_prefix = Path(stage_dir, *Path(opts['prefix']).parts[1:])
+    files = copy_tree_into(stage_prefix, tmp_dir / 'tree')
+    # The cached build may be installed without a staging tree
+    finalize_staged_text_files(tmp_dir / 'tree', files)
+    with open(tmp_dir / 'info.json', 'w', encoding='utf-8') as f:
+        json.dump({
+            'package': build_key,
+            'branch': build_info[build_key]['branch'],
+            'prefix': opts['prefix'],
+            'files': files
+        }, f, indent=2)
+
+    try:
+        tmp_dir.rename(art_dir)
+    except OSError:
+        # Another build stored the same artifact first
+        shutil.rmtree(tmp_dir)
+
+    note_ok()
+
+def restore_artifact(build_key:str, cache_key:str)->bool:
+    """
+    Install a package from the artifact cache if it's there.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cache_key : str
+        The key computed by artifact_key(), or None if the artifact cache is disabled.
+
+    Returns
+    -------
+    bool
+        True if the package was installed from the cache, false if it must be built.
+    """
+    if cache_key is None:
+        return False
+
+    art_dir = get_artifact_dir(cache_key)
+    if not art_dir.is_dir():
+        return False
+
+    with trace_phase(f'restore {build_key}', 'artifact'):
+        install_artifact(build_key, cache_key, art_dir)
+
+    return True
+
+def install_artifact(build_key:str, cache_key:str, art_dir:Path):
+    """
+    Copy a cached build into the prefix and record which artifact was installed.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the selected package.
+    cache_key : str
+        The key computed by artifact_key().
+    art_dir : Path
+        The directory holding the cached build.
+    """
+    note(f'Installing {build_key.upper()} from the artifact cache')
+    with open(art_dir / 'info.json', encoding='utf-8') as f:
+        info = json.load(f)
+
+    files = copy_tree_into(art_dir / 'tree', get_install_prefix())
+    relocate_text_files(files, info['prefix'])
+    relocate_binaries(files, info['prefix'])
+    record_manifest(build_key, files, build_id=cache_key)
+    note_ok()
+
+def relocate_text_files(files:list, old_prefix:str):
+    """
+    Point the pkg-config and libtool files of a package that was built for another
+    prefix to this one.
+
+    Parameters
+    ----------
+    files : list
+        The installed files, relative to the prefix.
+    old_prefix : str
+        The prefix the package was built with.
+    """
+    if old_prefix == opts['prefix']:
+        return
+
+    for rel_path in files:
+        file_path = get_install_prefix() / rel_path
+        if file_path.suffix in ['.pc', '.la'] and not file_path.is_symlink():
+            data = file_path.read_text(encoding='utf-8')
+            # Write a new file, since this one may be a hard link into another prefix
+            file_path.unlink()
+            file_path.write_text(data.replace(old_prefix, opts['prefix']), encoding='utf-8')
+
+def find_relocation_tool()->str:
+    """
+    Find the tool that changes the library search paths of installed binaries.
+
+    Returns
+    -------
+    str
+        The path of install_name_tool on macOS or patchelf elsewhere, or None if
+        it's not available.
+    """
+    return which('install_name_tool' if sys_info['sys_name'] == 'Darwin' else 'patchelf')
+
+def relocate_path(path:str, old_prefix:str)->str:
+    """
+    Move a path in one prefix to the same place in this one.
+
+    Parameters
+    ----------
+    path : str
+        The path to check.
+    old_prefix : str
+        The prefix the path may be in.
+
+    Returns
+    -------
+    str
+        The path in this prefix, or the same path if it's not in old_prefix.
+    """
+    if path == old_prefix or path.startswith(f'{old_prefix}/'):
+        return opts['prefix'] + path[len(old_prefix):]
+
+    return path
+
+def relocate_binaries(files:list, old_prefix:str):
+    """
+    Point the library search paths (RPATH entries, and install names on macOS) of the
+    libraries and programs of a package that was built for another prefix to this one.
+
+    Parameters
+    ----------
+    files : list
+        The installed files, relative to the prefix.
+    old_prefix : str
+        The prefix the package was built with.
+    """
+    if old_prefix == opts['prefix']:
+        return
+
+    tool = find_relocation_tool()
+    if tool is None:
+        print(f'{yellow("WARNING")}: {"install_name_tool" if sys_info["sys_name"] == "Darwin" else "patchelf"} '
+              f'was not found, so library search paths still refer to {code(old_prefix)}.')
+        return
+
+    for rel_path in files:
+        file_path = get_install_prefix() / rel_path
+        if file_path.is_symlink() or not file_path.is_file():
+            continue
+        with open(file_path, 'rb') as f:
+            magic = f.read(4)
+
+        if sys_info['sys_name'] == 'Darwin':
+            if magic not in [b'\xcf\xfa\xed\xfe', b'\xce\xfa\xed\xfe', b'\xca\xfe\xba\xbe']:
+                continue
+            change_args = macho_relocation_args(file_path, old_prefix)
+        else:
+            if magic != b'\x7fELF':
+                continue
+            rpath = run_cmd([tool, '--print-rpath', str(file_path)], capture=True).stdout.strip()
+            new_rpath = ':'.join(relocate_path(entry, old_prefix) for entry in rpath.split(':'))
+            change_args = [] if new_rpath == rpath else ['--set-rpath', new_rpath]
+
+        if len(change_args) == 0:
+            continue
+
+        if file_path.stat().st_nlink > 1:
+            # Don't change the file in another prefix or the artifact cache
+            tmp_path = file_path.with_name(f'.{file_path.name}.relocate')
+            shutil.copy2(str(file_path), str(tmp_path))
+            os.replace(tmp_path, file_path)
+
+        run_cmd([tool, *change_args, str(file_path)])
+        if sys_info['sys_name'] == 'Darwin' and which('codesign') is not None:
+            # Changing the load commands invalidates the signature, which arm64 requires
+            run_cmd(['codesign', '--force', '--sign', '-', str(file_path)])
+
+def macho_relocation_args(file_path:Path, old_prefix:str)->list:
+    """
+    Find the install_name_tool arguments that move the install name, dependencies and
+    RPATH entries of a Mach-O file from another prefix to this one.
+
+    Parameters
+    ----------
+    file_path : Path
+        The library or program.
+    old_prefix : str
+        The prefix the file was built with.
+
+    Returns
+    -------
+    list
+        The arguments, which are empty if nothing refers to old_prefix.
+    """
+    args = []
+    # The first line of otool output names the file
+    id_lines = run_cmd(['otool', '-D', str(file_path)], capture=True).stdout.splitlines()
+    install_name = id_lines[1].strip() if len(id_lines) > 1 else None
+    if install_name is not None and relocate_path(install_name, old_prefix) != install_name:
+        args.extend(['-id', relocate_path(install_name, old_prefix)])
+
+    for line in run_cmd(['otool', '-L', str(file_path)], capture=True).stdout.splitlines()[1:]:
+        dep = line.strip().split(' (')[0]
+        if relocate_path(dep, old_prefix) != dep and dep != install_name:
+            args.extend(['-change', dep, relocate_path(dep, old_prefix)])
+
+    load_cmds = run_cmd(['otool', '-l', str(file_path)], capture=True).stdout
+    for rpath in re.findall(r'cmd LC_RPATH\n\s+cmdsize \d+\n\s+path (.+) \(offset \d+\)', load_cmds):
+        if relocate_path(rpath, old_prefix) != rpath:
+            args.extend(['-rpath', rpath, relocate_path(rpath, old_prefix)])
+
+    return args
+
+# Stands in for wget and curl while the get.* scripts run, so downloads come from the
+# tarball cache when possible, and new downloads are added to it
+download_shim = '''#!/bin/sh
+tool=$(basename "$0")
+if [ "$tool" = curl ]; then real="$BUILD_PYOPTSPARSE_CURL"; else real="$BUILD_PYOPTSPARSE_WGET"; fi
+url=
+for arg in "$@"; do
+    case "$arg" in
+        http://*|https://*|ftp://*) url="$arg";;
+    esac
+done
+if [ -z "$url" ] && [ -n "$real" ]; then
+    exec "$real" "$@"
+fi
+
+name=$(basename "$url")
+echo "$name" >> "$BUILD_PYOPTSPARSE_DOWNLOAD_LOG"
+if [ -f "$BUILD_PYOPTSPARSE_TARBALL_DIR/$name" ]; then
+    echo "Using $name from the tarball cache"
+    cp "$BUILD_PYOPTSPARSE_TARBALL_DIR/$name" "./$name"
+    exit 0
+fi
+if [ "$BUILD_PYOPTSPARSE_OFFLINE" = 1 ]; then
+    echo "$name is not in the tarball cache, and --offline was used" >&2
+    exit 1
+fi
+if [ -z "$real" ]; then
+    echo "$tool was not found" >&2
+    exit 127
+fi
+
+"$real" "$@" || exit $?
+if [ -f "./$name" ]; then
+    cp "./$name" "$BUILD_PYOPTSPARSE_TARBALL_DIR/.$name.$$" &&
+        mv "$BUILD_PYOPTSPARSE_TARBALL_DIR/.$name.$$" "$BUILD_PYOPTSPARSE_TARBALL_DIR/$name"
+fi
+'''
+
+def get_tarball_dir()->Path:
+    """
+    Determine where source tar files downloaded by the get.* scripts are cached.
+
+    Returns
+    -------
+    Path
+        The tarball cache directory.
+    """
+    return Path(opts['cache_dir']) / 'tarballs'
+
+def read_tarball_index()->dict:
+    """
+    Read the index of the tarball cache, which has the SHA-256 digest of each cached
+    file, and the files each package branch downloaded.
+
+    Returns
+    -------
+    dict
+        The index, with 'files' and 'packages' entries.
+    """
+    index_path = get_tarball_dir() / 'index.json'
+    if not index_path.is_file():
+        return {'files': {}, 'packages': {}}
+
+    with open(index_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def write_tarball_index(index:dict):
+    """
+    Replace the index of the tarball cache.
+
+    Parameters
+    ----------
+    index : dict
+        The index, as returned by read_tarball_index().
+    """
+    index_path = get_tarball_dir() / 'index.json'
+    tmp_path = index_path.with_suffix(f'.{os.getpid()}.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+def check_cached_tarballs(build_key:str):
+    """
+    Verify the digests of the cached tar files a package downloaded before, and
+    remove any that don't match so they're downloaded again.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the package.
+    """
+    tarball_dir = get_tarball_dir()
+    with lock_file(tarball_dir / 'tarballs.lock'):
+        index = read_tarball_index()
+        pkg_id = f"{build_key}@{build_info[build_key]['branch']}"
+        for name in index['packages'].get(pkg_id, []):
+            tar_path = tarball_dir / name
+            if not tar_path.is_file():
+                continue
+            if file_sha256(str(tar_path)) != index['files'].get(name):
+                print(f'{yellow("WARNING")}: Removing {name} from the tarball cache, its checksum is wrong.')
+                tar_path.unlink()
+                index['files'].pop(name, None)
+        write_tarball_index(index)
+
+def run_get_script(build_key:str, script:str):
+    """
+    Run a get.* script, which downloads and unpacks the source of a third-party
+    package, with wget and curl replaced so the tarball cache is used.
+
+    Parameters
+    ----------
+    build_key : str
+        A key in the build_info dict with info about the package.
+    script : str
+        The script to run.
+    """
+    tarball_dir = get_tarball_dir()
+    shim_dir = tarball_dir / 'bin'
+    shim_dir.mkdir(parents=True, exist_ok=True)
+    check_cached_tarballs(build_key)
+
+    shim_env = {
+        'BUILD_PYOPTSPARSE_TARBALL_DIR': str(tarball_dir),
+        'BUILD_PYOPTSPARSE_DOWNLOAD_LOG': str(Path('.build_pyoptsparse-downloads').resolve()),
+        'BUILD_PYOPTSPARSE_OFFLINE': '1' if opts['offline'] is True else '0',
+        'PATH': f"{shim_dir}{os.pathsep}{os.environ['PATH']}"
+    }
+    for tool in ['wget', 'curl']:
+        real_path = which(tool)
+        shim_env[f'BUILD_PYOPTSPARSE_{tool.upper()}'] = real_path or ''
+        # The scripts check which tool is available, so only pretend to be one that is
+        shim_path = shim_dir / tool
+        if real_path is not None or opts['offline'] is True:
+            if not shim_path.is_file() or shim_path.read_text() != download_shim:
+                tmp_path = shim_dir / f'.{tool}.{os.getpid()}'
+                tmp_path.write_text(download_shim)
+                tmp_path.chmod(0o755)
+                os.replace(tmp_path, shim_path)
+        elif shim_path.is_file():
+            shim_path.unlink()
+
+    Path(shim_env['BUILD_PYOPTSPARSE_DOWNLOAD_LOG']).unlink(missing_ok=True)
+    saved_env = {var: os.environ.get(var) for var in shim_env}
+    os.environ.update(shim_env)
+    try:
+        run_cmd([script])
+    finally:
+        for var, value in saved_env.items():
+            if value is None:
+                del os.environ[var]
+            else:
+                os.environ[var] = value
+
+    # Record what was used, so it can be verified and found by --offline next time
+    log_path = Path(shim_env['BUILD_PYOPTSPARSE_DOWNLOAD_LOG'])
+    names = log_path.read_text().split() if log_path.is_file() else []
+    log_path.unlink(missing_ok=True)
+    with lock_file(tarball_dir / 'tarballs.lock'):
+        index = read_tarball_index()
+        for name in names:
+            if name not in index['files'] and (tarball_dir / name).is_file():
+                index['files'][name] = file_sha256(str(tarball_dir / name))
+        index['packages'][f"{build_key}@{build_info[build_key]['branch']}"] = names
+        write_tarball_index(index)
+
+def check_offline_sources():
+    """
+    Make sure that the repository mirrors and source tar files of the packages that
+    will be built are available, so an --offline run fails before building anything.
+    """
+    missing = []
+    index = read_tarball_index()
+    for build_key in get_source_keys():
+        if not get_mirror_path(build_key).is_dir():
+            missing.append(f"mirror of {build_info[build_key]['url']}")
+        if build_key in ['metis', 'mumps']:
+            names = index['packages'].get(f"{build_key}@{build_info[build_key]['branch']}")
+            if names is None:
+                missing.append(f'source tar files of {build_key.upper()} {build_info[build_key]["branch"]}')
+            else:
+                missing.extend(f'{name} in the tarball cache' for name in names
+                               if not (get_tarball_dir() / name).is_file())
+
+    if len(missing) > 0:
+        raise RuntimeError('--offline was used, but these are not available locally. Run once '
+                           'without --offline to fetch them:\n    ' + '\n    '.join(missing))
+
+def get_pgo_dir()->Path:
+    """
+    Determine where the profile collected by a --pgo build is kept.
+
+    Returns
+    -------
+    Path
+        The profile directory in the build root.
+    """
+    return Path(opts['build_root']) / 'pgo-profile'
+
+def get_profile_flags()->dict:
+    """
+    Determine the optimization flags for the selected build profile, and the current
+    phase of a PGO build.
+
+    Returns
+    -------
+    dict
+        The flags, keyed by the CFLAGS, CXXFLAGS, FCFLAGS, FFLAGS, and LDFLAGS variables.
+    """
+    intel = opts['intel_compiler_suite']
+    flags = []
+    if opts['build_profile'] in ['fast', 'fast-portable']:
+        flags.append('-O3')
+        if opts['build_profile'] == 'fast':
+            if intel is True:
+                flags.append('-xHost')
+            elif platform.machine() in ['arm64', 'aarch64']:
+                flags.append('-mcpu=native')
+            else:
+                flags.append('-march=native')
+
+        if intel is True:
+            flags.append('-ipo')
+        elif sys_info['sys_name'] == 'Linux' and sys_info['gcc_major_ver'] >= 10:
+            flags.append('-flto=auto')
+        else:
+            flags.append('-flto')
+
+    if sys_info['pgo_phase'] == 'generate':
+        flags.append(f'-fprofile-generate={get_pgo_dir()}')
+    elif sys_info['pgo_phase'] == 'use':
+        flags.extend([f'-fprofile-use={get_pgo_dir()}', '-fprofile-correction', '-Wno-missing-profile'])
+
+    # With link-time optimization, code is generated when linking, so the linker needs
+    # the same flags
+    return {var: ' '.join(flags) for var in ['CFLAGS', 'CXXFLAGS', 'FCFLAGS', 'FFLAGS', 'LDFLAGS']}
+
+def profile_configure_args(base_flags:dict=None)->list:
+    """
+    Create the configure arguments that set the compiler flags of a package, adding
+    those of the build profile.
+
+    Parameters
+    ----------
+    base_flags : dict
+        Flags the package needs, keyed by variable name. Other variables start with
+        their value in the environment.
+
+    Returns
+    -------
+    list
+        VAR=flags arguments for the configure script.
+    """
+    base_flags = base_flags or {}
+    args = []
+    for var, extra_flags in get_profile_flags().items():
+        if var in base_flags:
+            flags = f'{base_flags[var]} {extra_flags}'
+        elif extra_flags != '':
+            flags = f"{os.environ.get(var, '')} {extra_flags}"
+        else:
+            continue
+        args.append(f'{var}={flags.strip()}')
+
+    return args
+
+def run_pgo_training(pos_dir_name:str):
+    """
+    Build the solver libraries with instrumentation, then run the IPOPT tests with
+    them to collect the profile that the final build is optimized with.
+
+    Parameters
+    ----------
+    pos_dir_name : str
+        The directory to clone and build pyOptSparse in, needed to create the task graph.
+    """
+    announce('Building instrumented solver libraries for profile-guided optimization')
+    pgo_dir = get_pgo_dir()
+    shutil.rmtree(pgo_dir, ignore_errors=True)
+    pgo_dir.mkdir(parents=True)
+
+    # The instrumented libraries are always installed into a staging tree that's thrown
+    # away afterwards, so they never reach the prefix
+    if sys_info['stage_root'] is None:
+        start_staged_install()
+
+    sys_info['pgo_phase'] = 'generate'
+    var_name = 'DYLD_LIBRARY_PATH' if sys_info['sys_name'] == 'Darwin' else 'LD_LIBRARY_PATH'
+    saved_path = os.environ.get(var_name)
+    try:
+        tasks = build_task_graph(pos_dir_name)
+        run_task_graph({name: task for name, task in tasks.items()
+                        if name in ['metis', 'mumps', 'hsl', 'ipopt']})
+
+        # The test programs are linked with the libraries in the build trees, but find
+        # their dependencies in the staging tree, or the prefix
+        os.environ[var_name] = os.pathsep.join([str(prefix / 'lib') for prefix in get_dep_prefixes()] +
+                                               ([saved_path] if saved_path else []))
+        note('Running the IPOPT tests to collect a profile')
+        result = run_cmd([opts['make_name'], 'test'], cwd=str(get_build_tree_path('ipopt')),
+                         raise_error=False)
+    finally:
+        if saved_path is None:
+            os.environ.pop(var_name, None)
+        else:
+            os.environ[var_name] = saved_path
+        shutil.rmtree(sys_info['stage_root'], ignore_errors=True)
+        sys_info['stage_root'] = None
+
+    if opts['staged_install']:
+        start_staged_install()
+
+    if result is None:
+        note_failed()
+        print(f'{yellow("WARNING")}: The IPOPT tests failed, the profile may be incomplete.')
+    else:
+        note_ok()
+
+    print(f'Collected profile data for {len(list(pgo_dir.glob("**/*.gcda")))} object files')
+    sys_info['pgo_phase'] = 'use'
+
 def install_metis_from_src():
     """ Git clone the METIS repo, build the library, and install it and the include files. """
     if not allow_build('metis'):
         return
 
-    build_dir = git_clone('metis')
-    run_cmd(['./get.Metis'])
     os.environ['CFLAGS'] = '-Wno-implicit-function-declaration'
-    note("Running configure")
-    run_cmd(cmd_list=['./configure', f'--prefix={opts["prefix"]}'])
-    note_ok()
-    make_install()
+    cnf_cmd_list = ['./configure', f'--prefix={opts["prefix"]}'] + profile_configure_args()
+    cache_key = artifact_key('metis', cnf_cmd_list)
+    if restore_artifact('metis', cache_key):
+        return
+
+    build_dir = git_clone('metis')
+    prepare_source('get', git_revision(), lambda: run_get_script('metis', './get.Metis'))
+    run_configure('metis', cnf_cmd_list)
+    make_install(build_key='metis', cache_key=cache_key)
     popd()
 
 def install_metis():
-    """ Install METIS either through conda or building. """
-    if allow_install_with_conda() and opts['force_build'] is False:
-        try:
-            install_conda_pkg('metis')
-            return
-        except Exception as e:
-            try_fallback('METIS', e)
-
-    install_metis_from_src()
+    """ Build METIS unless it was installed with conda. """
+    if installed_with_conda('metis') is False:
+        install_metis_from_src()
 
 def install_mumps_from_src():
     """ Git clone the MUMPS repo, build the library, and install it and the include files. """
     if not allow_build('mumps'):
         return
 
-    build_dir = git_clone('mumps')
-    run_cmd(['./get.Mumps'])
     coin_dir = get_coin_inc_dir()
-    cflags = f'-w -I{opts["prefix"]}/include -I{coin_dir} -I{coin_dir}/metis'
+    inc_flags = ' '.join(f'-I{prefix}/include' for prefix in get_dep_prefixes())
+    cflags = f'-w {inc_flags} -I{coin_dir} -I{coin_dir}/metis'
     fcflags = cflags
     if sys_info['gcc_major_ver'] >= 10:
         fcflags = '-fallow-argument-mismatch ' + fcflags
@@ -672,20 +3147,24 @@ def install_mumps_from_src():
     metis_lib = get_coin_lib_name('metis')
     config_opts = [
         '--with-metis',
-        f'--with-metis-lflags=-L{opts["prefix"]}/lib -l{metis_lib} -lm',
+        f'--with-metis-lflags={get_dep_lib_flags()} -l{metis_lib} -lm',
         f'--with-metis-cflags={cflags}',
         f'--prefix={opts["prefix"]}',
-        f'CFLAGS={cflags}',
-        f'FCFLAGS={fcflags}'
+        *blas_configure_args(),
+        *profile_configure_args({'CFLAGS': cflags, 'FCFLAGS': fcflags})
     ]
     cnf_cmd_list = ['./configure']
     cnf_cmd_list.extend(config_opts)
+    cache_key = artifact_key('mumps', cnf_cmd_list, deps=['metis'])
+    if restore_artifact('mumps', cache_key):
+        return
 
-    note("Running configure")
-    run_cmd(cmd_list=cnf_cmd_list)
-    note_ok()
+    build_dir = git_clone('mumps')
+    prepare_source('get', git_revision(), lambda: run_get_script('mumps', './get.Mumps'))
+    run_configure('mumps', cnf_cmd_list, deps=['metis'])
 
-    make_install(1) # MUMPS build can fail with parallel make
+    # MUMPS build can fail with parallel make
+    make_install(1, build_key='mumps', cache_key=cache_key)
     popd()
 
 def install_paropt_from_src():
@@ -695,22 +3174,27 @@ def install_paropt_from_src():
     build_dir = git_clone('paropt')
     pip_install(['Cython'], pkg_desc='Cython')
 
-    # Use build defaults as per ParOpt instructions:
-    Path('Makefile.in.info').rename('Makefile.in')
+    # Use build defaults as per ParOpt instructions. A persistent build tree already has them.
+    if not Path('Makefile.in').is_file():
+        Path('Makefile.in.info').rename('Makefile.in')
     make_vars =  [f'PAROPT_DIR={Path.cwd()}']
     if sys_info['sys_name'] == 'Darwin':
         make_vars.extend(['SO_EXT=dylib', 'SO_LINK_FLAGS=-fPIC -dynamiclib'])
     else:
         make_vars.extend(['SO_EXT=so', 'SO_LINK_FLAGS=-fPIC -shared'])
 
-    make_install(make_args=make_vars, do_install=False)
-    pip_install(['./'], pkg_desc='paropt')
+    make_install(make_args=make_vars, do_install=False, build_key='paropt')
+    pip_install_package(['./'], pkg_desc='paropt')
 
-    lib_dest_dir = str(Path(opts['prefix']) / 'lib')
+    lib_dest_dir = str(get_install_prefix() / 'lib')
     note(f'Copying library files to {code(subst_env_for_path(lib_dest_dir))}')
+    Path(lib_dest_dir).mkdir(parents=True, exist_ok=True)
     lib_files = sorted(Path('lib').glob('libparopt*'))
     for lib in lib_files:
+        # Replace rather than overwrite, in case the old file is linked from other prefixes
+        Path(lib_dest_dir, lib.name).unlink(missing_ok=True)
         shutil.copy2(str(lib), lib_dest_dir)
+    record_manifest('paropt', [str(Path('lib') / lib.name) for lib in lib_files])
     note_ok()
 
     popd()
@@ -727,127 +3211,583 @@ def install_ipopt_from_src(config_opts:list=None):
     if not allow_build('ipopt') or opts['include_ipopt'] is False:
         return
 
-    build_dir = git_clone('ipopt')
     cnf_cmd_list = ['./configure', f'--prefix={opts["prefix"]}', '--disable-java']
 
-    # Don't accidentally use PARDISO if it wasn't selected:
-    if opts['linear_solver'] != 'pardiso': cnf_cmd_list.append('--disable-pardisomkl')
+    # Don't accidentally use PARDISO if it wasn't selected:
+    if opts['linear_solver'] != 'pardiso': cnf_cmd_list.append('--disable-pardisomkl')
+
+    if config_opts is not None: cnf_cmd_list.extend(config_opts)
+    cnf_cmd_list.extend(blas_configure_args())
+    cnf_cmd_list.extend(profile_configure_args())
+
+    deps = {
+        'mumps': ['metis', 'mumps'],
+        'hsl': ['metis', 'hsl'],
+        'mumps+hsl': ['metis', 'mumps'],
+        'auto': ['metis', 'mumps'],
+        'pardiso': []
+    }[opts['linear_solver']]
+    cache_key = artifact_key('ipopt', cnf_cmd_list, deps=deps)
+    if restore_artifact('ipopt', cache_key):
+        return
+
+    build_dir = git_clone('ipopt')
+    run_configure('ipopt', cnf_cmd_list, deps=deps)
+    make_install(build_key='ipopt', cache_key=cache_key)
+    popd()
+
+def install_ipopt(config_opts:list=None):
+    """
+    Build IPOPT unless it was installed with conda.
+
+    Parameters
+    ----------
+    config_opts : list
+        Additional options to use with the IPOPT configure script if building.
+    """
+    if installed_with_conda('ipopt') is False:
+        install_ipopt_from_src(config_opts=config_opts)
+
+def install_mumps():
+    """ Build MUMPS unless it was installed with conda. """
+    if installed_with_conda('mumps') is False:
+        install_mumps_from_src()
+
+def ipopt_opts_for_mumps()->list:
+    """
+    Determine the IPOPT configure options for linking with an installed MUMPS.
+
+    Returns
+    -------
+    list
+        The options to use with the IPOPT configure script if building.
+    """
+    coin_dir = get_coin_inc_dir()
+    mumps_lib = get_coin_lib_name('mumps')
+    return [
+        '--with-mumps',
+        f'--with-mumps-lflags={get_dep_lib_flags()} -l{mumps_lib}',
+        f'--with-mumps-cflags=-I{coin_dir}/mumps',
+        '--without-asl',
+        '--without-hsl'
+    ]
+
+def check_tar_member(member:tarfile.TarInfo, dest_dir:Path):
+    """
+    Make sure an archive member can be extracted without writing outside the directory
+    it's extracted to, for Python versions whose tarfile module has no extraction
+    filters. Raises an exception if it can't. Special permission bits are cleared.
+
+    Parameters
+    ----------
+    member : tarfile.TarInfo
+        The archive member about to be extracted.
+    dest_dir : Path
+        The directory it's extracted to.
+    """
+    dest_path = os.path.realpath(dest_dir)
+    def inside(path)->bool:
+        return os.path.commonpath([dest_path, os.path.realpath(path)]) == dest_path
+
+    # Resolving the path also catches links extracted earlier that point outside
+    member_path = Path(dest_path, member.name)
+    error = None
+    if os.path.isabs(member.name) or '..' in Path(member.name).parts or not inside(member_path):
+        error = 'its path is outside the directory it would be extracted to'
+    elif not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+        error = 'it is a device or FIFO'
+    elif member.issym() and (os.path.isabs(member.linkname) or not inside(member_path.parent / member.linkname)):
+        error = f'it links to {member.linkname}, outside the directory it would be extracted to'
+    elif member.islnk() and (os.path.isabs(member.linkname) or not inside(Path(dest_path, member.linkname))):
+        error = f'it links to {member.linkname}, outside the directory it would be extracted to'
+
+    if error is not None:
+        raise RuntimeError(f'Refusing to extract {member.name} from the archive: {error}.')
+
+    member.mode &= 0o777
+
+def extract_hsl_archive(tar_path:Path, src_cache_dir:Path)->tuple:
+    """
+    Extract the HSL tar file into the source cache in a single pass, computing its
+    digest while it's read. gzip, bzip2, xz, and zstd compression are supported, with
+    zstd decompressed by the zstd command if this Python's tarfile can't.
+
+    Parameters
+    ----------
+    tar_path : Path
+        The HSL tar file.
+    src_cache_dir : Path
+        Where extracted sources are kept, each in a directory named by the digest.
+
+    Returns
+    -------
+    tuple
+        The SHA-256 digest of the tar file, and the directory holding its source.
+    """
+    note(f'Extracting {tar_path.name}')
+    with open(tar_path, 'rb') as f:
+        is_zstd = f.read(4) == b'\x28\xb5\x2f\xfd'
+
+    zstd_proc = None
+    if is_zstd and 'zst' not in tarfile.TarFile.OPEN_METH:
+        if which('zstd') is None:
+            raise RuntimeError(f'{tar_path} is compressed with zstd, but the zstd command was not found.')
+        zstd_proc = subprocess.Popen(['zstd', '-dcq'], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        sink, source, tar_mode = zstd_proc.stdin, zstd_proc.stdout, 'r|'
+    else:
+        read_fd, write_fd = os.pipe()
+        sink, source, tar_mode = os.fdopen(write_fd, 'wb'), os.fdopen(read_fd, 'rb'), 'r|*'
+
+    # The file is read once, by this thread, which hashes and passes along each block
+    digest = hashlib.sha256()
+    def feed():
+        try:
+            with open(tar_path, 'rb') as f:
+                for block in iter(lambda: f.read(1 << 20), b''):
+                    digest.update(block)
+                    sink.write(block)
+        except BrokenPipeError:
+            pass # Extraction stopped early because of an error
+        finally:
+            try:
+                sink.close()
+            except BrokenPipeError:
+                pass
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+
+    src_cache_dir.mkdir(parents=True, exist_ok=True)
+    tmp_dir = Path(tempfile.mkdtemp(dir=src_cache_dir, prefix='.extract-'))
+    try:
+        top_names = set()
+        with tarfile.open(fileobj=source, mode=tar_mode) as tar:
+            for member in tar:
+                parts = Path(member.name).parts
+                if len(parts) > 0:
+                    top_names.add(parts[0])
+                if hasattr(tarfile, 'data_filter'):
+                    tar.extract(member, tmp_dir, filter='data')
+                else:
+                    check_tar_member(member, tmp_dir)
+                    tar.extract(member, tmp_dir)
+
+        # Read past the end of the archive so the digest covers the whole file
+        while source.read(1 << 20):
+            pass
+        source.close()
+        feeder.join()
+        if zstd_proc is not None and zstd_proc.wait() != 0:
+            raise RuntimeError(f'zstd could not decompress {tar_path}.')
+
+        if len(top_names) != 1 or not (tmp_dir / next(iter(top_names))).is_dir():
+            raise RuntimeError(f'{tar_path} should hold the HSL source in a single top-level '
+                               f'directory, but it has {", ".join(sorted(top_names)) or "nothing"}.')
+
+        src_dir = src_cache_dir / digest.hexdigest()
+        if not src_dir.is_dir():
+            (tmp_dir / next(iter(top_names))).rename(src_dir)
+    finally:
+        source.close()
+        feeder.join()
+        if zstd_proc is not None:
+            zstd_proc.wait()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
 
-    if config_opts is not None: cnf_cmd_list.extend(config_opts)
-    note("Running configure")
-    run_cmd(cmd_list=cnf_cmd_list)
     note_ok()
-    make_install()
-    popd()
+    return digest.hexdigest(), src_dir
 
-def install_ipopt(config_opts:list=None):
+def get_hsl_tar_id()->dict:
+    """
+    Identify the HSL tar file by its path, size, and modification time, which is how
+    its digest is remembered in the index of the HSL source cache.
+
+    Returns
+    -------
+    dict
+        The size and modification time.
+    """
+    tar_stat = Path(opts['hsl_tar_file']).stat()
+    return {'size': tar_stat.st_size, 'mtime_ns': tar_stat.st_mtime_ns}
+
+def read_hsl_index(index_path:Path)->dict:
     """
-    Install IPOPT either through conda or building.
+    Read the index of the HSL source cache. The cache lock must be held.
 
     Parameters
     ----------
-    config_opts : list
-        Additional options to use with the IPOPT configure script if building.
+    index_path : Path
+        The index file.
+
+    Returns
+    -------
+    dict
+        The size, modification time, and digest of each tar file, keyed by path.
     """
-    if allow_install_with_conda() and opts['force_build'] is False:
-        try:
-            install_conda_pkg('ipopt')
-            return
-        except Exception as e:
-            try_fallback('IPOPT', e)
+    if not index_path.is_file():
+        return {}
 
-    install_ipopt_from_src(config_opts=config_opts)
+    with open(index_path, encoding='utf-8') as f:
+        return json.load(f)
 
-def install_mumps():
-    """ Install MUMPS either through conda or building. """
-    if allow_install_with_conda() and opts['force_build'] is False:
-        try:
-            install_conda_pkg('mumps-include')
-            install_conda_pkg('mumps-seq')
-            install_conda_pkg('mumps-mpi')
-            return
-        except Exception as e:
-            try_fallback('MUMPS', e)
+def get_hsl_digest()->str:
+    """
+    Find the SHA-256 digest of the HSL tar file. A tar file that was seen before isn't
+    read again, and one that wasn't is extracted into the source cache while its
+    digest is computed, since it's read either way.
 
-    install_mumps_from_src()
+    Returns
+    -------
+    str
+        The digest.
+    """
+    src_cache_dir = Path(opts['cache_dir']) / 'hsl'
+    tar_id = get_hsl_tar_id()
+    with lock_file(src_cache_dir / 'hsl.lock'):
+        known = read_hsl_index(src_cache_dir / 'archives.json').get(str(Path(opts['hsl_tar_file'])))
+        if known is not None and all(known.get(k) == v for k, v in tar_id.items()):
+            return known['sha256']
+
+    with hsl_source() as (tar_sha256, _):
+        return tar_sha256
+
+@contextlib.contextmanager
+def hsl_source():
+    """
+    Find the extracted source of the HSL tar file in the cache, extracting it first
+    if needed. The cache stays locked while the context is active, so the source
+    isn't removed by another build pruning the cache while it's used.
+
+    Yields
+    ------
+    tuple
+        The SHA-256 digest of the tar file, and the directory holding its source.
+    """
+    tar_path = Path(opts['hsl_tar_file'])
+    src_cache_dir = Path(opts['cache_dir']) / 'hsl'
+    index_path = src_cache_dir / 'archives.json'
+    tar_id = get_hsl_tar_id()
+
+    with lock_file(src_cache_dir / 'hsl.lock'):
+        index = read_hsl_index(index_path)
+        known = index.get(str(tar_path))
+        if known is not None and all(known.get(k) == v for k, v in tar_id.items()) and \
+                (src_cache_dir / known['sha256']).is_dir():
+            print(f'Using the extracted {tar_path.name} from the HSL source cache')
+            yield known['sha256'], src_cache_dir / known['sha256']
+            return
 
-def install_with_mumps():
-    """ Install METIS, MUMPS, and IPOPT. """
-    install_metis()
-    install_mumps()
+        tar_sha256, src_dir = extract_hsl_archive(tar_path, src_cache_dir)
+        index[str(tar_path)] = {**tar_id, 'sha256': tar_sha256}
 
-    if opts['include_ipopt'] is True:
-        # Get this info in case we need to build IPOPT from source
-        coin_dir = get_coin_inc_dir()
+        # Forget tar files that are gone, and remove sources no other tar file has
+        index = {path: entry for path, entry in index.items() if Path(path).is_file()}
+        used = {entry['sha256'] for entry in index.values()}
+        for cached_dir in src_cache_dir.iterdir():
+            if cached_dir.is_dir() and len(cached_dir.name) == 64 and cached_dir.name not in used:
+                shutil.rmtree(cached_dir)
 
-        mumps_lib = get_coin_lib_name('mumps')
-        ipopt_opts = [
-            '--with-mumps',
-            f'--with-mumps-lflags=-L{opts["prefix"]}/lib -l{mumps_lib}',
-            f'--with-mumps-cflags=-I{coin_dir}/mumps',
-            '--without-asl',
-            '--without-hsl'
-        ]
+        with open(index_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2)
 
-        install_ipopt(config_opts=ipopt_opts)
+        yield tar_sha256, src_dir
 
 def install_hsl_from_src():
     """ Build HSL from the user-supplied source tar file. """
     if not allow_build('hsl'):
         return
 
-    build_dir = git_clone('hsl')
-
-    # Extract the HSL tar file and rename the folder to 'coinhsl'
-    # First, determine the name of the top-level folder:
-    tar = subprocess.run(['tar', 'vtf', opts['hsl_tar_file']], encoding='UTF-8',
-          stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-    first_line = tar.stdout.splitlines()[0]
-    hsl_dir_name = first_line.split()[-1].replace('/', '')[1:]
-    run_cmd(cmd_list=['tar', 'xf', opts['hsl_tar_file']]) # Extract
-    Path(hsl_dir_name).rename('coinhsl') # Rename
-
     coin_dir = get_coin_inc_dir()
     metis_lib = get_coin_lib_name('metis')
     cnf_cmd_list = [
         './configure',
         f'--prefix={opts["prefix"]}',
         '--with-metis',
-        f'--with-metis-lflags=-L{opts["prefix"]}/lib -l{metis_lib}',
+        f'--with-metis-lflags={get_dep_lib_flags()} -l{metis_lib}',
         f'--with-mumps-cflags=-I{coin_dir}',
+        *blas_configure_args(),
+        *profile_configure_args()
     ]
 
-    note("Running configure")
-    run_cmd(cmd_list=cnf_cmd_list)
-    note_ok()
-    make_install()
+    # Only the digest is needed to find a cached build, not the extracted source
+    hsl_tar_sha256 = get_hsl_digest()
+    hsl_inputs = {'hsl_tar_sha256': hsl_tar_sha256}
+    cache_key = artifact_key('hsl', cnf_cmd_list, deps=['metis'],
+                             extra_inputs={**hsl_inputs, 'loader_link': True})
+    if restore_artifact('hsl', cache_key):
+        return
+
+    build_dir = git_clone('hsl')
+
+    def copy_hsl():
+        if Path('coinhsl').is_dir():
+            shutil.rmtree('coinhsl') # Left from a different tar file in a persistent build tree
+        with hsl_source() as (tar_sha256, hsl_src_dir):
+            if tar_sha256 != hsl_tar_sha256:
+                raise RuntimeError(f"{opts['hsl_tar_file']} changed during the build.")
+            shutil.copytree(str(hsl_src_dir), 'coinhsl', symlinks=True)
+
+    prepare_source('hsl-tar', hsl_tar_sha256, copy_hsl)
+    run_configure('hsl', cnf_cmd_list, deps=['metis'], extra_inputs=hsl_inputs)
+    make_install(build_key='hsl', cache_key=cache_key, fix_stage=add_hsl_loader_link)
     popd()
 
-def install_with_hsl():
-    """ Install pyOptSparse using the HSL linear solver """
-    install_metis()
-    install_hsl_from_src()
+def ipopt_opts_for_hsl()->list:
+    """
+    Determine the IPOPT configure options for linking with an installed HSL.
 
+    Returns
+    -------
+    list
+        The options to use with the IPOPT configure script.
+    """
     coin_dir = get_coin_inc_dir()
     metis_lib = get_coin_lib_name('metis')
-    ipopt_opts = [
+    return [
         '--with-hsl',
-        f'--with-hsl-lflags=-L{opts["prefix"]}/lib -lcoinhsl -l{metis_lib}',
+        f'--with-hsl-lflags={get_dep_lib_flags()} -lcoinhsl -l{metis_lib}',
         f'--with-hsl-cflags=-I{coin_dir}/hsl',
         '--disable-linear-solver-loader'
     ]
-    install_ipopt_from_src(config_opts=ipopt_opts)
-    install_pyoptsparse_from_src()
 
-def install_with_pardiso():
-    """ Build IPOPT with the PARDISO linear solver. """
-    # install_ipopt_from_src(config_opts=['--with-lapack=-mkl'])
-    install_ipopt_from_src()
+def ipopt_opts_for_loader()->list:
+    """
+    Determine the IPOPT configure options for linking with an installed MUMPS, and
+    loading HSL at run time with the linear solver loader. Any of MUMPS and the HSL
+    solvers can then be chosen with the linear_solver option, and HSL can be rebuilt
+    without rebuilding IPOPT.
+
+    Returns
+    -------
+    list
+        The options to use with the IPOPT configure script.
+    """
+    return ipopt_opts_for_mumps() + ['--enable-linear-solver-loader']
+
+def add_hsl_loader_link(stage_prefix:Path):
+    """
+    Link the name that the IPOPT linear solver loader looks for by default, libhsl,
+    to the installed libcoinhsl, so the HSL solvers are found without setting hsllib.
+
+    Parameters
+    ----------
+    stage_prefix : Path
+        Where 'make install' put the prefix's files.
+    """
+    ext = 'dylib' if sys_info['sys_name'] == 'Darwin' else 'so'
+    link_path = stage_prefix / 'lib' / f'libhsl.{ext}'
+    if (stage_prefix / 'lib' / f'libcoinhsl.{ext}').exists() and not link_path.exists():
+        link_path.symlink_to(f'libcoinhsl.{ext}')
+
+# Solves the optimal control of a nonlinear PDE on a k x k grid with the IPOPT C interface,
+# so the KKT systems have the fill-in of a 2D mesh. The state y and control u at each grid
+# point are the variables, and -laplace(y) + y^3 = u (scaled by h^2) the constraints.
+# Like pyOptSparse, it uses a limited-memory Hessian.
+linear_solver_bench_src = r"""#include <math.h>
+#include <stdio.h>
+#include <stdlib.h>
+#include "IpStdCInterface.h"
+
+static ipindex k;
+static ipnumber h2;
+
+#define Y(i, j) ((i) * k + (j))
+#define U(i, j) (k * k + (i) * k + (j))
+
+static bool eval_f(ipindex n, ipnumber *x, bool new_x, ipnumber *obj, UserDataPtr data) {
+    ipnumber sum = 0;
+    for (ipindex p = 0; p < k * k; p++)
+        sum += (x[p] - 1) * (x[p] - 1) + 1e-2 * x[k * k + p] * x[k * k + p];
+    *obj = 0.5 * h2 * sum;
+    return true;
+}
+
+static bool eval_grad_f(ipindex n, ipnumber *x, bool new_x, ipnumber *grad, UserDataPtr data) {
+    for (ipindex p = 0; p < k * k; p++) {
+        grad[p] = h2 * (x[p] - 1);
+        grad[k * k + p] = 1e-2 * h2 * x[k * k + p];
+    }
+    return true;
+}
+
+static bool eval_g(ipindex n, ipnumber *x, bool new_x, ipindex m, ipnumber *g, UserDataPtr data) {
+    for (ipindex i = 0; i < k; i++)
+        for (ipindex j = 0; j < k; j++) {
+            ipnumber y = x[Y(i, j)], lap = 4 * y;
+            if (i > 0) lap -= x[Y(i - 1, j)];
+            if (i < k - 1) lap -= x[Y(i + 1, j)];
+            if (j > 0) lap -= x[Y(i, j - 1)];
+            if (j < k - 1) lap -= x[Y(i, j + 1)];
+            g[Y(i, j)] = lap + h2 * (y * y * y - x[U(i, j)]);
+        }
+    return true;
+}
+
+static bool eval_jac_g(ipindex n, ipnumber *x, bool new_x, ipindex m, ipindex nele_jac,
+                       ipindex *rows, ipindex *cols, ipnumber *values, UserDataPtr data) {
+    ipindex e = 0;
+    for (ipindex i = 0; i < k; i++)
+        for (ipindex j = 0; j < k; j++) {
+            const ipindex r = Y(i, j);
+            const ipindex nbrs[4][2] = {{i - 1, j}, {i + 1, j}, {i, j - 1}, {i, j + 1}};
+            for (int q = 0; q < 4; q++) {
+                if (nbrs[q][0] < 0 || nbrs[q][0] >= k || nbrs[q][1] < 0 || nbrs[q][1] >= k) continue;
+                if (values == NULL) { rows[e] = r; cols[e] = Y(nbrs[q][0], nbrs[q][1]); }
+                else values[e] = -1;
+                e++;
+            }
+            if (values == NULL) { rows[e] = r; cols[e] = r; rows[e + 1] = r; cols[e + 1] = U(i, j); }
+            else { values[e] = 4 + 3 * h2 * x[r] * x[r]; values[e + 1] = -h2; }
+            e += 2;
+        }
+    return true;
+}
+
+static bool eval_h(ipindex n, ipnumber *x, bool new_x, ipnumber obj_factor, ipindex m,
+                   ipnumber *lambda, bool new_lambda, ipindex nele_hess, ipindex *rows,
+                   ipindex *cols, ipnumber *values, UserDataPtr data) {
+    return false;
+}
+
+int main(int argc, char **argv) {
+    if (argc != 4) {
+        fprintf(stderr, "usage: %s SIZE LINEAR_SOLVER OUTPUT_FILE\n", argv[0]);
+        return 2;
+    }
+    k = (ipindex)ceil(sqrt(atof(argv[1])));
+    h2 = 1.0 / ((k + 1.0) * (k + 1.0));
+    const ipindex n = 2 * k * k, m = k * k;
+
+    ipnumber *x_L = malloc(n * sizeof(ipnumber)), *x_U = malloc(n * sizeof(ipnumber));
+    ipnumber *x = calloc(n, sizeof(ipnumber)), *g_L = calloc(m, sizeof(ipnumber));
+    ipnumber *g_U = calloc(m, sizeof(ipnumber)), *mult_g = calloc(m, sizeof(ipnumber));
+    ipnumber *mult_x_L = calloc(n, sizeof(ipnumber)), *mult_x_U = calloc(n, sizeof(ipnumber));
+    for (ipindex p = 0; p < k * k; p++) {
+        x_L[p] = -1e20;
+        x_U[p] = 1e20;
+        x_L[k * k + p] = -10;
+        x_U[k * k + p] = 10;
+    }
+
+    IpoptProblem nlp = CreateIpoptProblem(n, x_L, x_U, m, g_L, g_U, 2 * k * k + 4 * k * (k - 1),
+                                          0, 0, eval_f, eval_g, eval_grad_f, eval_jac_g, eval_h);
+    AddIpoptStrOption(nlp, "sb", "yes");
+    AddIpoptIntOption(nlp, "print_level", 0);
+    AddIpoptStrOption(nlp, "linear_solver", argv[2]);
+    AddIpoptStrOption(nlp, "hessian_approximation", "limited-memory");
+    AddIpoptStrOption(nlp, "print_timing_statistics", "yes");
+    if (!OpenIpoptOutputFile(nlp, argv[3], 5)) return 2;
+
+    ipnumber obj;
+    enum ApplicationReturnStatus status = IpoptSolve(nlp, x, NULL, &obj, mult_g, mult_x_L,
+                                                     mult_x_U, NULL);
+    FreeIpoptProblem(nlp);
+    if (status != Solve_Succeeded && status != Solved_To_Acceptable_Level) {
+        fprintf(stderr, "IPOPT finished with status %d\n", status);
+        return 1;
+    }
+    return 0;
+}
+"""
+
+# The linear solvers IPOPT can be built with from MUMPS and HSL, in order of preference
+# when they're equally fast
+linear_solver_candidates = ['mumps', 'ma27', 'ma57', 'ma77', 'ma86', 'ma97']
+
+def run_linear_solver_bench()->dict:
+    """
+    Time the installed IPOPT with each linear solver on a problem with --auto-scale
+    constraints. Solvers that it wasn't built with fail and are left out.
+
+    Returns
+    -------
+    dict
+        The iterations, time in the linear solver, and total time of each solver that worked.
+    """
+    var_name = 'DYLD_LIBRARY_PATH' if sys_info['sys_name'] == 'Darwin' else 'LD_LIBRARY_PATH'
+    saved_path = os.environ.get(var_name)
+    results = {}
+    with tempfile.TemporaryDirectory() as bench_dir:
+        with open(Path(bench_dir) / 'bench.c', 'w', encoding='utf-8') as f:
+            f.write(linear_solver_bench_src)
+
+        note('Building the linear solver benchmark')
+        if run_cmd(cmd_list=[os.environ['CC'], '-O2', '-o', 'bench', 'bench.c', f'-I{get_coin_inc_dir()}',
+                             *get_dep_lib_flags().split(), '-lipopt', '-lm'],
+                   cwd=bench_dir, raise_error=False) is None or not (Path(bench_dir) / 'bench').is_file():
+            note_failed()
+            return results
+        note_ok()
+
+        os.environ[var_name] = os.pathsep.join([str(prefix / 'lib') for prefix in get_dep_prefixes()] +
+                                               ([saved_path] if saved_path else []))
+        try:
+            for solver in linear_solver_candidates:
+                note(f'Timing IPOPT with {solver}')
+                out_file = Path(bench_dir) / f'{solver}.out'
+                start_time = time.perf_counter()
+                result = run_cmd(cmd_list=['./bench', str(opts['auto_scale']), solver, str(out_file)],
+                                 cwd=bench_dir, raise_error=False)
+                solve_seconds = time.perf_counter() - start_time
+                if result is None:
+                    note_result(yellow('not available'))
+                    continue
+
+                log = out_file.read_text(errors='replace')
+                iters = re.search(r'Number of Iterations\.*:\s*(\d+)', log)
+                # Not every interface times its numerical factorization separately, so
+                # the solvers are compared by all the time spent in them
+                linsol = re.search(r'StdAugSystemSolverMultiSolve\.*:\s*[\d.]+ \(sys:\s*[\d.]+ wall:\s*([\d.]+)\)', log)
+                results[solver] = {
+                    'iterations': int(iters.group(1)) if iters is not None else None,
+                    'linear_solver_seconds': float(linsol.group(1)) if linsol is not None else None,
+                    'solve_seconds': round(solve_seconds, 3)
+                }
+                note_result(f"{green('OK')} {results[solver]['iterations']} iterations, "
+                            f"{results[solver]['linear_solver_seconds']}s in the linear solver, "
+                            f"{solve_seconds:.2f}s total")
+        finally:
+            if saved_path is None:
+                del os.environ[var_name]
+            else:
+                os.environ[var_name] = saved_path
+
+    return results
+
+def select_linear_solver()->str:
+    """
+    Select the linear solver that IPOPT solves the KKT systems of the benchmark problem
+    fastest with, and record the measurements in its install manifest.
 
-    # pyOptSparse doesn't do well with Intel compilers, so unset:
-    # select_gnu_compiler()
+    Returns
+    -------
+    str
+        The selected linear solver, or None if none of them worked.
+    """
+    announce(f"Selecting the linear solver for IPOPT at scale {opts['auto_scale']}")
+    results = run_linear_solver_bench()
+    if len(results) == 0:
+        print(f'{yellow("WARNING")}: No linear solver completed the benchmark, '
+              'so the IPOPT default was not changed.')
+        return None
+
+    # Fall back to the total time if the timing statistics weren't found
+    selected = min(results, key=lambda solver: (results[solver]['linear_solver_seconds'] is None,
+                                                results[solver]['linear_solver_seconds'] or
+                                                results[solver]['solve_seconds']))
+    print(f'Selected {cyan(selected)} as the linear solver of IPOPT')
+
+    entry = get_manifest_entry('ipopt')
+    if entry is not None:
+        entry['linear_solver'] = {'selected': selected, 'scale': opts['auto_scale'], 'results': results}
+        if sys_info['stage_root'] is not None:
+            with open(Path(sys_info['stage_root']) / 'manifests' / 'ipopt.json', 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+        else:
+            with open_manifest() as manifest:
+                manifest['ipopt'] = entry
 
-    install_pyoptsparse_from_src()
+    return selected
 
 def copy_snopt_files(build_dirname):
     """
@@ -873,7 +3813,28 @@ def copy_snopt_files(build_dirname):
     note_ok()
 
 def patch_pyoptsparse_src():
-    """ Some versions of pyOptSparse need to be modified slightly to build correctly. """
+    """
+    Some versions of pyOptSparse need to be modified slightly to build correctly, and
+    the linear solver selected by --linear-solver=auto is made IPOPT's default.
+    """
+    ipopt_py = Path('pyoptsparse') / 'pyIPOPT' / 'pyIPOPT.py'
+    if ipopt_py.is_file():
+        # A persistent build tree still has the default set by an earlier run
+        if opts['build_root'] is not None:
+            run_cmd(cmd_list=['git', 'checkout', '-q', '--', str(ipopt_py)])
+
+        linear_solver = sys_info['task_results'].get('linear-solver-bench')
+        if linear_solver is not None:
+            note(f'Making {linear_solver} the default linear solver of IPOPT')
+            data, count = re.subn(r'("linear_solver":\s*\[str,\s*)"\w+"', rf'\1"{linear_solver}"',
+                                  ipopt_py.read_text(encoding='utf-8'))
+            if count == 0:
+                note_failed()
+                print(f'{yellow("WARNING")}: The linear_solver option was not found in {ipopt_py}, '
+                      f'pass linear_solver="{linear_solver}" to IPOPT yourself.')
+            else:
+                ipopt_py.write_text(data, encoding='utf-8')
+                note_ok()
 
     if opts['pyoptsparse_version'] < parse('2.6.3'):
         pushd("pyoptsparse/pyIPOPT")
@@ -893,51 +3854,711 @@ def patch_pyoptsparse_src():
         note_ok()
         popd()
 
-def install_pyoptsparse_from_src():
-    """ Git clone the pyOptSparse repo and use pip to install it. """
-    # First, build PAROPT if selected:
-    if opts['include_paropt'] is True:
-        install_paropt_from_src()
+def get_pyoptsparse_src(dir_name:str):
+    """
+    Git clone the pyOptSparse repo and pull in the SNOPT source if selected.
+
+    Parameters
+    ----------
+    dir_name : str
+        The existing empty directory to clone into.
+    """
+    git_clone('pyoptsparse', auto_delete=opts['build_pyoptsparse'], dir_name=dir_name)
+
+    if opts['snopt_dir'] is not None:
+        copy_snopt_files(dir_name)
+
+    popd()
+
+def install_pyoptsparse_from_src(dir_name:str):
+    """
+    Use pip to install pyOptSparse from the previously cloned source.
+
+    Parameters
+    ----------
+    dir_name : str
+        The directory that get_pyoptsparse_src() cloned the repo into.
+    """
+    pushd(dir_name)
+
+    if opts['include_ipopt'] is True:
+        os.environ['IPOPT_INC'] = get_coin_inc_dir()
+        ipopt_prefix = Path(os.environ['IPOPT_INC']).parent.parent
+        os.environ['IPOPT_LIB'] = str(ipopt_prefix / 'lib')
+        os.environ['IPOPT_DIR'] = str(ipopt_prefix)
+    os.environ['CFLAGS'] = '-Wno-implicit-function-declaration -std=c99'
+
+    if opts['build_pyoptsparse'] is True:
+        patch_pyoptsparse_src()
+
+        # `numpy.distutils` is deprecated since NumPy 1.23.0, as a result
+        # of the deprecation of `distutils` itself. It will be removed for
+        # Python >= 3.12. For older Python versions it will remain present.
+        # It is recommended to use `setuptools < 60.0` for those Python versions.
+        # For more details, see:
+        # https://numpy.org/devdocs/reference/distutils_status_migration.html
+        pip_install(pip_install_args=['setuptools<66.0'], pkg_desc='setuptools')
+
+        pip_install_package(['--no-cache-dir', './'], pkg_desc='pyoptsparse')
+    else:
+        announce('Not building pyOptSparse by request')
+        linear_solver = sys_info['task_results'].get('linear-solver-bench')
+        if linear_solver is not None:
+            print(f'Pass {code(f"linear_solver={linear_solver!r}")} in the IPOPT options to use the selected linear solver.')
+        if opts['include_ipopt'] is True:
+            print(f"""
+Make sure to set these environment variables before building it yourself:
+
+{code(f'export IPOPT_INC={subst_env_for_path(final_path(os.environ["IPOPT_INC"]))}')}
+{code(f'export IPOPT_LIB={subst_env_for_path(final_path(os.environ["IPOPT_LIB"]))}')}
+                   """)
+
+    popd()
+
+def add_task(tasks:dict, name:str, func, deps:list=None, cores:int=1, lock:str=None):
+    """
+    Add a node to the task graph.
+
+    Parameters
+    ----------
+    tasks : dict
+        The task graph, keyed by task name. Tasks must be added after their dependencies.
+    name : str
+        The name of the new task.
+    func : callable
+        Called with no arguments to perform the task. The return value is saved in
+        sys_info['task_results'], where tasks that depend on this one can find it.
+    deps : list
+        Names of tasks that must finish before this one starts. Names that are
+        not in the graph are ignored, so optional packages can be listed.
+    cores : int
+        The most CPU cores the task can use. It may be given fewer so that other
+        tasks can start at the same time.
+    lock : str
+        Tasks with the same lock never run at the same time.
+    """
+    tasks[name] = {
+        'func': func,
+        'deps': [dep for dep in (deps or []) if dep in tasks],
+        'cores': cores,
+        'lock': lock
+    }
+
+def get_conda_keys()->list:
+    """
+    Determine which packages will be installed with conda.
+
+    Returns
+    -------
+    list
+        The build_info keys of the packages.
+    """
+    conda_keys = []
+    if allow_install_with_conda() and opts['force_build'] is False:
+        if opts['linear_solver'] in ['mumps', 'hsl', 'mumps+hsl', 'auto']:
+            conda_keys.append('metis')
+        # IPOPT is built from source in the other modes, and its configure options are
+        # for ThirdParty-Mumps, not conda-forge's MUMPS libraries and include layout
+        if opts['linear_solver'] == 'mumps':
+            conda_keys.append('mumps')
+            if opts['include_ipopt'] is True:
+                conda_keys.append('ipopt')
+
+    return conda_keys
+
+def get_source_keys()->list:
+    """
+    Determine which packages will be cloned and built from source.
+
+    Returns
+    -------
+    list
+        The build_info keys of the packages.
+    """
+    source_keys = {
+        'mumps': ['metis', 'mumps'] + (['ipopt'] if opts['include_ipopt'] is True else []),
+        'hsl': ['metis', 'hsl', 'ipopt'],
+        'mumps+hsl': ['metis', 'mumps', 'hsl'] + (['ipopt'] if opts['include_ipopt'] is True else []),
+        'auto': ['metis', 'mumps', 'hsl', 'ipopt'],
+        'pardiso': ['ipopt']
+    }[opts['linear_solver']]
+    if opts['include_paropt'] is True:
+        source_keys.append('paropt')
+    source_keys.append('pyoptsparse')
+
+    conda_keys = get_conda_keys()
+    return [key for key in source_keys if key not in conda_keys and
+            (opts['force_build'] is True or not is_installed(key))]
+
+def build_task_graph(pos_dir_name:str)->dict:
+    """
+    Create the graph of install tasks for the selected options.
+
+    Parameters
+    ----------
+    pos_dir_name : str
+        The directory to clone and build pyOptSparse in.
+
+    Returns
+    -------
+    dict
+        The task graph, keyed by task name.
+    """
+    tasks = {}
+    cores = sys_info['compile_cores']
+
+    # Work out everything conda can provide up front, so it's solved and installed in
+    # one transaction. The tasks that depend on it build whatever conda didn't install.
+    conda_keys = get_conda_keys()
+    if len(conda_keys) > 0:
+        # conda and pip both modify the environment, so don't let them run at the same time:
+        add_task(tasks, 'conda', lambda: install_conda_pkgs(conda_keys), lock='env')
+
+    if opts['linear_solver'] == 'mumps':
+        add_task(tasks, 'metis', install_metis, deps=['conda'], cores=cores)
+        # MUMPS build can fail with parallel make
+        add_task(tasks, 'mumps', install_mumps, deps=['metis'])
+        if opts['include_ipopt'] is True:
+            add_task(tasks, 'ipopt', lambda: install_ipopt(config_opts=ipopt_opts_for_mumps()),
+                     deps=['mumps'], cores=cores)
+    elif opts['linear_solver'] == 'hsl':
+        add_task(tasks, 'metis', install_metis, deps=['conda'], cores=cores)
+        add_task(tasks, 'hsl', install_hsl_from_src, deps=['metis'], cores=cores)
+        add_task(tasks, 'ipopt', lambda: install_ipopt_from_src(config_opts=ipopt_opts_for_hsl()),
+                 deps=['hsl'], cores=cores)
+    elif opts['linear_solver'] in ['mumps+hsl', 'auto']:
+        # IPOPT only links with MUMPS and loads HSL at run time, so they're built side by side
+        add_task(tasks, 'metis', install_metis, deps=['conda'], cores=cores)
+        add_task(tasks, 'mumps', install_mumps, deps=['metis'])
+        add_task(tasks, 'hsl', install_hsl_from_src, deps=['metis'], cores=cores)
+        if opts['include_ipopt'] is True:
+            add_task(tasks, 'ipopt', lambda: install_ipopt_from_src(config_opts=ipopt_opts_for_loader()),
+                     deps=['mumps'], cores=cores)
+        if opts['linear_solver'] == 'auto':
+            add_task(tasks, 'linear-solver-bench', select_linear_solver, deps=['ipopt', 'hsl'])
+    elif opts['linear_solver'] == 'pardiso':
+        # install_ipopt_from_src(config_opts=['--with-lapack=-mkl'])
+        add_task(tasks, 'ipopt', install_ipopt_from_src, cores=cores)
+
+    if opts['include_paropt'] is True:
+        add_task(tasks, 'paropt', install_paropt_from_src, cores=cores, lock='env')
+
+    add_task(tasks, 'pyoptsparse-src', lambda: get_pyoptsparse_src(pos_dir_name))
+    add_task(tasks, 'pyoptsparse', lambda: install_pyoptsparse_from_src(pos_dir_name),
+             deps=['ipopt', 'linear-solver-bench', 'paropt', 'pyoptsparse-src'], cores=cores, lock='env')
+
+    return tasks
+
+def get_fork_context():
+    """
+    Find the multiprocessing context used to run tasks concurrently.
+
+    Returns
+    -------
+    multiprocessing.context.BaseContext
+        The 'fork' context, or None if the platform doesn't support it.
+    """
+    try:
+        return multiprocessing.get_context('fork')
+    except ValueError:
+        return None
+
+def run_task_child(name:str, task:dict, cores:int, mem_mb:int, conn):
+    """
+    Perform a task in a forked process and report the result through a pipe.
+
+    Parameters
+    ----------
+    name : str
+        The name of the task.
+    task : dict
+        The task graph node.
+    cores : int
+        The number of CPU cores allotted to the task.
+    mem_mb : int
+        The memory allotted to the task in MiB, or None if it's unknown.
+    conn : multiprocessing.connection.Connection
+        Where to send the result: a tuple with None on success or an error message
+        on failure, the trace events recorded by the task, and its return value.
+    """
+    # Lead a process group, so the commands started by the task can be stopped with it
+    os.setpgrp()
+    sys_info['task_label'] = name
+    sys_info['task_name'] = name
+    sys_info['log_count'] = 0
+    sys_info['task_cores'] = cores
+    sys_info['task_mem_mb'] = mem_mb
+    sys_info['trace_events'] = [{
+        'name': 'thread_name', 'ph': 'M', 'pid': sys_info['trace_pid'], 'tid': os.getpid(),
+        'args': {'name': name}
+    }]
+    try:
+        with trace_phase(name, 'task', {'cores': cores}):
+            result = task['func']()
+        conn.send((None, sys_info['trace_events'], result))
+    except BaseException as e:
+        report_cmd_failure(e)
+        conn.send((f'{type(e).__name__}: {e}', sys_info['trace_events'], None))
+    finally:
+        sys.stdout.flush()
+        conn.close()
+
+def stop_task_process(proc):
+    """
+    Stop a task process and every command it started, which are in its process group.
+
+    Parameters
+    ----------
+    proc : multiprocessing.Process
+        The task process.
+    """
+    try:
+        os.killpg(proc.pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass # The task and everything it started already exited
+    proc.join()
+
+def run_task_graph(tasks:dict):
+    """
+    Run each task once all of its dependencies have finished. Independent tasks run
+    concurrently in separate processes, sharing the cores in the budget, and the
+    available memory in proportion to their cores.
+
+    Parameters
+    ----------
+    tasks : dict
+        The task graph, keyed by task name.
+    """
+    budget = opts['cpu_budget']
+    ctx = get_fork_context()
+    concurrent = (ctx is not None and budget > 1)
+    mem_budget = None
+    if concurrent is True:
+        # Measured once for all tasks, since each would otherwise count its siblings'
+        # make jobs as load, and claim the memory they're about to use
+        try:
+            budget = max(1, min(budget, get_cpu_limit() - math.floor(os.getloadavg()[0])))
+        except OSError:
+            pass
+        mem_budget = get_available_memory_mb()
+    pending = dict(tasks)
+    done = set()
+    running = {} # Receiving connection: (name, process, connection, cores)
+
+    try:
+        while len(pending) > 0 or len(running) > 0:
+            used_cores = sum(r[3] for r in running.values())
+            held_locks = {tasks[r[0]]['lock'] for r in running.values()}
+            started = False
+
+            ready = [name for name, task in pending.items() if all(dep in done for dep in task['deps'])]
+            for ready_idx, name in enumerate(ready):
+                task = pending[name]
+                if concurrent is False:
+                    cores = min(task['cores'], budget)
+                    sys_info['task_cores'] = cores
+                    sys_info['task_name'] = name
+                    sys_info['log_count'] = 0
+                    try:
+                        with trace_phase(name, 'task', {'cores': cores}):
+                            sys_info['task_results'][name] = task['func']()
+                    except BaseException as e:
+                        report_cmd_failure(e)
+                        raise
+                    sys_info['task_cores'] = None
+                    sys_info['task_name'] = None
+                    done.add(name)
+                    del pending[name]
+                    started = True
+                    break # Start over, since more tasks may be ready now
+
+                if len(running) > 0 and used_cores >= budget:
+                    break
+                if task['lock'] is not None and task['lock'] in held_locks:
+                    continue
+
+                # Leave some of the free cores for the other ready tasks
+                free_cores = budget - used_cores
+                cores = max(1, min(task['cores'], free_cores // (len(ready) - ready_idx)))
+
+                mem_mb = None if mem_budget is None else mem_budget * cores // budget
+
+                recv_conn, send_conn = ctx.Pipe(duplex=False)
+                sys.stdout.flush()
+                proc = ctx.Process(target=run_task_child, args=(name, task, cores, mem_mb, send_conn))
+                proc.start()
+                try:
+                    # Also done by the child, so the group exists however they're scheduled
+                    os.setpgid(proc.pid, proc.pid)
+                except OSError:
+                    pass # The child already did it, or exited
+                send_conn.close()
+                running[recv_conn] = (name, proc, recv_conn, cores)
+                used_cores += cores
+                held_locks.add(task['lock'])
+                del pending[name]
+                started = True
+
+            if len(running) == 0:
+                if started is False and len(pending) > 0:
+                    raise RuntimeError(f'Unable to schedule tasks: {", ".join(pending)}')
+                continue
+
+            # The result is read as soon as the task sends it, since a large result fills
+            # the pipe and the task can't exit until it's read. The sentinel catches a task
+            # that dies without sending one.
+            by_sentinel = {r[1].sentinel: conn for conn, r in running.items()}
+            readable = multiprocessing.connection.wait(list(running) + list(by_sentinel))
+            for conn in dict.fromkeys(by_sentinel.get(obj, obj) for obj in readable):
+                name, proc, conn, cores = running.pop(conn)
+                try:
+                    error, events, result = conn.recv()
+                    sys_info['trace_events'].extend(events)
+                    sys_info['task_results'][name] = result
+                except EOFError:
+                    error = 'process exited unexpectedly'
+                conn.close()
+                proc.join()
+
+                if error is None and proc.exitcode == 0:
+                    done.add(name)
+                    continue
+
+                # Commands of the failed task may still be running
+                stop_task_process(proc)
+                raise RuntimeError(f'Task {yellow(name)} failed: {error}')
+    except BaseException:
+        # Task processes lead their own process groups, so they don't get the
+        # terminal's Ctrl-C, and must be stopped here along with their commands
+        for other in running.values():
+            stop_task_process(other[1])
+        raise
+
+def make_rpaths_relative(tree_dir:Path, files:list):
+    """
+    Change RPATH entries that point into the prefix to be relative to each library,
+    so the libraries in a bundle find each other wherever it's installed. This is
+    only done on Linux, with patchelf.
+
+    Parameters
+    ----------
+    tree_dir : Path
+        A copy of the prefix holding the files.
+    files : list
+        The files to check, relative to tree_dir.
+    """
+    if sys_info['sys_name'] != 'Linux':
+        return
+
+    patchelf = which('patchelf')
+    lib_dir = tree_dir / 'lib'
+    for rel_path in files:
+        file_path = tree_dir / rel_path
+        if file_path.is_symlink() or not file_path.is_file():
+            continue
+        with open(file_path, 'rb') as f:
+            if f.read(4) != b'\x7fELF':
+                continue
+
+        if patchelf is None:
+            print(f'{yellow("WARNING")}: patchelf was not found, so library search paths in '
+                  f'the bundle still refer to {code(subst_env_for_path(opts["prefix"]))}.')
+            return
+
+        rpath = run_cmd([patchelf, '--print-rpath', str(file_path)], capture=True).stdout.strip()
+        if opts['prefix'] not in rpath:
+            continue
+
+        rel_lib_dir = os.path.relpath(lib_dir, file_path.parent)
+        origin_dir = '$ORIGIN' if rel_lib_dir == '.' else f'$ORIGIN/{rel_lib_dir}'
+        new_rpath = ':'.join(origin_dir if entry == f'{opts["prefix"]}/lib' else entry
+                             for entry in rpath.split(':'))
+        run_cmd([patchelf, '--set-rpath', new_rpath, str(file_path)])
+
+def export_bundle(bundle_path:str):
+    """
+    Pack the packages built from source in the prefix into an archive that can be
+    installed in another prefix with --from-bundle. The archive holds bundle.json,
+    with the install manifest of each package, the installed files under tree/, and
+    the Python wheels built by this run under wheels/.
+
+    Parameters
+    ----------
+    bundle_path : str
+        Where to write the archive.
+    """
+    announce('Exporting a relocatable bundle')
+    prefix = Path(opts['prefix'])
+    packages = {}
+    for build_key in build_info:
+        entry = get_manifest_entry(build_key)
+        if entry is not None:
+            packages[build_key] = entry
+        elif installed_with_conda(build_key):
+            print(f'{yellow("WARNING")}: {build_key.upper()} was installed with conda, '
+                   'so it is not in the bundle.')
+
+    with tempfile.TemporaryDirectory(prefix='build_pyoptsparse-bundle-') as tmp_name:
+        bundle_dir = Path(tmp_name)
+        tree_dir = bundle_dir / 'tree'
+        note('Copying installed files')
+        files = []
+        for entry in packages.values():
+            for rel_path in entry['files']:
+                src_file = prefix / rel_path
+                dest_file = tree_dir / rel_path
+                dest_file.parent.mkdir(parents=True, exist_ok=True)
+                if src_file.is_symlink():
+                    dest_file.symlink_to(os.readlink(src_file))
+                else:
+                    shutil.copy2(str(src_file), str(dest_file))
+                files.append(rel_path)
+        note_ok()
+
+        make_rpaths_relative(tree_dir, files)
+
+        wheels = []
+        if sys_info['wheel_dir'] is not None:
+            (bundle_dir / 'wheels').mkdir()
+            for wheel in sorted(Path(sys_info['wheel_dir']).glob('**/*.whl')):
+                shutil.copy2(str(wheel), str(bundle_dir / 'wheels'))
+                wheels.append(wheel.name)
+
+        with open(bundle_dir / 'bundle.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'format': 1,
+                'prefix': opts['prefix'],
+                'sys_name': sys_info['sys_name'],
+                'machine': platform.machine(),
+                'python': platform.python_version(),
+                'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+                'packages': packages,
+                'wheels': wheels
+            }, f, indent=2)
+
+        note(f'Writing {code(subst_env_for_path(bundle_path))}')
+        tmp_path = f'{bundle_path}.{os.getpid()}.tmp'
+        with tarfile.open(tmp_path, 'w:gz') as tar:
+            for name in ['bundle.json', 'tree', 'wheels']:
+                if (bundle_dir / name).exists():
+                    tar.add(str(bundle_dir / name), arcname=name)
+        os.replace(tmp_path, bundle_path)
+        note_ok()
+
+    print(f'Bundled {", ".join(k.upper() for k in packages)} and {len(wheels)} wheels.')
+
+def install_bundle(bundle_path:str):
+    """
+    Install an archive made with --export-bundle into the prefix, as a staged install
+    so the prefix is only changed if everything in the bundle can be installed.
+
+    Parameters
+    ----------
+    bundle_path : str
+        The archive to install.
+    """
+    announce(f'Installing from {subst_env_for_path(bundle_path)}')
+    start_staged_install()
+    try:
+        note('Unpacking the bundle')
+        unpack_dir = Path(sys_info['stage_root']) / 'bundle'
+        with tarfile.open(bundle_path) as tar:
+            if hasattr(tarfile, 'data_filter'):
+                tar.extractall(unpack_dir, filter='data')
+            else:
+                # One at a time, so links extracted earlier are seen by the check
+                for member in tar:
+                    check_tar_member(member, unpack_dir)
+                    tar.extract(member, unpack_dir)
+        with open(unpack_dir / 'bundle.json', encoding='utf-8') as f:
+            bundle = json.load(f)
+        note_ok()
+
+        if bundle['sys_name'] != sys_info['sys_name'] or bundle['machine'] != platform.machine():
+            raise RuntimeError(f'The bundle was built for {bundle["sys_name"]} {bundle["machine"]}, '
+                               f'not {sys_info["sys_name"]} {platform.machine()}.')
+
+        python_ver = platform.python_version_tuple()[:2]
+        if len(bundle['wheels']) > 0 and bundle['python'].split('.')[:2] != list(python_ver):
+            raise RuntimeError(f'The wheels in the bundle are for Python {bundle["python"]}, '
+                               f'not {platform.python_version()}.')
+
+        note('Placing files in the staging tree')
+        stage_prefix = get_stage_prefix()
+        stage_prefix.parent.mkdir(parents=True, exist_ok=True)
+        if (unpack_dir / 'tree').is_dir():
+            (unpack_dir / 'tree').rename(stage_prefix)
+        for build_key, entry in bundle['packages'].items():
+            relocate_text_files(list(entry['files']), bundle['prefix'])
+            relocate_binaries(list(entry['files']), bundle['prefix'])
+            build_info[build_key]['branch'] = entry['branch']
+            record_manifest(build_key, list(entry['files']), build_id=entry['build_id'])
+        note_ok()
+
+        if len(bundle['wheels']) > 0:
+            sys_info['wheel_dir'] = str(unpack_dir / 'wheels')
+        commit_staged_install()
+    finally:
+        if sys_info['stage_root'] is not None:
+            discard_staged_install()
+
+# The Linux ioctl request that makes a file share the data of another (a reflink)
+FICLONE = 0x40049409
+
+def link_file(src_file:Path, dest_file:Path)->str:
+    """
+    Make a file available at another path without copying its data if possible:
+    with a hard link, or a reflink on filesystems with copy-on-write support.
+
+    Parameters
+    ----------
+    src_file : Path
+        The file to share.
+    dest_file : Path
+        The new path, which must not exist.
+
+    Returns
+    -------
+    str
+        How the file was shared: 'hardlink', 'reflink', or 'copy'.
+    """
+    try:
+        os.link(src_file, dest_file)
+        return 'hardlink'
+    except OSError:
+        pass
+
+    if sys_info['sys_name'] == 'Linux':
+        try:
+            with open(src_file, 'rb') as src, open(dest_file, 'wb') as dest:
+                fcntl.ioctl(dest.fileno(), FICLONE, src.fileno())
+            shutil.copystat(str(src_file), str(dest_file))
+            return 'reflink'
+        except OSError:
+            dest_file.unlink(missing_ok=True)
 
-    build_dir = git_clone('pyoptsparse', opts['build_pyoptsparse'])
+    shutil.copy2(str(src_file), str(dest_file))
+    return 'copy'
 
-    if opts['include_ipopt'] is True:
-        os.environ['IPOPT_INC'] = get_coin_inc_dir()
-        os.environ['IPOPT_LIB'] = str(Path(opts["prefix"]) / 'lib')
-        os.environ['IPOPT_DIR'] = str(Path(opts["prefix"]))
-    os.environ['CFLAGS'] = '-Wno-implicit-function-declaration -std=c99'
+def installed_wheel_libraries(python_cmd:str)->list:
+    """
+    List the shared libraries and extension modules installed from the wheels built by
+    this run.
 
-    # Pull in SNOPT source:
-    if opts['snopt_dir'] is not None:
-        build_dir_str = build_dir if isinstance(build_dir, str) else build_dir.name
-        copy_snopt_files(build_dir_str)
+    Parameters
+    ----------
+    python_cmd : str
+        The Python interpreter the wheels were installed with.
 
-    if opts['build_pyoptsparse'] is True:
-        patch_pyoptsparse_src()
+    Returns
+    -------
+    list
+        The installed files, relative to the prefix.
+    """
+    if sys_info['wheel_dir'] is None:
+        return []
 
-        # `numpy.distutils` is deprecated since NumPy 1.23.0, as a result
-        # of the deprecation of `distutils` itself. It will be removed for
-        # Python >= 3.12. For older Python versions it will remain present.
-        # It is recommended to use `setuptools < 60.0` for those Python versions.
-        # For more details, see:
-        # https://numpy.org/devdocs/reference/distutils_status_migration.html
-        pip_install(pip_install_args=['setuptools<66.0'], pkg_desc='setuptools')
+    result = run_cmd([python_cmd, '-c', 'import sysconfig; print(sysconfig.get_paths()["platlib"])'],
+                     capture=True)
+    platlib = Path(result.stdout.strip())
+    files = []
+    for wheel in sorted(Path(sys_info['wheel_dir']).glob('**/*.whl')):
+        with zipfile.ZipFile(wheel) as zf:
+            files.extend(os.path.relpath(platlib / name, opts['prefix']) for name in zf.namelist()
+                         if re.search(r'\.(so|dylib)(\.|$)', name) is not None)
 
-        pip_install(pip_install_args=['--no-cache-dir', './'], pkg_desc='pyoptsparse')
-    else:
-        announce('Not building pyOptSparse by request')
-        if opts['include_ipopt'] is True:
-            print(f"""
-Make sure to set these environment variables before building it yourself:
+    return files
 
-{code(f'export IPOPT_INC={subst_env_for_path(os.environ["IPOPT_INC"])}')}
-{code(f'export IPOPT_LIB={subst_env_for_path(os.environ["IPOPT_LIB"])}')}
-                   """)
+def install_into_extra_prefix(target:str):
+    """
+    Install the packages built from source in the prefix, and the wheels built by this
+    run, into another environment. It's done as a staged install of the target.
 
-    popd()
+    Parameters
+    ----------
+    target : str
+        The prefix of the other environment.
+    """
+    announce(f'Installing into {subst_env_for_path(target)}')
+    build_prefix = opts['prefix']
+    packages = {}
+    for build_key in build_info:
+        entry = get_manifest_entry(build_key)
+        if entry is not None:
+            packages[build_key] = entry
+
+    opts['prefix'] = target
+    try:
+        start_staged_install()
+        stage_prefix = get_stage_prefix()
+        note('Linking installed files')
+        counts = collections.Counter()
+        for entry in packages.values():
+            for rel_path in entry['files']:
+                src_file = Path(build_prefix) / rel_path
+                dest_file = stage_prefix / rel_path
+                dest_file.parent.mkdir(parents=True, exist_ok=True)
+                if src_file.is_symlink():
+                    dest_file.symlink_to(os.readlink(src_file))
+                else:
+                    counts[link_file(src_file, dest_file)] += 1
+        note_ok()
+        print(f'Shared {counts["hardlink"]} files with hard links and {counts["reflink"]} '
+              f'with reflinks, copied {counts["copy"]}.')
+
+        for build_key, entry in packages.items():
+            relocate_text_files(list(entry['files']), build_prefix)
+            relocate_binaries(list(entry['files']), build_prefix)
+            record_manifest(build_key, list(entry['files']), build_id=entry['build_id'])
+
+        python_cmd = str(Path(target) / 'bin' / 'python')
+        commit_staged_install(python_cmd=python_cmd)
+        # Extension modules built against the libraries in the build prefix
+        relocate_binaries(installed_wheel_libraries(python_cmd), build_prefix)
+    finally:
+        if sys_info['stage_root'] is not None:
+            discard_staged_install()
+        opts['prefix'] = build_prefix
+
+def show_installed():
+    """ Print a summary of the install manifest of each package built from source. """
+    announce(f'Packages built from source in {subst_env_for_path(opts["prefix"])}')
+    found = False
+    for build_key in build_info:
+        entry = get_manifest_entry(build_key)
+        if entry is None:
+            continue
+
+        found = True
+        size_mib = sum(info.get('size', 0) for info in entry['files'].values()) / 2**20
+        print(f"{build_key.upper():<8} {entry['branch']:<16} build {entry['build_id'][:12]}  "
+              f"{len(entry['files'])} files, {size_mib:.1f} MiB, installed {entry['installed']}")
+        if 'linear_solver' in entry:
+            times = ', '.join(f"{solver} {result['linear_solver_seconds']}s"
+                              for solver, result in entry['linear_solver']['results'].items())
+            print(f"{'':<8} linear solver {entry['linear_solver']['selected']}, selected at scale "
+                  f"{entry['linear_solver']['scale']} by time in the linear solver: {times}")
+
+    if found is False:
+        print('No packages were found in the install manifest.')
 
 def uninstall_built_item(build_key:str):
-    """ Uninstall a specific item that was previously built from source code. """
+    """
+    Uninstall a specific item that was previously built from source code, removing
+    the files in its install manifest. Without a manifest, the files are found with
+    the patterns in build_info.
+    """
+    entry = get_manifest_entry(build_key)
+    if entry is not None:
+        note(f'Removing {build_key.upper()} files')
+        kept = remove_manifest_files(entry['files'])
+        with open_manifest() as manifest:
+            del manifest[build_key]
+        note_ok()
+        for rel_path in kept:
+            print(f'{yellow("NOTE")}: Kept {code(rel_path)}, which changed after it was installed.')
+        return
+
     d = build_info[build_key]
 
     if 'include_subdir' in d:
@@ -977,13 +4598,8 @@ def uninstall_built_item(build_key:str):
 
 def uninstall_paropt_and_pyoptsparse():
     """ Both ParOpt and pyOptSparse were installed with pip. """
-    # Uninstall pyOptSparse
-    note('Removing pyOptSparse')
-    run_cmd(cmd_list=['pip','uninstall','-y','pyOptSparse'], do_check=False)
-    note_ok()
-
-    note('Removing PAROPT package')
-    run_cmd(cmd_list=['pip','uninstall','-y','paropt'], do_check=False)
+    note('Removing pyOptSparse and PAROPT packages')
+    run_cmd(cmd_list=['pip','uninstall','-y','pyOptSparse','paropt'], do_check=False)
     note_ok()
     uninstall_built_item('paropt')
 
@@ -1011,9 +4627,19 @@ def uninstall_conda_pkgs():
     """ Attempt to remove packages previously installed by conda. """
 
     if conda_is_active():
-        for pkg in ['ipopt','mumps','mumps-include','mumps-seq','mumps-mpi','metis']:
-            note(f"Removing {pkg.upper()} conda package")
-            run_cmd(cmd_list=[opts['conda_cmd'],'uninstall','-y',pkg], do_check=False)
+        # Only ask for packages that are there, since a missing one fails the whole transaction
+        known_pkgs = ['ipopt','mumps','mumps-include','mumps-seq','mumps-mpi','metis']
+        result = run_cmd(cmd_list=[opts['conda_cmd'],'list','--json'], do_check=False,
+                         capture=True)
+        try:
+            installed = {pkg['name'] for pkg in json.loads(result.stdout)}
+            pkg_list = [pkg for pkg in known_pkgs if pkg in installed]
+        except (ValueError, TypeError, KeyError):
+            pkg_list = known_pkgs
+
+        if len(pkg_list) > 0:
+            note(f"Removing {', '.join(pkg.upper() for pkg in pkg_list)} conda packages")
+            run_cmd(cmd_list=[opts['conda_cmd'],'uninstall','-y'] + pkg_list, do_check=False)
             note_ok()
 
 def display_environment():
@@ -1022,74 +4648,320 @@ def display_environment():
         if ev in os.environ:
             print(f'{cyan(ev)}: {code(os.environ[ev])}')
 
-def check_library(libname:str, raise_on_failure=True):
+# Minimal programs used to test the compilers and libraries
+hello_src = {
+    'hello.c': '#include <stdio.h>\nint main() {\nprintf("cc works!\\n");\nreturn 0;\n}\n',
+    'hello.cc': '#include <iostream>\nint main() {\nstd::cout << "c++ works!" << std::endl;\nreturn 0;\n}\n',
+    'hello.f90': "program hello\n  print *, 'fortran works!'\nend program hello"
+}
+
+def build_hello(compiler:str, src_name:str, link_args:list=None, run:bool=True):
     """
-    Determine whether the specified library is available for linking.
+    Build, and optionally run, a minimal program in a new temporary directory.
+
+    Parameters
+    ----------
+    compiler : str
+        The compiler command.
+    src_name : str
+        A key in hello_src selecting the source file to build.
+    link_args : list
+        Additional arguments for the compiler, such as libraries to link with.
+    run : bool
+        Run the program after building it if true.
+    """
+    with tempfile.TemporaryDirectory() as build_dir:
+        with open(Path(build_dir) / src_name, 'w', encoding="utf-8") as f:
+            f.write(hello_src[src_name])
+
+        run_cmd(cmd_list=[compiler, '-o', 'hello', src_name] + (link_args or []), cwd=build_dir)
+        if run is True:
+            run_cmd(cmd_list=['./hello'], cwd=build_dir)
+
+def find_library_file(libname:str)->str:
+    """
+    Ask the C compiler which file it links with for a library.
 
     Parameters
     ----------
     libname : str
         The name of the library without the preceding 'lib' or '.a/.so.*/.dll' extension.
+
+    Returns
+    -------
+    str
+        The resolved path of the library, or None if the compiler didn't find it.
     """
+    for ext in ['dylib' if sys_info['sys_name'] == 'Darwin' else 'so', 'a']:
+        result = subprocess.run([os.environ['CC'], f'-print-file-name=lib{libname}.{ext}'],
+                                check=False, capture_output=True, text=True)
+        # The name is printed unchanged if the library isn't found
+        lib_path = result.stdout.strip()
+        if result.returncode == 0 and os.path.isabs(lib_path) and os.path.isfile(lib_path):
+            return os.path.realpath(lib_path)
 
-    build_dir = tempfile.TemporaryDirectory()
-    pushd(build_dir.name)
+    return None
 
-    note(f'Checking for library: {libname}')
-    with open('hello.c', 'w', encoding="utf-8") as f:
-        f.write('#include <stdio.h>\nint main() {\nprintf("cc works!\\n");\nreturn 0;\n}\n')
+def check_library(libname:str, raise_on_failure=True)->str:
+    """
+    Determine whether the specified library is available for linking.
 
-    result = run_cmd(cmd_list=[os.environ['CC'], '-o', 'hello_c', 'hello.c', f'-l{libname}'],
-                    raise_error=False)
+    Parameters
+    ----------
+    libname : str
+        The name of the library without the preceding 'lib' or '.a/.so.*/.dll' extension.
+    raise_on_failure : bool
+        If true, raise an exception if the library isn't found, otherwise return a warning.
 
-    success = (result is not None and result.returncode == 0)
-    if success is True:
-        note_ok()
-    else:
-        print(red('not found'))
+    Returns
+    -------
+    str
+        A warning message if the library wasn't found, otherwise None.
+    """
+    link_env = {var: os.environ.get(var) for var in ['LDFLAGS', 'LIBRARY_PATH', 'LD_LIBRARY_PATH']}
+    # The linker could pick up a different file if one is installed or replaced
+    lib_path = find_library_file(libname)
+    link_env['library'] = {'path': lib_path, 'mtime': os.stat(lib_path).st_mtime_ns if lib_path else None}
+    try:
+        cached_probe(f'library {libname}', [sys_info['compilers']['CC']],
+                     lambda: build_hello(os.environ['CC'], 'hello.c', link_args=[f'-l{libname}'], run=False),
+                     extra_inputs=link_env)
+    except subprocess.CalledProcessError:
         if raise_on_failure is True:
             raise RuntimeError(f'Cannot continue without {libname} library.')
+        return f'{libname} library not found.'
 
-    popd()
+    return None
 
-    return success
+# Links with the BLAS and LAPACK routines the solvers use, and prints the threading
+# model: 0 for sequential, 1 for pthreads, 2 for OpenMP
+blas_probe_src = """#include <stdio.h>
+extern void dgemm_(void);
+extern void dgetrf_(void);
+{decl}
+int main() {{
+    void (*volatile funcs[])(void) = {{dgemm_, dgetrf_}};
+    printf("%d\\n", {threading});
+    return funcs[0] == 0;
+}}
+"""
+
+# How to ask each implementation for its threading model
+blas_threading_queries = {
+    'openblas': ('extern int openblas_get_parallel(void);', 'openblas_get_parallel()'),
+    'blis': ('extern long bli_info_get_enable_openmp(void);\nextern long bli_info_get_enable_pthreads(void);',
+             '(int)(bli_info_get_enable_openmp() ? 2 : bli_info_get_enable_pthreads() ? 1 : 0)'),
+    # -lblas is often another implementation installed as the system BLAS, so ask
+    # whichever one is loaded. The reference BLAS has no query, so it's reported unknown.
+    'reference': ('''#include <dlfcn.h>
+static int reference_threading(void) {
+    void *self = dlopen(0, RTLD_LAZY);
+    int (*openblas)(void) = (int (*)(void))dlsym(self, "openblas_get_parallel");
+    long (*blis_openmp)(void) = (long (*)(void))dlsym(self, "bli_info_get_enable_openmp");
+    long (*blis_pthreads)(void) = (long (*)(void))dlsym(self, "bli_info_get_enable_pthreads");
+    if (openblas) return openblas();
+    if (blis_openmp && blis_pthreads) return blis_openmp() ? 2 : blis_pthreads() ? 1 : 0;
+    return -1;
+}''', 'reference_threading()')
+}
 
-def check_compiler_sanity():
-    """ Build and run programs written in C, C++, and FORTRAN to test the compilers. """
-    build_dir = tempfile.TemporaryDirectory()
-    pushd(build_dir.name)
+def get_blas_candidates(blas_name:str)->list:
+    """
+    List the ways of linking with a BLAS/LAPACK implementation, in order of preference.
 
-    note(f'Testing {os.environ["CC"]}')
-    with open('hello.c', 'w', encoding="utf-8") as f:
-        f.write('#include <stdio.h>\nint main() {\nprintf("cc works!\\n");\nreturn 0;\n}\n')
+    Parameters
+    ----------
+    blas_name : str
+        One of 'mkl', 'openblas', 'blis', or 'reference'.
 
-    run_cmd(cmd_list=[os.environ['CC'], '-o', 'hello_c', 'hello.c'])
-    run_cmd(cmd_list=['./hello_c'])
-    note_ok()
+    Returns
+    -------
+    list
+        Tuples of link flags, and the threading model if it's determined by the flags.
+    """
+    if blas_name == 'reference':
+        return [('-llapack -lblas', None)]
+    if blas_name == 'openblas':
+        return [('-lopenblas', None)]
+    if blas_name == 'blis':
+        # libflame provides LAPACK on top of BLIS
+        return [('-lflame -lblis', None), ('-llapack -lblis', None)]
+
+    lib_dirs = []
+    if 'MKLROOT' in os.environ:
+        lib_dirs = [d for d in [Path(os.environ['MKLROOT']) / 'lib' / 'intel64', Path(os.environ['MKLROOT']) / 'lib']
+                    if len(list(d.glob('libmkl_core.*'))) > 0]
+    lib_flags = f'-L{lib_dirs[0]} ' if len(lib_dirs) > 0 else ''
+    if sys_info['sys_name'] == 'Linux':
+        lib_flags += '-Wl,--no-as-needed '
+
+    # gfortran needs the gf interface layer. The threaded layers match the compilers' OpenMP.
+    if opts['intel_compiler_suite'] is True:
+        layers = [('-lmkl_intel_lp64 -lmkl_intel_thread -lmkl_core -liomp5', 'openmp')]
+    else:
+        layers = [('-lmkl_gf_lp64 -lmkl_gnu_thread -lmkl_core -lgomp', 'openmp')]
+    layers.append((layers[0][0].split()[0] + ' -lmkl_sequential -lmkl_core', 'sequential'))
+    return [(f'{lib_flags}{libs} -lpthread -lm -ldl', threading) for libs, threading in layers]
 
-    note(f'Testing {os.environ["CXX"]}')
-    with open('hello.cc', 'w', encoding="utf-8") as f:
-        f.write('#include <iostream>\nint main() {\nstd::cout << "c++ works!" << std::endl;\nreturn 0;\n}\n')
+def probe_blas(blas_name:str, link_flags:str)->str:
+    """
+    Build and run a program that uses BLAS and LAPACK with the given link flags.
 
-    run_cmd(cmd_list=[os.environ['CXX'], '-o', 'hello_cxx', 'hello.cc'])
-    run_cmd(cmd_list=['./hello_cxx'])
-    note_ok()
+    Parameters
+    ----------
+    blas_name : str
+        The implementation the flags are for.
+    link_flags : str
+        The flags to link with.
 
-    if opts['include_paropt']:
-        note(f'Testing mpicxx')
-        run_cmd(cmd_list=['mpicxx', '-o', 'hello_cxx_mpi', 'hello.cc'])
-        run_cmd(cmd_list=['./hello_cxx_mpi'])
-        note_ok()
+    Returns
+    -------
+    str
+        The threading model reported by the implementation, or None if it can't tell.
+    """
+    decl, threading = blas_threading_queries.get(blas_name, ('', '-1'))
+    with tempfile.TemporaryDirectory() as build_dir:
+        with open(Path(build_dir) / 'blas.c', 'w', encoding='utf-8') as f:
+            f.write(blas_probe_src.format(decl=decl, threading=threading))
 
-    note(f'Testing {os.environ["FC"]}')
-    with open('hello.f90', 'w', encoding="utf-8") as f:
-        f.write("program hello\n  print *, 'fortran works!'\nend program hello")
+        # dlopen() is in libdl with older glibc versions
+        libdl = ['-ldl'] if sys_info['sys_name'] == 'Linux' else []
+        run_cmd(cmd_list=[os.environ['CC'], '-o', 'blas', 'blas.c'] + link_flags.split() + libdl,
+                cwd=build_dir)
+        result = run_cmd(cmd_list=['./blas'], cwd=build_dir, capture=True)
 
-    run_cmd(cmd_list=[os.environ['FC'], '-o', 'hello_f', 'hello.f90'])
-    run_cmd(cmd_list=['./hello_f'])
-    note_ok()
+    return {'0': 'sequential', '1': 'pthreads', '2': 'openmp'}.get(result.stdout.strip())
 
-    popd()
+def select_blas():
+    """
+    Find the BLAS/LAPACK implementations that can be linked with, and select the one
+    that MUMPS, HSL, and IPOPT are configured to use.
+    """
+    names = ['mkl', 'openblas', 'blis', 'reference'] if opts['blas'] == 'auto' else [opts['blas']]
+    link_env = {var: os.environ.get(var) for var in ['LDFLAGS', 'LIBRARY_PATH', 'LD_LIBRARY_PATH', 'MKLROOT']}
+    found = {}
+
+    def find(blas_name:str):
+        for link_flags, threading in get_blas_candidates(blas_name):
+            # Switching the system BLAS changes what -lblas resolves to
+            lib_paths = [find_library_file(flag[2:]) for flag in link_flags.split() if flag.startswith('-l')]
+            probe_inputs = dict(link_env, libraries={p: os.stat(p).st_mtime_ns for p in lib_paths if p})
+            try:
+                probed = cached_probe(f'blas {link_flags}', [sys_info['compilers']['CC']],
+                                      lambda: probe_blas(blas_name, link_flags), extra_inputs=probe_inputs)
+            except (subprocess.CalledProcessError, OSError):
+                continue
+            found[blas_name] = {'name': blas_name, 'flags': link_flags, 'threading': threading or probed}
+            return
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(names)) as pool:
+        list(pool.map(find, names))
+
+    print('BLAS/LAPACK implementations: ' + ', '.join(
+        f"{name} ({found[name]['threading'] or 'unknown threading'})" if name in found else f'{name} (not found)'
+        for name in names))
+
+    selected = [name for name in names if name in found]
+    if len(selected) == 0:
+        if opts['blas'] == 'auto':
+            print(f'{yellow("WARNING")}: No BLAS/LAPACK was found, leaving it to the configure scripts.')
+            return
+        raise RuntimeError(f"--blas={opts['blas']} was selected, but it could not be linked with.")
+
+    sys_info['blas'] = found[selected[0]]
+    print(f"Using {cyan(selected[0])} for BLAS/LAPACK: {code(sys_info['blas']['flags'])}")
+
+def blas_configure_args()->list:
+    """
+    Create the configure arguments for linking with the selected BLAS/LAPACK.
+
+    Returns
+    -------
+    list
+        The arguments, or nothing if the configure script should find it.
+    """
+    if sys_info['blas'] is None:
+        return []
+
+    return [f"--with-lapack-lflags={sys_info['blas']['flags']}"]
+
+def report_blas_linkage():
+    """ Show which BLAS and LAPACK libraries the installed solver libraries load. """
+    if sys_info['sys_name'] == 'Darwin':
+        list_cmd = ['otool', '-L']
+    else:
+        list_cmd = ['ldd']
+    if which(list_cmd[0]) is None:
+        return
+
+    for lib_glob in ['libcoinmumps.*', 'libcoinhsl.*', 'libipopt.*']:
+        libs = sorted(p for p in (Path(opts['prefix']) / 'lib').glob(lib_glob) if not p.is_symlink())
+        if len(libs) == 0:
+            continue
+
+        result = run_cmd(cmd_list=list_cmd + [str(libs[0])], capture=True, raise_error=False)
+        if result is None:
+            continue
+        blas_libs = sorted({Path(line.split()[0]).name for line in result.stdout.splitlines()[1:]
+                            if re.search(r'blas|lapack|mkl|blis|flame', line) is not None})
+        print(f"{libs[0].name} loads {', '.join(blas_libs) if blas_libs else 'no BLAS/LAPACK library'}")
+
+def get_probe_error(e:Exception)->str:
+    """
+    Create an error message for a failed check, including the end of the error output
+    of a failed command.
+
+    Parameters
+    ----------
+    e : Exception
+        The exception raised by the check.
+
+    Returns
+    -------
+    str
+        The error message.
+    """
+    msg = str(e)
+    if isinstance(e, subprocess.CalledProcessError) and e.stderr:
+        msg += '\n' + '\n'.join(str(e.stderr).strip().splitlines()[-5:])
+
+    return msg
+
+def run_probes(probes:dict)->list:
+    """
+    Run independent environment checks concurrently, then print their results in order.
+    Each check is a function that returns None or a warning message, and raises an
+    exception on failure. Checks must not change the current directory.
+
+    Parameters
+    ----------
+    probes : dict
+        The checks to run, keyed by a description of each.
+
+    Returns
+    -------
+    list
+        Error messages for the checks that failed.
+    """
+    errors = []
+    if len(probes) == 0:
+        return errors
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(probes)) as pool:
+        futures = {desc: pool.submit(func) for desc, func in probes.items()}
+
+    for desc, future in futures.items():
+        note(desc)
+        try:
+            warning = future.result()
+            note_ok()
+            if warning is not None:
+                print(f'{yellow("WARNING")}: {warning}')
+        except Exception as e:
+            note_failed()
+            errors.append(f"{red('ERROR')}: {desc}: {get_probe_error(e)}")
+
+    return errors
 
 def find_required_command(cmd:str, errors:list):
     """
@@ -1131,7 +5003,6 @@ If it does, set up Intel OneAPI {yellow('before')} activating your conda env.
 """[1:])
 
     if opts['compile_required'] is True or opts['fall_back'] is True:
-        check_make(errors)
         required_cmds.extend(['git', os.environ['CC'], os.environ['CXX'], os.environ['FC']])
         if opts['build_pyoptsparse'] is True:
             required_cmds.extend(['pip', 'swig'])
@@ -1156,42 +5027,182 @@ If it does, set up Intel OneAPI {yellow('before')} activating your conda env.
     for cmd in required_cmds:
         find_required_command(cmd, errors)
 
+    # Each of these runs in its own temporary directory, so they can run at the same time
+    probes = {}
+    if opts['compile_required'] is True or opts['fall_back'] is True:
+        probes['Checking make'] = check_make
+        for var, src_name in [('CC', 'hello.c'), ('CXX', 'hello.cc'), ('FC', 'hello.f90')]:
+            comp = os.environ[var]
+            # The compiler cache wrappers are rewritten by every run, so identify the real compiler
+            probes[f'Testing {comp}'] = lambda comp=comp, src_name=src_name, var=var: \
+                cached_probe(f'compiler {src_name}', [sys_info['compilers'][var]],
+                             lambda: build_hello(comp, src_name))
+
+        if opts['include_paropt']:
+            probes['Testing mpicxx'] = lambda: \
+                cached_probe('compiler mpicxx', ['mpicxx'], lambda: build_hello('mpicxx', 'hello.cc'))
+
+        for libname in ['lapack', 'blas']:
+            probes[f'Checking for library: {libname}'] = lambda libname=libname: check_library(libname)
+
+        if opts['build_pyoptsparse'] is True:
+            def check_openblas():
+                if check_library('openblas', raise_on_failure=False) is not None:
+                    return 'openblas missing. Required to build scipy on uncommon platforms.'
+            probes['Checking for library: openblas'] = check_openblas
+
+    errors.extend(run_probes(probes))
+
     if len(errors) > 0:
         for err in errors:
             print(err)
 
         exit(1)
 
-    if opts['compile_required'] is True or opts['fall_back'] is True:
-        check_compiler_sanity()
-        check_library('lapack')
-        check_library('blas')
-
-        if opts['build_pyoptsparse'] is True:
-            if check_library('openblas', raise_on_failure=False) is False:
-                print(f"{yellow('WARNING')}: openblas missing. Required to build scipy on uncommon platforms.")
-
 def select_intel_compilers():
     """ Set environment variables to use Intel compilers. """
-    os.environ['CC'] = 'icc'
-    os.environ['CXX'] = 'icpc'
-    os.environ['FC'] = 'ifort'
+    sys_info['compilers'] = {'CC': 'icc', 'CXX': 'icpc', 'FC': 'ifort'}
+    os.environ.update(sys_info['compilers'])
     sys_info['gcc_major_ver'] = -1
 
 def select_gnu_compilers():
     """ Set environment variables to use GNU compilers. """
-    os.environ['CC'] = 'gcc'
-    os.environ['CXX'] = 'g++'
-    os.environ['FC'] = 'gfortran'
+    sys_info['compilers'] = {'CC': 'gcc', 'CXX': 'g++', 'FC': 'gfortran'}
+    os.environ.update(sys_info['compilers'])
+
+def check_gcc_version()->str:
+    """
+    Determine the major version of gcc.
+
+    Returns
+    -------
+    str
+        A warning message if it couldn't be determined, otherwise None.
+    """
     gcc_ver = subprocess.run(['gcc', '-dumpversion'], capture_output=True)
-    sys_info['gcc_major_ver'] = int(gcc_ver.stdout.decode('UTF-8').split('.')[0])
+    try:
+        sys_info['gcc_major_ver'] = int(gcc_ver.stdout.decode('UTF-8').split('.')[0])
+    except ValueError:
+        return 'Unable to determine the gcc version.'
+
+    return None
+
+def check_conda_forge()->str:
+    """
+    Determine whether the conda-forge channel is available.
+
+    Returns
+    -------
+    str
+        A warning message if the channel is not available, otherwise None.
+    """
+    def channel_found()->bool:
+        cmd_list=['info','--unsafe-channels']
+        result = run_conda_cmd(cmd_list, capture=True)
+        if re.search(r'conda.*forge', result.stdout) is None:
+            # Raised so the result isn't cached, and adding the channel takes effect
+            raise LookupError('conda-forge')
+        return True
+
+    # The channel list comes from the condarc files and environment variables
+    condarc_files = [Path.home() / '.condarc', Path.home() / '.conda' / '.condarc',
+                     Path(os.environ['CONDA_PREFIX']) / '.condarc']
+    if 'CONDARC' in os.environ:
+        condarc_files.append(Path(os.environ['CONDARC']))
+    channel_inputs = {str(f): f.stat().st_mtime_ns for f in condarc_files if f.is_file()}
+    channel_inputs['env'] = {var: os.environ.get(var) for var in ['CONDA_PREFIX', 'CONDA_CHANNELS']}
+
+    try:
+        cached_probe('conda-forge', [opts['conda_cmd']], channel_found, extra_inputs=channel_inputs)
+    except LookupError:
+        opts['compile_required'] = True
+        return 'The conda-forge channel is not configured, cannot install conda packages. ' \
+               'Falling back to building from source.'
+
+    sys_info['conda_forge_available'] = True
+    return None
+
+def select_compiler_cache():
+    """
+    Find ccache or sccache and point the compiler environment variables at wrapper
+    scripts that run the selected compilers through it. Wrapper scripts are used
+    instead of values like 'ccache gcc' because some build tools don't accept a
+    command with arguments in CC.
+    """
+    candidates = ['ccache', 'sccache'] if opts['compiler_cache'] == 'auto' else [opts['compiler_cache']]
+    for tool in candidates:
+        tool_path = which(tool)
+        if tool_path is not None:
+            break
+    else:
+        print(f'{yellow("WARNING")}: {" or ".join(candidates)} not found, '
+              'building without a compiler cache.')
+        return
+
+    sys_info['compiler_cache_cmd'] = tool_path
+    cache_dir = Path(opts['cache_dir'])
+    if tool == 'ccache':
+        os.environ.setdefault('CCACHE_DIR', str(cache_dir / 'ccache'))
+        # Build directories have random names, so hash paths relative to them
+        os.environ.setdefault('CCACHE_BASEDIR', tempfile.gettempdir())
+    else:
+        os.environ.setdefault('SCCACHE_DIR', str(cache_dir / 'sccache'))
+
+    wrapper_dir = cache_dir / 'compiler-wrappers' / tool
+    wrapper_dir.mkdir(parents=True, exist_ok=True)
+    for var, comp in sys_info['compilers'].items():
+        comp_path = which(comp)
+        if comp_path is None:
+            continue
+
+        wrapper_path = wrapper_dir / comp
+        tmp_path = wrapper_dir / f'.{comp}.{os.getpid()}'
+        tmp_path.write_text(f'#!/bin/sh\nexec "{tool_path}" "{comp_path}" "$@"\n')
+        tmp_path.chmod(0o755)
+        os.replace(tmp_path, wrapper_path)
+        os.environ[var] = str(wrapper_path)
+
+    print(f'Using {code(tool_path)} to cache compiler output')
+
+def show_compiler_cache_stats():
+    """ Print the hit/miss statistics of the compiler cache, if one was used. """
+    if sys_info['compiler_cache_cmd'] is None:
+        return
+
+    announce('Compiler cache statistics')
+    result = run_cmd(cmd_list=[sys_info['compiler_cache_cmd'], '--show-stats'], raise_error=False,
+                     capture=True)
+    if result is not None and opts['verbose'] is False:
+        print(result.stdout)
 
 def finish_setup():
     """ Finalize settings based on provided options and environment state. """
+    probes = {}
     if opts['intel_compiler_suite'] is True:
         select_intel_compilers()
     else:
         select_gnu_compilers()
+        probes['Checking gcc version'] = check_gcc_version
+
+    if sys_info['check_conda_forge'] is True:
+        probes['Checking for conda-forge'] = check_conda_forge
+
+    errors = run_probes(probes)
+    if len(errors) > 0:
+        for err in errors:
+            print(err)
+
+        exit(1)
+
+    if opts['linear_solver'] == 'auto':
+        if opts['include_ipopt'] is False:
+            raise RuntimeError('--linear-solver=auto selects the linear solver for IPOPT, so it cannot be used with -o.')
+        if opts['hsl_tar_file'] is None:
+            print(f'{yellow("NOTE")}: Only MUMPS is available without --hsl-tar-file, so it will be used.')
+            opts['linear_solver'] = 'mumps'
+
+    if opts['linear_solver'] in ['hsl', 'mumps+hsl'] and opts['hsl_tar_file'] is None:
+        raise RuntimeError(f"--linear-solver={opts['linear_solver']} requires the HSL source from --hsl-tar-file.")
 
     # Determine whether any compiling will actually be performed
     opts['compile_required'] = opts['build_pyoptsparse'] is True or \
@@ -1210,10 +5221,52 @@ def finish_setup():
     if opts['hsl_tar_file'] is not None:
         opts['hsl_tar_file'] = str(Path(opts['hsl_tar_file']).resolve())
 
+    # Only the packages built from source can be installed into other environments
+    conda_keys = get_conda_keys()
+    if len(opts['extra_prefixes']) > 0 and len(conda_keys) > 0:
+        raise RuntimeError(f"{', '.join(k.upper() for k in conda_keys)} would be installed with conda, "
+                           "which can't be shared with --extra-prefix. Use -f or -e to build "
+                           "everything from source.")
+
+    # The wheels built here can only be installed in environments with the same Python
+    for target in opts['extra_prefixes']:
+        python_path = Path(target) / 'bin' / 'python'
+        if not python_path.is_file():
+            raise RuntimeError(f'{target} is not a Python environment, {python_path} was not found.')
+        result = run_cmd([str(python_path), '-c', 'import platform; print(platform.python_version())'],
+                         capture=True)
+        if parse(result.stdout.strip()).release[:2] != parse(platform.python_version()).release[:2]:
+            raise RuntimeError(f'{target} has Python {result.stdout.strip()}, but packages will '
+                               f'be built with Python {platform.python_version()}.')
+
+    if opts['pgo'] is True:
+        if opts['intel_compiler_suite'] is True:
+            raise RuntimeError('--pgo is only supported with the GNU compilers.')
+        if opts['include_ipopt'] is False:
+            raise RuntimeError('--pgo uses the IPOPT tests to collect a profile, so it cannot be used with -o.')
+        if opts['artifact_cache'] is True:
+            # The cache key doesn't cover the collected profile
+            print(f'{yellow("NOTE")}: Not using the artifact cache with --pgo.')
+            opts['artifact_cache'] = False
+
+    if opts['offline'] is True and opts['compile_required'] is True:
+        check_offline_sources()
+
+    if opts['compiler_cache'] is not None and opts['compile_required'] is True:
+        select_compiler_cache()
+
+    # Find the directory once here, instead of in every task
+    if opts['configure_cache'] is True and opts['compile_required'] is True:
+        print(f'Using configure cache {code(subst_env_for_path(str(get_configure_cache_dir())))}')
+
+    if opts['include_ipopt'] is True and opts['compile_required'] is True:
+        select_blas()
+
     display_environment()
 
     if opts['check_sanity']:
-        check_sanity()
+        with trace_phase('sanity checks', 'setup'):
+            check_sanity()
 
 def install_conda_scripts(var_name:str, lib_dir:Path):
     """
@@ -1269,8 +5322,12 @@ Run {code(f'source {subst_env_for_path(act_file_name)}')} to set it now.
 
 def post_build_success():
     """ Announce successful build and print some instructions. """
+    show_compiler_cache_stats()
     announce("The pyOptSparse build is complete")
 
+    if sys_info['blas'] is not None:
+        report_blas_linkage()
+
     lib_dir = Path(opts['prefix']) / 'lib'
     if sys_info['sys_name'] == 'Darwin':
         var_name = 'DYLD_LIBRARY_PATH'
@@ -1290,14 +5347,396 @@ Otherwise, you may encounter errors such as:
  "pyOptSparse Error: There was an error importing the compiled IPOPT module"
 """)
 
+    if opts['linear_solver'] in ['mumps+hsl', 'auto'] and opts['include_ipopt'] is True:
+        print(f"{yellow('NOTE')}: IPOPT loads HSL at run time. Choose the linear solver with its "
+              f"{code('linear_solver')} option: mumps, ma27, ma57, ma77, ma86, or ma97.\n")
+
     announce('SUCCESS!')
     exit(0)
 
+# Runs one benchmark case in the Python environment pyOptSparse is installed in, and
+# prints the measurements as JSON. Each case gets its own process so the peak RSS is
+# its own.
+bench_worker_src = r"""import json
+import re
+import resource
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+from pyoptsparse import OPT, Optimization
+
+case = json.loads(sys.argv[1])
+n = case['size']
+out_file = str(Path(case['work_dir']) / f"{case['optimizer']}.out")
+
+def peak_rss_mib():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 2**20 if sys.platform == 'darwin' else rss / 2**10
+
+def control_problem():
+    # Discretized optimal control with nonlinear dynamics: banded equality constraints
+    h = 1.0 / n
+    rows = np.arange(n)
+    jac_u = {'coo': [rows, rows, np.full(n, -h)], 'shape': [n, n]}
+
+    def jac_x(x):
+        return {'coo': [np.concatenate([rows, rows]), np.concatenate([rows + 1, rows]),
+                        np.concatenate([np.ones(n), 3 * h * x[:-1]**2 - 1])], 'shape': [n, n + 1]}
+
+    def objfunc(xdict):
+        x, u = xdict['x'], xdict['u']
+        return {'obj': h * (x @ x + u @ u), 'dyn': x[1:] - x[:-1] - h * (u - x[:-1]**3)}, False
+
+    def sens(xdict, funcs):
+        x, u = xdict['x'], xdict['u']
+        return {'obj': {'x': 2 * h * x, 'u': 2 * h * u}, 'dyn': {'x': jac_x(x), 'u': jac_u}}, False
+
+    lower = np.full(n + 1, -10.0)
+    upper = np.full(n + 1, 10.0)
+    lower[0] = upper[0] = 1.0
+    prob = Optimization('control', objfunc)
+    prob.addVarGroup('x', n + 1, 'c', value=1.0, lower=lower, upper=upper)
+    prob.addVarGroup('u', n, 'c', value=0.0, lower=-10.0, upper=10.0)
+    prob.addConGroup('dyn', n, lower=0.0, upper=0.0, wrt=['x', 'u'],
+                     jac={'x': jac_x(np.ones(n + 1)), 'u': jac_u})
+    prob.addObj('obj')
+    return prob, sens
+
+def rosenbrock_problem():
+    # Chained Rosenbrock with an inequality constraint on each neighboring pair
+    rows = np.arange(n - 1)
+
+    def jac(x):
+        return {'coo': [np.concatenate([rows, rows]), np.concatenate([rows, rows + 1]),
+                        np.concatenate([2 * x[:-1], 2 * x[1:]])], 'shape': [n - 1, n]}
+
+    def objfunc(xdict):
+        x = xdict['x']
+        r = x[1:] - x[:-1]**2
+        return {'obj': 100 * r @ r + (1 - x[:-1]) @ (1 - x[:-1]), 'pair': x[:-1]**2 + x[1:]**2}, False
+
+    def sens(xdict, funcs):
+        x = xdict['x']
+        r = x[1:] - x[:-1]**2
+        g = np.zeros(n)
+        g[:-1] = -400 * x[:-1] * r - 2 * (1 - x[:-1])
+        g[1:] += 200 * r
+        return {'obj': {'x': g}, 'pair': {'x': jac(x)}}, False
+
+    prob = Optimization('rosenbrock', objfunc)
+    prob.addVarGroup('x', n, 'c', value=0.5, lower=-5.0, upper=5.0)
+    prob.addConGroup('pair', n - 1, upper=1.5, wrt=['x'], jac={'x': jac(np.full(n, 0.5))})
+    prob.addObj('obj')
+    return prob, sens
+
+max_iter = case['max_iter']
+options = {
+    'IPOPT': {'print_level': 0, 'output_file': out_file, 'file_print_level': 5,
+              'print_timing_statistics': 'yes', 'max_iter': max_iter},
+    'SLSQP': {'IPRINT': 1, 'IFILE': out_file, 'MAXIT': max_iter},
+    'SNOPT': {'Print file': out_file, 'Summary file': out_file + '.summary',
+              'Major iterations limit': max_iter},
+    'ParOpt': {'output_file': out_file}
+}[case['optimizer']]
+if case['optimizer'] == 'IPOPT' and case['linear_solver'] is not None:
+    options['linear_solver'] = case['linear_solver']
+
+prob, sens = {'control': control_problem, 'rosenbrock': rosenbrock_problem}[case['problem']]()
+try:
+    opt = OPT(case['optimizer'], options=options)
+except Exception as e:
+    # pyOptSparse raises an error here if the optimizer wasn't built
+    print(json.dumps({'status': 'unavailable', 'error': str(e).strip()}))
+    sys.exit(0)
+
+baseline_rss = peak_rss_mib()
+start = time.perf_counter()
+sol = opt(prob, sens=sens)
+solve_seconds = time.perf_counter() - start
+
+log = Path(out_file).read_text(errors='replace') if Path(out_file).is_file() else ''
+iter_pattern = {'IPOPT': r'Number of Iterations\.*:\s*(\d+)',
+                'SNOPT': r'No\. of major iterations\s+(\d+)'}.get(case['optimizer'])
+match = re.search(iter_pattern, log) if iter_pattern is not None else None
+# Without a count in the optimizer's output, each gradient evaluation is an iteration
+iterations = int(match.group(1)) if match is not None else int(sol.userSensCalls)
+# IPOPT's timing statistics, by wall time
+timing = {name: float(wall) for name, wall in
+          re.findall(r'^\s*(\w+)\.*:\s*[\d.]+ \(sys:\s*[\d.]+ wall:\s*([\d.]+)\)', log, re.M)}
+
+print(json.dumps({
+    'status': 'ok',
+    'inform': {'value': int(sol.optInform['value']), 'text': str(sol.optInform['text'])}
+              if sol.optInform else None,
+    'objective': float(sol.fStar),
+    'iterations': iterations,
+    'function_evals': int(sol.userObjCalls),
+    'gradient_evals': int(sol.userSensCalls),
+    'solve_seconds': solve_seconds,
+    'seconds_per_iteration': solve_seconds / max(1, iterations),
+    # Not every linear solver interface times its numerical factorization separately, so
+    # the time spent in the linear solver altogether is recorded too
+    'factorization_seconds': timing.get('LinearSystemSymbolicFactorization', 0) + timing['LinearSystemFactorization']
+                             if 'LinearSystemFactorization' in timing else None,
+    'linear_solver_seconds': timing.get('StdAugSystemSolverMultiSolve'),
+    'peak_rss_mib': peak_rss_mib(),
+    'baseline_rss_mib': baseline_rss
+}))
+"""
+
+# The scalable problems in the benchmark suite, and the optimizers they're solved with
+bench_problems = ['control', 'rosenbrock']
+bench_optimizers = ['IPOPT', 'SLSQP', 'SNOPT', 'ParOpt']
+
+# Optimizers that use dense linear algebra, with the largest problem size they're given
+bench_max_size = {'SLSQP': 1000}
+
+def process_bench_command_line(argv:list)->argparse.Namespace:
+    """
+    Parse the arguments of the bench command, or print usage and exit.
+
+    Parameters
+    ----------
+    argv : list
+        The command line arguments after 'bench'.
+
+    Returns
+    -------
+    argparse.Namespace
+        The parsed arguments.
+    """
+    parser = argparse.ArgumentParser(
+        prog='build_pyoptsparse bench',
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        description='''
+    Benchmark the installed pyOptSparse optimizers with a suite of scalable sparse
+    NLPs, and write the measurements to a JSON file that can be compared with one
+    from another build or machine. Optimizers that weren't built are skipped.
+            ''',
+        epilog='''
+    Examples:
+    build_pyoptsparse bench
+    build_pyoptsparse bench --sizes 1000 100000 --optimizer IPOPT --linear-solver ma57
+    build_pyoptsparse bench -o new.json --baseline old.json
+    '''
+    )
+    parser.add_argument("-b", "--baseline",
+                        help="Compare with results previously written with --output, and exit \
+                              with status 1 if any case got slower.")
+    parser.add_argument("-l", "--linear-solver",
+                        help="The linear solver for IPOPT to use. Default: IPOPT's default")
+    parser.add_argument("--max-iter",
+                        help="Iteration limit of each optimization. Default: 3000",
+                        type=int,
+                        default=3000)
+    parser.add_argument("-o", "--output",
+                        help="Write the results to this JSON file. Default: pyoptsparse-bench.json",
+                        default='pyoptsparse-bench.json')
+    parser.add_argument("--optimizer",
+                        help="Optimizer to benchmark, can be repeated. Default: all",
+                        action="append",
+                        choices=bench_optimizers)
+    parser.add_argument("-p", "--prefix",
+                        help=f"Where the solver libraries were installed. Default: {opts['prefix']}",
+                        default=opts['prefix'])
+    parser.add_argument("--problem",
+                        help="Problem to solve, can be repeated. Default: all",
+                        action="append",
+                        choices=bench_problems)
+    parser.add_argument("--python",
+                        help="Python interpreter pyOptSparse is installed for. Default: python",
+                        default='python')
+    parser.add_argument("-s", "--sizes",
+                        help="Problem sizes to sweep. Default: 100 1000 10000",
+                        nargs='+',
+                        type=int,
+                        default=[100, 1000, 10000])
+    parser.add_argument("-t", "--threshold",
+                        help="Allowed slowdown relative to the baseline. Default: 0.2",
+                        type=float,
+                        default=0.2)
+    parser.add_argument("--timeout",
+                        help="Seconds each case is allowed to run. Default: 600",
+                        type=float,
+                        default=600)
+
+    return parser.parse_args(argv)
+
+def run_bench_case(case:dict, python_cmd:str, env:dict, timeout:float)->dict:
+    """
+    Solve one benchmark problem in a separate process.
+
+    Parameters
+    ----------
+    case : dict
+        The problem, size, optimizer, and options to use.
+    python_cmd : str
+        The Python interpreter to run it with.
+    env : dict
+        The environment of the process.
+    timeout : float
+        Seconds to wait before giving up.
+
+    Returns
+    -------
+    dict
+        The case with its measurements, or the reason it didn't finish.
+    """
+    result = dict(case)
+    with tempfile.TemporaryDirectory() as work_dir:
+        cmd_list = [python_cmd, '-c', bench_worker_src, json.dumps({**case, 'work_dir': work_dir})]
+        try:
+            proc = subprocess.run(cmd_list, cwd=work_dir, env=env, capture_output=True, text=True,
+                                  errors='replace', timeout=timeout, check=False)
+        except subprocess.TimeoutExpired:
+            result.update({'status': 'timeout', 'error': f'Did not finish in {timeout:g} seconds'})
+            return result
+
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or len(lines) == 0:
+        error_lines = proc.stderr.strip().splitlines()
+        result.update({'status': 'failed', 'error': error_lines[-1] if error_lines else
+                       f'Exited with status {proc.returncode}'})
+        return result
+
+    result.update(json.loads(lines[-1]))
+    return result
+
+def compare_bench(results:list, baseline_file:str, threshold:float)->list:
+    """
+    Find the cases that got slower than in a previous benchmark run.
+
+    Parameters
+    ----------
+    results : list
+        The results of this run.
+    baseline_file : str
+        The JSON file written by the previous run.
+    threshold : float
+        The allowed fractional increase in time per iteration.
+
+    Returns
+    -------
+    list
+        A description of each slower case.
+    """
+    with open(baseline_file, encoding='utf-8') as f:
+        baseline = {(r['optimizer'], r['problem'], r['size']): r for r in json.load(f)['results']}
+
+    regressions = []
+    for result in results:
+        old = baseline.get((result['optimizer'], result['problem'], result['size']))
+        if old is None or old['status'] != 'ok' or result['status'] != 'ok':
+            continue
+
+        ratio = result['seconds_per_iteration'] / max(old['seconds_per_iteration'], 1e-9)
+        if ratio > 1 + threshold:
+            regressions.append(f"{result['optimizer']} {result['problem']} n={result['size']}: "
+                               f"{ratio:.2f}x the time per iteration")
+    return regressions
+
+def perform_bench(argv:list):
+    """
+    Run the benchmark suite against the installed pyOptSparse and write the results.
+
+    Parameters
+    ----------
+    argv : list
+        The command line arguments after 'bench'.
+    """
+    initialize()
+    args = process_bench_command_line(argv)
+    opts['prefix'] = args.prefix
+
+    env = dict(os.environ)
+    var_name = 'DYLD_LIBRARY_PATH' if sys_info['sys_name'] == 'Darwin' else 'LD_LIBRARY_PATH'
+    lib_dir = str(Path(opts['prefix']) / 'lib')
+    env[var_name] = os.pathsep.join([lib_dir] + ([env[var_name]] if env.get(var_name) else []))
+
+    announce('Benchmarking the pyOptSparse optimizers')
+    results = []
+    unavailable = set()
+    for optimizer in args.optimizer or bench_optimizers:
+        for problem in args.problem or bench_problems:
+            for size in args.sizes:
+                case = {'optimizer': optimizer, 'problem': problem, 'size': size,
+                        'linear_solver': args.linear_solver, 'max_iter': args.max_iter}
+                if optimizer in unavailable:
+                    continue
+                note(f'{optimizer} {problem} n={size}')
+                if size > bench_max_size.get(optimizer, size):
+                    results.append({**case, 'status': 'skipped',
+                                    'error': f'Larger than {bench_max_size[optimizer]} for a dense optimizer'})
+                    note_result(yellow('skipped, too large for a dense optimizer'))
+                    continue
+
+                result = run_bench_case(case, args.python, env, args.timeout)
+                results.append(result)
+                if result['status'] == 'ok':
+                    note_result(f"{green('OK')} {result['iterations']} iterations, "
+                                f"{result['seconds_per_iteration'] * 1e3:.2f} ms/iteration, "
+                                f"{result['peak_rss_mib']:.0f} MiB")
+                elif result['status'] == 'unavailable':
+                    note_result(yellow('not built'))
+                    unavailable.add(optimizer)
+                else:
+                    note_failed()
+                    print(f"{red('ERROR')}: {result['error']}")
+
+    builds = {}
+    for build_key in build_info:
+        entry = get_manifest_entry(build_key)
+        if entry is not None:
+            builds[build_key] = {k: entry[k] for k in ['branch', 'build_id', 'installed']}
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump({
+            'format': 1,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'host': {
+                'node': platform.node(),
+                'sys_name': sys_info['sys_name'],
+                'machine': platform.machine(),
+                'cpu_count': os.cpu_count()
+            },
+            'prefix': opts['prefix'],
+            'builds': builds,
+            'settings': {
+                'python': args.python,
+                'threads': {var: os.environ.get(var) for var in
+                            ['OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS']}
+            },
+            'results': results
+        }, f, indent=2)
+    print(f'Results written to {code(args.output)}')
+
+    if args.baseline is not None:
+        regressions = compare_bench(results, args.baseline, args.threshold)
+        for reg in regressions:
+            print(f"{yellow('REGRESSION')}: {reg}")
+        if len(regressions) > 0:
+            exit(1)
+
+    exit(0)
+
 def perform_install():
     """ Initiate all the required actions in the script. """
+    if sys.argv[1:2] == ['bench']:
+        perform_bench(sys.argv[2:])
+
     process_command_line()
     initialize()
 
+    if opts['show_installed']:
+        show_installed()
+        exit(0)
+
+    if opts['from_bundle'] is not None:
+        install_bundle(opts['from_bundle'])
+        post_build_success()
+
     if opts['uninstall']:
         announce('Uninstalling pyOptSparse and related packages')
         print(f'{yellow("NOTE:")} Some items may be listed even if not installed.')
@@ -1305,17 +5744,42 @@ def perform_install():
         uninstall_built()
         exit(0)
 
-    finish_setup()
+    try:
+        finish_setup()
 
-    announce('Beginning installation')
+        announce('Beginning installation')
+        start_build_logs()
 
-    if opts['linear_solver'] == 'mumps':
-        install_with_mumps()
-        install_pyoptsparse_from_src()
-    elif opts['linear_solver'] == 'pardiso':
-        install_with_pardiso()
-    elif opts['linear_solver'] == 'hsl':
-        install_with_hsl()
+        # The pyOptSparse source is cloned and built by separate tasks, so create its
+        # directory here. It's left in place if pyOptSparse itself won't be built.
+        if opts['build_root'] is None:
+            pos_build_dir, pos_dir_name = make_build_dir(opts['build_pyoptsparse'])
+        else:
+            pos_dir_name = str(get_build_tree_path('pyoptsparse'))
+        # Keep the wheels of the Python packages if they're installed later or bundled
+        if opts['staged_install'] or opts['export_bundle'] is not None or \
+                len(opts['extra_prefixes']) > 0:
+            sys_info['wheel_dir'] = tempfile.mkdtemp(prefix='build_pyoptsparse-wheels-')
+        if opts['staged_install']:
+            start_staged_install()
+        if opts['pgo'] is True:
+            run_pgo_training(pos_dir_name)
+        run_task_graph(build_task_graph(pos_dir_name))
+        if opts['staged_install']:
+            commit_staged_install()
+        if opts['export_bundle'] is not None:
+            export_bundle(opts['export_bundle'])
+        for target in opts['extra_prefixes']:
+            install_into_extra_prefix(target)
+    finally:
+        if sys_info['stage_root'] is not None:
+            discard_staged_install()
+        if sys_info['wheel_dir'] is not None:
+            shutil.rmtree(sys_info['wheel_dir'], ignore_errors=True)
+
+        # Write the trace even if the build failed, to see how far it got
+        if opts['trace_file'] is not None:
+            write_trace()
 
     post_build_success()
 